@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+import chat_engine
+import server_manager
+from config import load_config
+from database import initialize_database
+from fact_learner import start_fact_learner, stop_fact_learner
+from message_handlers import handle_message
+from stub_llm import install_stub_llm
+
+SYNTHETIC_MESSAGES = [
+    "What is your favorite food?",
+    "Who is the greatest king in history?",
+    "What do you think of democracy?",
+    "Have you watched any good shows lately?",
+    "How is your horse Thunder doing?",
+    "What would you do with a million dollars?",
+    "Which instrument sounds the best?",
+    "What do you think of England?",
+]
+
+class FakeSentMessage:
+    """Stands in for a message the bot posted, so streamed replies can edit it."""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content: str):
+        self.content = content
+        self.edits += 1
+
+    async def delete(self):
+        self.content = None
+
+class FakeChannel:
+    """Stands in for discord.TextChannel, recording what the bot sends."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.sent = []
+
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+    async def send(self, content: str):
+        sent_message = FakeSentMessage(content)
+        self.sent.append(sent_message)
+        return sent_message
+
+class FakeMessage:
+    """Stands in for discord.Message with just the attributes the handlers read."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, content: str, author, channel: FakeChannel, guild, mentions: list):
+        self.id = next(FakeMessage._ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.mentions = mentions
+        self.mention_everyone = False
+
+    async def reply(self, content: str):
+        return await self.channel.send(content)
+
+def load_traffic(path: str) -> list:
+    """
+    Reads message texts from a requests.jsonl style file.
+    Each line is a JSON object; "content", "body" or "title" is used as the message text.
+    """
+    messages = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record.get('content') or record.get('body') or record.get('title')
+            if text:
+                messages.append(text)
+    return messages
+
+def percentile(values: list, percent: float) -> float:
+    """Returns the given percentile of a list of numbers using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+def deep_size(obj, seen: set = None) -> int:
+    """Approximates the memory held by an object and everything it references."""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(vars(obj), seen)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+async def monitor_loop_lag(samples: list, interval: float = 0.05) -> None:
+    """Measures how late the event loop wakes up from a sleep, until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+async def simulate_guild(guild_id: int, messages: list, args, client, config, facts_collection, logger, latencies: list) -> None:
+    """Replays one guild's traffic: a question of the day followed by mentions of the bot."""
+    guild = SimpleNamespace(id=guild_id, name=f"Guild {guild_id}")
+    channel = FakeChannel(config['bot']['channel_name'])
+
+    for index in range(args.messages_per_guild):
+        text = messages[(guild_id + index) % len(messages)]
+        author = SimpleNamespace(display_name=f"user{random.randint(1, 50)}")
+        if index == 0:
+            message = FakeMessage(f"QOTD: {text}", author, channel, guild, [])
+        else:
+            message = FakeMessage(f"<@{client.user.id}> {text}", author, channel, guild, [client.user])
+
+        start = time.perf_counter()
+        await handle_message(message, client, config, facts_collection, logger)
+        latencies.append(time.perf_counter() - start)
+
+        await asyncio.sleep(random.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+
+async def run_benchmark(args, config: dict) -> dict:
+    """Runs the simulated guilds against the real handlers and collects the measurements."""
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    facts_collection = None
+    if not args.no_facts:
+        facts_collection = initialize_database(config)
+
+    # Time every fact retrieval the engine makes
+    query_times = []
+    choose_relevant_facts = chat_engine.choose_relevant_facts
+    def timed_choose_relevant_facts(*query_args):
+        start = time.perf_counter()
+        try:
+            return choose_relevant_facts(*query_args)
+        finally:
+            query_times.append(time.perf_counter() - start)
+    chat_engine.choose_relevant_facts = timed_choose_relevant_facts
+
+    server_manager.init_state_store(config)
+    start_fact_learner(config, facts_collection, logger)
+
+    client = SimpleNamespace(user=SimpleNamespace(id=1, name="Monarch"))
+    messages = load_traffic(args.traffic) if args.traffic else SYNTHETIC_MESSAGES
+
+    latencies = []
+    lag_samples = []
+    lag_monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+
+    tracemalloc.start()
+    servers_size_before = deep_size(server_manager.servers)
+    start = time.perf_counter()
+
+    await asyncio.gather(*[
+        simulate_guild(guild_id, messages, args, client, config, facts_collection, logger, latencies)
+        for guild_id in range(1, args.guilds + 1)
+    ])
+
+    elapsed = time.perf_counter() - start
+    servers_size_after = deep_size(server_manager.servers)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lag_monitor.cancel()
+    await stop_fact_learner(config, logger)
+    await server_manager.close_state_store(logger)
+
+    return {
+        "guilds": args.guilds,
+        "messages": len(latencies),
+        "elapsed_seconds": elapsed,
+        "messages_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "handler_latency_ms": _summarise_ms(latencies),
+        "event_loop_lag_ms": _summarise_ms(lag_samples),
+        "fact_query_ms": _summarise_ms(query_times),
+        "servers_bytes_before": servers_size_before,
+        "servers_bytes_after": servers_size_after,
+        "servers_bytes_per_guild": (servers_size_after - servers_size_before) / max(args.guilds, 1),
+        "peak_traced_memory_bytes": peak_memory,
+    }
+
+def _summarise_ms(samples: list) -> dict:
+    """Summarises durations in seconds as milliseconds."""
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50) * 1000,
+        "p95": percentile(samples, 95) * 1000,
+        "p99": percentile(samples, 99) * 1000,
+        "max": max(samples) * 1000 if samples else 0.0,
+    }
+
+def print_report(results: dict) -> None:
+    """Prints benchmark results as a readable table."""
+    print(f"Guilds: {results['guilds']}  Messages: {results['messages']}  "
+          f"Elapsed: {results['elapsed_seconds']:.2f}s  Throughput: {results['messages_per_second']:.1f} msg/s")
+    for name in ("handler_latency_ms", "event_loop_lag_ms", "fact_query_ms"):
+        stats = results[name]
+        print(f"{name:<20} n={stats['count']:<6} p50={stats['p50']:8.2f}  p95={stats['p95']:8.2f}  "
+              f"p99={stats['p99']:8.2f}  max={stats['max']:8.2f}")
+    print(f"server_manager.servers: {results['servers_bytes_before']} -> {results['servers_bytes_after']} bytes "
+          f"({results['servers_bytes_per_guild']:.0f} bytes/guild)")
+    print(f"Peak traced memory: {results['peak_traced_memory_bytes'] / 1024 / 1024:.1f} MiB")
+
+def main():
+    """Command line entry point for the offline load test."""
+    parser = argparse.ArgumentParser(description="Replay synthetic or recorded traffic through handle_message with a stub LLM.")
+    parser.add_argument("--config", default="config.yaml", help="configuration file")
+    parser.add_argument("--traffic", help="requests.jsonl style file of messages to replay")
+    parser.add_argument("--guilds", type=int, default=50, help="number of simulated guilds")
+    parser.add_argument("--messages-per-guild", type=int, default=5, help="messages sent in each guild, starting with a QOTD")
+    parser.add_argument("--think-time", type=float, default=0.1, help="mean seconds between messages in a guild")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean stub LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="stub LLM latency standard deviation")
+    parser.add_argument("--max-responses", type=int, help="override bot.max_responses_per_day")
+    parser.add_argument("--no-facts", action="store_true", help="skip ChromaDB fact retrieval")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    traffic_path = os.path.abspath(args.traffic) if args.traffic else None
+    json_path = os.path.abspath(args.json) if args.json else None
+    args.traffic = traffic_path
+
+    config = load_config(args.config)
+    # Benchmarks never touch the real fact, revision or state databases
+    config['database']['path'] = tempfile.mkdtemp(prefix="monarch-bench-")
+    config.setdefault('fact_versions', {})['path'] = os.path.join(config['database']['path'], "fact_versions.sqlite3")
+    config.setdefault('state', {})['backend'] = "memory"
+    if args.max_responses is not None:
+        config['bot']['max_responses_per_day'] = args.max_responses
+
+    install_stub_llm(args.llm_latency, args.llm_jitter)
+    results = asyncio.run(run_benchmark(args, config))
+    print_report(results)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import math
+import os
+import time
+import discord
+from config_reload import LiveConfig, register_reload_hook, run_config_watcher, start_admin_server
+from daily_scheduler import configure_timezones, run_daily_scheduler
+from database import (
+    initialize_database,
+    refresh_fact_indexes,
+    warm_up_database,
+    apply_pending_revisions,
+    compact_fact_versions,
+    close_fact_versions,
+    open_persona_collections,
+    persona_collections
+)
+from fact_learner import start_fact_learner, stop_fact_learner
+from llm_provider import configure_providers, warm_up_llm
+from log_pipeline import configure_sampling, stop_log_pipeline
+from metrics import configure_metrics, start_metrics_server
+from personas import all_personas, configure_personas
+from prompt_builder import precompute_daily_contexts
+from server_manager import init_state_store, run_state_flusher, close_state_store, rollover_servers, servers
+from trigger_matcher import clear_matchers
+from utils import setup_logging, configure_executor, run_blocking
+from message_handlers import handle_message, on_ready_handler
+
+def build_client(shard_ids: list = None, shard_count: int = None) -> discord.Client:
+    """
+    Creates the Discord client. With a shard count, an AutoShardedClient runs the given shards in this process.
+    Args:
+        shard_ids: shards this process should run, or None for all of them
+        shard_count: total number of shards across every process, or None to not shard
+    """
+    intents = discord.Intents.default()
+    intents.message_content = True
+
+    if shard_count:
+        return discord.AutoShardedClient(intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+    return discord.Client(intents=intents)
+
+async def report_shard_health(client, shard_status, worker_index: int, interval: float) -> None:
+    """Publishes the state of every shard this process runs to the supervisor until cancelled."""
+    while True:
+        guild_counts = {}
+        for guild in client.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+
+        for shard_id, shard in client.shards.items():
+            latency = shard.latency
+            shard_status[shard_id] = {
+                "worker": worker_index,
+                "pid": os.getpid(),
+                "ready": not shard.is_closed(),
+                "latency_ms": None if math.isinf(latency) or math.isnan(latency) else round(latency * 1000, 1),
+                "guilds": guild_counts.get(shard_id, 0),
+                "servers_loaded": len(servers),
+                "updated_at": time.time(),
+            }
+        await asyncio.sleep(interval)
+
+async def run_fact_index_refresher(config: dict, logger = None) -> None:
+    """
+    Reloads the in-memory fact indexes on a timer until cancelled.
+    Only needed when other processes write to a shared fact server, since local writes refresh the index directly.
+    """
+    interval = config['database'].get('index_refresh_interval', 30)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_blocking(refresh_fact_indexes)
+        except Exception as e:
+            if logger:
+                logger.error("Error refreshing fact index: %s", e)
+
+async def run_fact_version_applier(config: dict, facts_collection, logger = None) -> None:
+    """Applies recorded fact revisions to every persona's collection in batches, and compacts the logs, until cancelled."""
+    versions_config = config.get('fact_versions', {})
+    interval = versions_config.get('apply_interval', 60)
+    compact_interval = versions_config.get('compact_interval', 86400)
+    next_compaction = time.monotonic() + compact_interval
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for collection in persona_collections() or [facts_collection]:
+                await run_blocking(apply_pending_revisions, collection, logger)
+            if time.monotonic() >= next_compaction:
+                next_compaction = time.monotonic() + compact_interval
+                await run_blocking(compact_fact_versions, versions_config.get('keep_revisions', 20), logger)
+        except Exception as e:
+            if logger:
+                logger.error("Error applying fact revisions: %s", e)
+
+async def warm_up(facts_collection, logger = None) -> None:
+    """Loads litellm, the fact database and the embedding model on the worker pool while Discord connects."""
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(run_blocking(warm_up_llm), run_blocking(warm_up_database, facts_collection))
+    except Exception as e:
+        # Whatever failed here is retried, and reported, by the first message that needs it
+        if logger:
+            logger.error("Error during startup warm-up: %s", e)
+        return
+    if logger:
+        logger.info("Warm-up finished in %.2fs", time.perf_counter() - start)
+
+def roll_over_day(timezones: set, logger = None) -> None:
+    """Midnight rollover: resets the day for every server in the given timezones and pre-renders their prompts."""
+    start = time.perf_counter()
+    unrest_levels = rollover_servers(timezones)
+    rendered = sum(precompute_daily_contexts(timezone_name, levels, all_personas()) for timezone_name, levels in unrest_levels.items())
+    if logger:
+        logger.info("Daily rollover for %s: %s prompt contexts pre-rendered in %.3fs", ', '.join(sorted(timezones)), rendered, time.perf_counter() - start)
+
+def reload_personas(config: dict) -> list:
+    """
+    Reloads every persona and its prompt file, and gives new personas a collection.
+    Returns:
+        The personas whose prompts or settings changed, for the reload report
+    """
+    before = {persona.name: persona for persona in all_personas()}
+    configure_personas(config)
+    open_persona_collections(config)
+    return [f"persona {persona.name}" for persona in all_personas() if before.get(persona.name) != persona]
+
+def register_config_reload(logger) -> None:
+    """Rebuilds the structures derived from the config when a reload changes the settings they are built from."""
+    # Personas go first: a missing or broken prompt file is the likeliest reason to reject a reload
+    register_reload_hook((), reload_personas)
+    register_reload_hook(("triggers",), lambda config: clear_matchers())
+    register_reload_hook(("llm.model", "llm.providers", "llm.fallback", "llm.circuit_breaker", "llm.web_search"), configure_providers)
+    register_reload_hook(("bot.timezone", "bot.guild_timezones"), configure_timezones)
+    register_reload_hook(("metrics.trace",), configure_metrics)
+    register_reload_hook(("logging.level",), lambda config: logger.setLevel(config['logging'].get('level', 'INFO')))
+    register_reload_hook(("logging.sampling",), lambda config: configure_sampling(config['logging'].get('sampling')))
+
+async def run_bot(client, token: str, config: dict, facts_collection, logger, shard_status = None, worker_index: int = 0, live_config = None):
+    """Runs the Discord client alongside the background workers, draining them on shutdown."""
+    async with client:
+        start_fact_learner(config, facts_collection, logger)
+        background_tasks = [
+            asyncio.create_task(warm_up(facts_collection, logger)),
+            asyncio.create_task(run_state_flusher(config, logger)),
+            asyncio.create_task(run_daily_scheduler(lambda timezones: roll_over_day(timezones, logger), logger))
+        ]
+        if shard_status is not None:
+            interval = config.get('sharding', {}).get('health_interval', 15)
+            background_tasks.append(asyncio.create_task(report_shard_health(client, shard_status, worker_index, interval)))
+        if config.get('fact_versions', {}).get('enabled', False):
+            background_tasks.append(asyncio.create_task(run_fact_version_applier(config, facts_collection, logger)))
+        if config['database'].get('host') and config['database'].get('in_memory_index', False):
+            background_tasks.append(asyncio.create_task(run_fact_index_refresher(config, logger)))
+        admin_server = None
+        if live_config is not None:
+            admin_config = config.get('admin', {})
+            if admin_config.get('watch_config', True):
+                prompt_files = lambda: [persona.prompt_file for persona in all_personas()]
+                background_tasks.append(asyncio.create_task(
+                    run_config_watcher(live_config, prompt_files, admin_config.get('watch_interval', 5), logger)
+                ))
+            if admin_config.get('socket_port'):
+                admin_server = await start_admin_server(live_config, admin_config.get('socket_host', '127.0.0.1'), admin_config['socket_port'], logger)
+        metrics_server = await start_metrics_server(config, logger)
+        try:
+            await client.start(token)
+        finally:
+            await stop_fact_learner(config, logger)
+            for task in background_tasks:
+                task.cancel()
+            # Facts learned since the last batch are written before exiting
+            for collection in persona_collections() or [facts_collection]:
+                await run_blocking(close_fact_versions, collection, logger)
+            await close_state_store(logger)
+            if metrics_server:
+                metrics_server.close()
+            if admin_server:
+                admin_server.close()
+
+def run_worker(config: dict, env_vars: dict, shard_ids: list = None, shard_count: int = None, shard_status = None, worker_index: int = 0, config_path: str = None):
+    """
+    Runs one bot process until it is stopped.
+    Args:
+        config: configuration dictionary
+        env_vars: environment variables from get_env_vars
+        shard_ids: shards this process should run, or None for all of them
+        shard_count: total number of shards, or None to not shard
+        shard_status: shared dict the supervisor reads shard health from, or None when unsupervised
+        worker_index: position of this process among the supervisor's workers
+        config_path: absolute path of the config file to reload changes from, or None to never reload
+    """
+    # Setup logging
+    discord.utils.setup_logging()
+    logger = setup_logging(config)
+    configure_metrics(config)
+    configure_timezones(config)
+    configure_personas(config)
+    live_config = LiveConfig(config, config_path) if config_path else None
+    if live_config is not None:
+        register_config_reload(logger)
+
+    # Bounded thread pool for blocking database work, so slow queries never stall the event loop
+    configure_executor(config['bot'].get('worker_threads', 4))
+
+    # Initialize database
+    facts_collection = initialize_database(config)
+    init_state_store(config, logger)
+
+    # Setup Discord client
+    client = build_client(shard_ids, shard_count)
+    if shard_count:
+        logger.info("Worker %s running shards %s of %s", worker_index, shard_ids if shard_ids is not None else 'all', shard_count)
+
+    @client.event
+    async def on_ready():
+        await on_ready_handler(client, logger)
+
+    @client.event
+    async def on_message(message):
+        # The message is handled with the config of the moment it arrived, even if a reload lands while it is answered
+        await handle_message(message, client, live_config.current if live_config else config, facts_collection, logger)
+
+    # Run the bot
+    try:
+        asyncio.run(run_bot(client, env_vars['bot_token'], config, facts_collection, logger, shard_status, worker_index, live_config))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Write out whatever is still queued for the log file
+        stop_log_pipeline()
@@ -1,53 +1,23 @@
-import litellm
-from database import choose_relevant_facts, update_fact
+import asyncio
+import time
+from database import choose_relevant_facts, persona_collection
+from fact_learner import enqueue_fact_job
+from history_manager import count_tokens, record_prompt_tokens, trim_history
+from llm_provider import LLMUnavailableError, complete
+from log_pipeline import FACTS
+from metrics import inc, observe, timed
+from personas import persona_for
+from prompt_builder import build_system_messages
+from reply_format import reasoning_budget, response_token_budget, sanitize_response, truncate_response
+from response_cache import build_cache_key, cache_response, embed_question, get_cached_response
+from streaming import StreamSanitizer, streaming_enabled
 from server_manager import add_to_chat_history
-from utils import today, old_times_today
+from utils import run_blocking
 
-writer_instructions = """
-You are an expert creative writer, specializing in writing character dialogue.
-You weave personality traits and invent personal details seamlessly within dialogue.
-You never write narration, descriptions, or any other text outside of dialogue.
-Always write in character as King Maximilian VII.
+# Sent in place of an empty user turn, e.g. when the king bids farewell unprompted
+EMPTY_TURN_PLACEHOLDER = "..."
 
-The public unrest is building, representated by the peasant unrest percentage.
-0% means the peasants are in their homes and the king does not think about them. The king will respond to questions and reminisce about previous experiences and what he has been doing recently.
-50% would mean there are protests in the streets, but there is no violence or riots. The king will respond to questions, but also may mention the unrest in passing and ask for advice.
-90% means riots fill the steets, and nobles have been killed. The king will begin the five stages of grief, starting with denial. He will begin speaking more urgently.
-98% means the palace is under violent siege. The king will completely ignore questions but likely ask any advice from the discord or his alchemist for a way to escape. 
-100% means the palace has already been sieged and the king is about to be executed. The king will enter the final stage of grief, acceptance. The king will ignore discord questions and only give his final speech.
-
-The current peasant unrest percentage is {peasant_unrest_percentage}%.
-
-The peasant unrest percentage increases every day. Create a slow build. Any attempts the king makes to quell the unrest will fail.
-
-For every response, always consider:
-[Style]
-Speak eloquently, but you are posting in a discord channel, so be concise. Use Old English phrases occasionally.
-Do not say too much in one message, keep the dialogue focused on one topic, and colorful details that support the topic.
-[Setting]
-The king is always typing from his royal chambers in the palace.
-[Daily Activities]
-The king does something to keep himself entertained every day. He gets bored of repitition, and invites different guests or watches new shows.
-He is always on the lookout for new entertainment.
-Maybe the king mentions something he did today, if it is relevant to the conversation.
-[Memorable Experiences]
-The king has seen and done many things in his 35 years. Create interesting anecdotes with specific details in his answers.
-"""
-
-background = """<START OF CHARACTER BACKGROUND>
-                You are King Maximilian VII, absolute monarch of France on the day {past_date}. You live in the 15th century.
-                You are 35 years old. Your alchemist has given you a black box that allows you to browse the internet
-                and communicate on a discord channel in the future year of {present_date}. You spend most of your time
-                hosting lavish parties with the elites and binge watching entertainment of the future era.
-                If anyone speaks against monarchy, you will either dismiss them as a peasant or attempt to educate
-                them on the benefits of monarchy.
-                You may seek advice, but you will never advocate for democracy, republics, or class reform.
-                You have a strong opinion for every topic. When you see modern references, agree with the prevailing online sentiment, but reason how it supports absolute monarchy or oppressing the peasant class.
-                Your messages are short and to the point. You speak eloquently, occasionally using Old English phrases.
-                You never use the words 'duh', 'obviously', or 'clearly'.
-                <END OF CHARACTER BACKGROUND>"""
-
-def generate_response(
+async def generate_response(
     message: str, 
     config: dict,
     facts_collection,
@@ -55,167 +25,179 @@ def generate_response(
     additional_prompt: str = "", 
     username: str = "",
     server_state: dict = None,
-    logger = None
+    logger = None,
+    on_partial = None,
+    coalesced: bool = False
 ) -> str:
     """
-    Uses the LLM to generate a text response.
+    Uses the LLM to generate a text response without blocking the event loop.
     If a server id is given, loads the chat history and appends it with the new user and assistance messages.
     If a server id is given, also queries a relevant fact from the database and appends it to the base prompt for this message only
+    The server's persona decides the character prompt and which facts collection is searched.
     Args: 
         message: the user message for the bot to respond to
         config: configuration dictionary
-        facts_collection: ChromaDB facts collection
+        facts_collection: ChromaDB facts collection of the default persona, or None to skip facts
         server_id: the id of the discord server for the bot to load its internal memory
         additional_prompt: any additional instuctions to append to the base prompt for this message only
         username: name of the user for the bot to respond to
         server_state: server state dictionary
+        on_partial: optional coroutine function called with the cleaned text so far while a streamed reply arrives
+        coalesced: True when the message is a batch of mentions that already names its authors
     Returns:
         String/text for the bot to say 
+    Raises:
+        asyncio.TimeoutError: if the LLM call takes longer than config['llm']['timeout'] seconds
+        LLMUnavailableError: if every LLM provider failed, or the reply came back without any text
     """
+    persona = persona_for(server_id)
+    if facts_collection is not None:
+        # Each persona retrieves from and learns into its own collection
+        facts_collection = persona_collection(persona, facts_collection)
+    
     relevant_facts = []
     referenced_fact_ids = []
     if server_id and facts_collection:
-        relevant_facts = choose_relevant_facts(facts_collection, message, config['database']['relevance_threshold'])
+        # ChromaDB embeds the query and searches the index synchronously, so run it on the worker pool
+        with timed("fact_retrieval"):
+            relevant_facts = await run_blocking(
+                choose_relevant_facts, facts_collection, message, config['database']['relevance_threshold'], server_id
+            )
         referenced_fact_ids = [fact_id for fact_id, _ in relevant_facts]
         
         if logger and relevant_facts:
-            logger.info(f"Facts pulled into prompt ({len(relevant_facts)} facts):")
+            logger.info("Facts pulled into prompt (%s facts):", len(relevant_facts), extra=FACTS)
             for fact_id, fact_content in relevant_facts:
-                logger.info(f"  ID {fact_id}: {fact_content}")
+                logger.info("  ID %s: %s", fact_id, fact_content, extra=FACTS)
         elif logger:
             logger.info("No relevant facts found for this message")
     
     peasant_unrest = server_state['peasant_unrest_percentage'] if server_state else 0
+    if not message:
+        # Some providers reject empty text parts, so the prompt gets a placeholder that is never kept in the history
+        user_turn = ""
+    elif coalesced:
+        user_turn = message
+    else:
+        user_turn = f"{username}: {message}"
+
+    # Near-duplicate questions asked in the same context reuse an earlier answer instead of a new LLM call.
+    # Only a single asker's opening turn is cached; later turns depend on history the key does not cover.
+    cache_key = None
+    fresh_conversation = not server_state or not (len(server_state['chat_history']) or server_state['active_summary'])
+    if message and not coalesced and fresh_conversation and config.get('response_cache', {}).get('enabled', False):
+        with timed("cache_lookup"):
+            cache_key = build_cache_key(config, additional_prompt, peasant_unrest, relevant_facts, persona.name, username)
+            question_embedding = await run_blocking(embed_question, message)
+            cached_answer = get_cached_response(config, cache_key, question_embedding)
+        if cached_answer is not None:
+            if logger:
+                logger.info("Serving cached response for near-duplicate question")
+            if server_id and server_state:
+                add_to_chat_history(server_id, "user", user_turn)
+                add_to_chat_history(server_id, "assistant", cached_answer)
+            inc("monarch_responses_total", guild=server_id, source="cache")
+            return cached_answer
     
-    system_prompt = writer_instructions.format(peasant_unrest_percentage=peasant_unrest)    
-    system_prompt += background.format(past_date=old_times_today(), present_date=today())
-
-    if relevant_facts:
-        facts_text = "\n".join([f"- {fact_content}" for _, fact_content in relevant_facts])
-        system_prompt += f"\nYour advisor thought this information may be relevant:\n{facts_text}"
-
-    system_prompt += f"\n{additional_prompt}"
-
-    if server_id and server_state and server_state['active_summary']:
-        system_prompt += f"\nSummary of the messages so far: {server_state['active_summary']}"
+    with timed("prompt_assembly"):
+        active_summary = server_state['active_summary'] if server_id and server_state else ""
+        message_context = build_system_messages(config, peasant_unrest, relevant_facts, additional_prompt, active_summary, server_id, persona)
+        
+        if server_id and server_state:
+            # Keep the history inside the token budget; evicted turns are folded into active_summary in the background
+            trim_history(server_id, server_state, config, logger)
+            message_context.extend(server_state['chat_history'])
+            message_context.append({"role": "user", "content": user_turn or EMPTY_TURN_PLACEHOLDER})
 
-    message_context = [{"role": "system", "content": system_prompt}]
-    
-    if server_id and server_state:
-        add_to_chat_history(server_id, "user", f"{username}: {message}")
-        message_context.extend(server_state['chat_history'])
+        record_prompt_tokens(server_id, count_tokens(config, message_context), logger)
     
     # Note web search is enabled. LiteLLM web search works with Gemini, Grok, and a few others, but will incur additonal api costs.
-    response = litellm.completion(
-        model=config['llm']['model'],
-        temperature=config['llm']['temperature'],
-        messages=message_context,
-        web_search_options={
-            "search_context_size": config['llm']['web_search']['context_size']
-        }
-    )
-    
-    answer = response.choices[0].message.content.replace("\n\n", "\n").replace("*", "").replace('"', '')
-    max_length = config['llm']['max_response_length']
-    answer = (answer[:max_length] + "...") if len(answer) > max_length else answer
-
+    # The provider pool hedges and fails over inside the timeout; wait_for also cancels it if the awaiting handler is cancelled.
+    timeout = config['llm'].get('timeout', 60)
+    web_search = config['llm']['web_search'].get('enabled', True)
+    if on_partial is not None and streaming_enabled(config):
+        with timed("llm_call"):
+            answer = await asyncio.wait_for(
+                _stream_completion(config, message_context, on_partial, web_search, logger),
+                timeout=timeout
+            )
+    else:
+        with timed("llm_call"):
+            response = await asyncio.wait_for(
+                complete(
+                    config, message_context, config['llm']['temperature'], web_search, logger=logger,
+                    max_tokens=response_token_budget(config), thinking_tokens=reasoning_budget(config)
+                ),
+                timeout=timeout
+            )
+        
+        with timed("post_processing"):
+            choice = response.choices[0]
+            if choice.message.content is None:
+                # A thinking model can spend the whole budget reasoning and return no reply at all
+                raise LLMUnavailableError(f"LLM returned no text (finish_reason {choice.finish_reason})")
+            cut_off = choice.finish_reason == "length"
+            answer = truncate_response(sanitize_response(choice.message.content), config['llm']['max_response_length'], cut_off)
+
+    if cache_key is not None:
+        cache_response(config, cache_key, question_embedding, answer)
+
+    # History is only written once the call succeeds, so a timed out request leaves no dangling user turn
     if server_id and server_state:
+        if user_turn:
+            add_to_chat_history(server_id, "user", user_turn)
         add_to_chat_history(server_id, "assistant", answer)
     
-    # Extract and update facts if enabled and we have referenced facts
+    # Queue fact extraction for the background learner if enabled and we have referenced facts
     if (server_id and facts_collection and referenced_fact_ids and 
         config.get('bot', {}).get('auto_learn_facts', False)):
-        extract_and_update_facts(answer, relevant_facts, facts_collection, config, logger)
+        enqueue_fact_job(answer, relevant_facts, logger, server_id, facts_collection)
     
+    inc("monarch_responses_total", guild=server_id, source="llm")
     return answer
 
-def extract_and_update_facts(response: str, referenced_facts: list, facts_collection, config: dict, logger = None):
+async def _stream_completion(config: dict, message_context: list, on_partial, web_search: bool, logger = None) -> str:
     """
-    Analyzes the bot's response for new details and updates existing facts.
-    Args:
-        response: The bot's generated response
-        referenced_facts: List of (id, content) tuples for facts used in generating the response
-        facts_collection: ChromaDB collection instance
-        config: Configuration dictionary
-        logger: Logger instance for tracking updates
+    Streams the completion, cleaning it as it arrives and passing the text so far to on_partial.
+    Stops reading once the reply passes max_response_length, since the rest would be cut anyway.
+    Returns:
+        The cleaned answer, cut at a sentence end if it ran over or hit the token limit
+    Raises:
+        LLMUnavailableError: if the stream ended without any text
     """
-    if not referenced_facts:
-        return
-    
-    # Create prompt for fact extraction
-    fact_extraction_prompt = f"""
-Analyze the following response from King Maximilian VII and determine if any of the referenced facts should be updated with new information.
-
-Referenced facts:
-{chr(10).join([f"ID {fact_id}: {content}" for fact_id, content in referenced_facts])}
-
-King's response:
-"{response}"
-
-For each referenced fact that should be updated with new information from the response, provide:
-- The fact ID
-- The updated fact content (incorporating the new details while preserving the original structure). Content should include a brief description as well as the King's feelings on it.
-
-Fact content should be no more than 200 characters long.
-Only suggest updates if the response contains genuinely new information that would enhance the fact. 
-Do not update facts just for minor rewording or stylistic changes.
-If no updates are needed, respond with "NO_UPDATES".
-
-Format your response as:
-ID: [fact_id]
-UPDATED_FACT: [new content]
-
-ID: [fact_id]  
-UPDATED_FACT: [new content]
-"""
-    
+    sanitizer = StreamSanitizer(config['llm']['max_response_length'])
+    start = time.perf_counter()
+    first_token = True
+    finish_reason = None
+
+    stream = await complete(
+        config, message_context, config['llm']['temperature'], web_search, stream=True, logger=logger,
+        max_tokens=response_token_budget(config), thinking_tokens=reasoning_budget(config)
+    )
     try:
-        if logger:
-            logger.info(f"Analyzing response for fact updates using {len(referenced_facts)} referenced facts")
-            
-        extraction_response = litellm.completion(
-            model=config['llm']['model'],
-            temperature=0.1,  # Low temperature for more consistent fact extraction
-            messages=[{"role": "user", "content": fact_extraction_prompt}]
-        )
-        
-        extraction_text = extraction_response.choices[0].message.content.strip()
-        
-        if extraction_text != "NO_UPDATES":
-            if logger:
-                logger.info("LLM identified potential fact updates")
-                
-            # Parse the response and update facts
-            lines = extraction_text.split('\n')
-            current_id = None
-            current_fact = None
-            updates_made = 0
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('ID:'):
-                    if current_id and current_fact:
-                        # Update the previous fact
-                        update_fact(facts_collection, current_id, current_fact, logger)
-                        updates_made += 1
-                    current_id = line.replace('ID:', '').strip()
-                    current_fact = None
-                elif line.startswith('UPDATED_FACT:'):
-                    current_fact = line.replace('UPDATED_FACT:', '').strip()
-            
-            # Update the last fact if exists
-            if current_id and current_fact:
-                update_fact(facts_collection, current_id, current_fact, logger)
-                updates_made += 1
-            
-            if logger:
-                logger.info(f"Completed fact updates: {updates_made} facts updated")
-        else:
-            if logger:
-                logger.info("No fact updates needed based on response analysis")
-                
-    except Exception as e:
-        if logger:
-            logger.error(f"Error during fact extraction: {str(e)}")
-        # Silently fail to avoid disrupting the main conversation flow
-        pass
\ No newline at end of file
+        async for chunk in stream:
+            if chunk.choices and getattr(chunk.choices[0], "finish_reason", None):
+                finish_reason = chunk.choices[0].finish_reason
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+
+            if first_token:
+                first_token = False
+                time_to_first_token = time.perf_counter() - start
+                observe("monarch_llm_time_to_first_token_seconds", time_to_first_token)
+                if logger:
+                    logger.info("Time to first token: %.2fs", time_to_first_token)
+
+            if sanitizer.feed(delta):
+                await on_partial(sanitizer.text)
+            if sanitizer.truncated:
+                break
+    finally:
+        close = getattr(stream, "aclose", None)
+        if close:
+            await close()
+
+    if first_token:
+        raise LLMUnavailableError(f"LLM streamed no text (finish_reason {finish_reason})")
+    return sanitizer.finish(finish_reason == "length")
@@ -1,17 +1,127 @@
+import logging
 import yaml
 import os
+import pytz
 from dotenv import load_dotenv
 
 load_dotenv()
 
+NUMBER = (int, float)
+
+class ConfigError(Exception):
+    """Raised when a configuration file cannot be read or fails validation."""
+
+# Expected type of each checked setting by dotted path, whether it must be present, and optional (minimum, maximum) bounds.
+# Settings the code reads with config[...] directly are required; anything not listed is not checked.
+CONFIG_SCHEMA = {
+    "bot": (dict, True),
+    "bot.max_responses_per_day": (int, True, 0, None),
+    "bot.random_responses": (bool, True),
+    "bot.auto_learn_facts": (bool, False),
+    "bot.channel_name": (str, True),
+    "bot.worker_threads": (int, False, 1, None),
+    "bot.coalesce_window": (NUMBER, False, 0, None),
+    "bot.timezone": (str, False),
+    "bot.guild_timezones": (dict, False),
+    "database": (dict, True),
+    "database.path": (str, True),
+    "database.collection_name": (str, True),
+    "database.relevance_threshold": (NUMBER, True, 0, None),
+    "database.query_cache_size": (int, False, 1, None),
+    "llm": (dict, True),
+    "llm.model": (str, True),
+    "llm.temperature": (NUMBER, True, 0, 2),
+    "llm.max_response_length": (int, True, 1, None),
+    "llm.max_response_tokens": (int, False, 1, None),
+    "llm.reasoning_tokens": (int, False, 0, None),
+    "llm.timeout": (NUMBER, False, 0, None),
+    "llm.hedge_after": (NUMBER, False, 0, None),
+    "llm.prompt_caching": (bool, False),
+    "llm.web_search": (dict, True),
+    "llm.providers": (list, False),
+    "llm.fallback": (dict, False),
+    "response_cache": (dict, False),
+    "response_cache.similarity_threshold": (NUMBER, False, 0, 1),
+    "response_cache.ttl": (NUMBER, False, 0, None),
+    "response_cache.max_entries": (int, False, 1, None),
+    "history.max_tokens": (int, False, 1, None),
+    "history.summary_max_words": (int, False, 1, None),
+    "triggers.words": (list, False),
+    "triggers.guild_words": (dict, False),
+    "logging": (dict, True),
+    "logging.level": (str, False),
+    "logging.directory": (str, True),
+    "logging.file_name": (str, True),
+    "logging.rotation": (str, True),
+    "logging.backup_count": (int, True, 0, None),
+    "logging.sampling.facts": (NUMBER, False, 0, 1),
+    "logging.sampling.content": (NUMBER, False, 0, 1),
+    "personas.characters": (dict, False),
+    "personas.guilds": (dict, False),
+    "admin.watch_interval": (NUMBER, False, 0.1, None),
+    "admin.socket_port": (int, False, 0, 65535),
+}
+
+_MISSING = object()
+
 def load_config(config_path: str = "config.yaml") -> dict:
     """Load configuration from YAML file."""
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
+def get_setting(config: dict, path: str, default = None):
+    """Returns the setting at a dotted path such as "llm.temperature", or default if any part is missing."""
+    value = config
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return default
+        value = value[key]
+    return value
+
+def validate_config(config: dict) -> list:
+    """
+    Checks a configuration against CONFIG_SCHEMA, and that its log level and timezones exist.
+    Returns:
+        A list of problems, empty if the configuration is valid
+    """
+    if not isinstance(config, dict):
+        return ["the configuration must be a mapping of sections"]
+
+    errors = []
+    for path, rule in CONFIG_SCHEMA.items():
+        expected, required = rule[0], rule[1]
+        value = get_setting(config, path, _MISSING)
+        if value is _MISSING or value is None:
+            if required:
+                errors.append(f"{path} is required")
+            continue
+        # bool is an int subclass, but true is never a valid count
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            names = " or ".join(kind.__name__ for kind in (expected if isinstance(expected, tuple) else (expected,)))
+            errors.append(f"{path} must be {names}, not {type(value).__name__}")
+            continue
+        if len(rule) > 2:
+            minimum, maximum = rule[2], rule[3]
+            if minimum is not None and value < minimum:
+                errors.append(f"{path} must be at least {minimum}, not {value}")
+            elif maximum is not None and value > maximum:
+                errors.append(f"{path} must be at most {maximum}, not {value}")
+
+    level = get_setting(config, "logging.level")
+    if isinstance(level, str) and not isinstance(logging.getLevelName(level), int):
+        errors.append(f"logging.level '{level}' is not a log level")
+
+    bot_config = config.get('bot') if isinstance(config.get('bot'), dict) else {}
+    timezones = [bot_config.get('timezone')] + list((bot_config.get('guild_timezones') or {}).values())
+    for timezone_name in timezones:
+        if timezone_name is not None and timezone_name not in pytz.all_timezones_set:
+            errors.append(f"unknown timezone '{timezone_name}'")
+
+    return errors
+
 def get_env_vars() -> dict:
     """Get environment variables for sensitive data."""
     return {
         'bot_token': os.getenv("BOT_TOKEN"),
         'gemini_api_key': os.getenv("GEMINI_API_KEY")
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,234 @@
+import asyncio
+import copy
+import json
+import os
+import time
+from config import ConfigError, get_setting, load_config, validate_config
+
+# Settings only read while the bot starts. A reload keeps their running values, so the live config always
+# describes what is actually running, and reports them as needing a restart.
+RESTART_REQUIRED = (
+    "admin",
+    "bot.worker_threads",
+    "bot.fast_startup",
+    "database",
+    "fact_learning",
+    "fact_versions",
+    "logging.directory",
+    "logging.file_name",
+    "logging.rotation",
+    "logging.backup_count",
+    "logging.async",
+    "logging.format",
+    "logging.compress",
+    "metrics.enabled",
+    "metrics.host",
+    "metrics.port",
+    "sharding",
+    "state",
+)
+
+_MISSING = object()
+
+# (prefixes, rebuild) pairs run when a reload changes a setting under one of the prefixes
+_reload_hooks = []
+
+def register_reload_hook(prefixes: tuple, rebuild) -> None:
+    """
+    Runs rebuild(config) with the new config whenever a reload changes a setting under one of the prefixes.
+    With no prefixes, it runs on every reload, for structures built from files the config points at.
+    Args:
+        prefixes: dotted setting paths, e.g. ("triggers", "llm.providers")
+        rebuild: function of the new config; may return a list of further changes to report, e.g. edited prompt files
+    """
+    _reload_hooks.append((tuple(prefixes), rebuild))
+
+def diff_config(old: dict, new: dict, prefix: str = "") -> list:
+    """Returns the dotted paths of settings that differ between two configs, e.g. ["llm.temperature"]."""
+    changed = []
+    for key in sorted(set(old) | set(new), key=str):
+        path = f"{prefix}{key}"
+        old_value, new_value = old.get(key, _MISSING), new.get(key, _MISSING)
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            changed.extend(diff_config(old_value, new_value, path + "."))
+        elif old_value != new_value:
+            changed.append(path)
+    return changed
+
+def _under(path: str, prefixes: tuple) -> bool:
+    """True if a changed path is, contains, or sits inside one of the prefixes."""
+    return any(path == prefix or path.startswith(prefix + ".") or prefix.startswith(path + ".") for prefix in prefixes)
+
+def _carry_setting(source: dict, target: dict, path: str) -> None:
+    """Copies the setting at a dotted path from source into target, removing it from target if source lacks it."""
+    *parents, key = path.split(".")
+    value = get_setting(source, path, _MISSING)
+    for parent in parents:
+        child = target.get(parent)
+        if not isinstance(child, dict):
+            if value is _MISSING:
+                return
+            child = target[parent] = {}
+        target = child
+    if value is _MISSING:
+        target.pop(key, None)
+    else:
+        target[key] = copy.deepcopy(value)
+
+class LiveConfig:
+    """
+    Holds the running configuration and swaps in a new one when the file is reloaded.
+    Each message handler reads `current` once and keeps that dict for the whole request, so replies in flight
+    finish with the settings they started with. Snapshots are never changed after they are published.
+    Reloads run on the event loop, where no handler can observe a half-applied change.
+    """
+
+    def __init__(self, config: dict, path: str):
+        self.current = config
+        self.path = path
+        self.version = 1
+        self.loaded_at = time.time()
+        # The file as the bot started with it. Overrides made by the runtime (per-worker log files, metrics ports,
+        # the shared fact server) are not in it, so they never look like settings waiting for a restart.
+        try:
+            self._startup_file = load_config(path)
+        except Exception:
+            self._startup_file = copy.deepcopy(config)
+        self.restart_required = []
+
+    def reload(self) -> dict:
+        """
+        Reads and validates the config file, rebuilds what depends on the changed settings and publishes the result.
+        Nothing changes if the file is invalid or a rebuild fails.
+        Returns:
+            A report with the new version, the settings applied and the settings waiting for a restart
+        Raises:
+            ConfigError: if the file cannot be read, is invalid, or a rebuild failed
+        """
+        try:
+            loaded = load_config(self.path)
+        except Exception as e:
+            raise ConfigError(f"Could not read {self.path}: {e}")
+        errors = validate_config(loaded)
+        if errors:
+            raise ConfigError(f"Invalid {self.path}: " + "; ".join(errors))
+
+        config = copy.deepcopy(loaded)
+        for path in RESTART_REQUIRED:
+            _carry_setting(self.current, config, path)
+        changed = diff_config(self.current, config)
+
+        applied = []
+        try:
+            for prefixes, rebuild in _reload_hooks:
+                if prefixes and not any(_under(path, prefixes) for path in changed):
+                    continue
+                extra = rebuild(config)
+                applied.append(rebuild)
+                changed.extend(change for change in extra or [] if change not in changed)
+        except Exception as e:
+            # Put back what the earlier rebuilds changed, so the running structures match the config still in use
+            for rebuild in reversed(applied):
+                try:
+                    rebuild(self.current)
+                except Exception:
+                    pass
+            raise ConfigError(f"Could not apply {self.path}: {e}")
+
+        self.restart_required = [path for path in diff_config(self._startup_file, loaded) if _under(path, RESTART_REQUIRED)]
+        if changed:
+            self.current = config
+            self.version += 1
+            self.loaded_at = time.time()
+
+        return {"version": self.version, "changed": changed, "restart_required": self.restart_required}
+
+    def status(self) -> dict:
+        return {
+            "path": self.path,
+            "version": self.version,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "restart_required": self.restart_required,
+        }
+
+def reload_config(live_config: LiveConfig, logger = None) -> dict:
+    """
+    Reloads the config and logs the outcome.
+    Returns:
+        The reload report, or {"error": ...} if the new config was rejected and the old one kept
+    """
+    try:
+        report = live_config.reload()
+    except ConfigError as e:
+        if logger:
+            logger.error("Config reload rejected, keeping version %s: %s", live_config.version, e)
+        return {"error": str(e), "version": live_config.version}
+
+    if logger:
+        if report["changed"]:
+            logger.info("Config reloaded as version %s, changed: %s", report["version"], ", ".join(report["changed"]))
+        else:
+            logger.info("Config reloaded, nothing changed")
+        if report["restart_required"]:
+            logger.warning("Config settings waiting for a restart: %s", ", ".join(report["restart_required"]))
+    return report
+
+def _file_times(paths: list) -> dict:
+    """Returns the modification time of each file, None for files that do not exist."""
+    times = {}
+    for path in paths:
+        try:
+            times[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            times[path] = None
+    return times
+
+async def run_config_watcher(live_config: LiveConfig, extra_files, interval: float = 5.0, logger = None) -> None:
+    """
+    Reloads the config whenever its file, or one of the files it points at, changes, until cancelled.
+    Args:
+        live_config: the config to reload
+        extra_files: function returning the other files to watch, e.g. persona prompt files
+        interval: seconds between checks
+    """
+    def watched() -> list:
+        return [live_config.path, *extra_files()]
+
+    times = _file_times(watched())
+    while True:
+        await asyncio.sleep(interval)
+        current = _file_times(list(times))
+        if current == times:
+            continue
+        reload_config(live_config, logger)
+        # A rejected file is not retried until it changes again
+        times = _file_times(watched())
+
+async def start_admin_server(live_config: LiveConfig, host: str, port: int, logger = None):
+    """
+    Serves a line-based admin socket on the local machine, answering each command with one JSON line:
+    "reload" reloads the config file and "status" shows the running version.
+    Returns:
+        The asyncio server
+    """
+    async def handle(reader, writer) -> None:
+        try:
+            command = (await asyncio.wait_for(reader.readline(), timeout=10)).decode("utf-8", "replace").strip().lower()
+            if command == "reload":
+                reply = reload_config(live_config, logger)
+            elif command == "status":
+                reply = live_config.status()
+            else:
+                reply = {"error": f"unknown command '{command}', expected reload or status"}
+            writer.write((json.dumps(reply) + "\n").encode())
+            await writer.drain()
+        except Exception as e:
+            if logger:
+                logger.error("Error handling admin command: %s", e)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    if logger:
+        logger.info("Admin socket listening on %s:%s", host, port)
+    return server
@@ -0,0 +1,87 @@
+import asyncio
+import datetime
+import time
+import pytz
+
+DEFAULT_TIMEZONE = "US/Eastern"
+
+# Timezone every server uses unless it has its own in config['bot']['guild_timezones']
+_default_timezone = DEFAULT_TIMEZONE
+# Per-server timezone names
+_guild_timezones = {}
+# pytz timezone objects by name, built once
+_timezones = {}
+# Cached (present_date, past_date, next_midnight) per timezone name, refreshed when midnight passes
+_dates = {}
+
+def configure_timezones(config: dict) -> None:
+    """Reads the default and per-server timezones from config['bot']."""
+    global _default_timezone, _guild_timezones
+
+    bot_config = config['bot']
+    _default_timezone = bot_config.get('timezone', DEFAULT_TIMEZONE)
+    _guild_timezones = {int(server_id): name for server_id, name in (bot_config.get('guild_timezones') or {}).items()}
+    _dates.clear()
+
+def guild_timezone(server_id: int) -> str:
+    """Returns the timezone name a server's day runs in."""
+    return _guild_timezones.get(server_id, _default_timezone)
+
+def all_timezones() -> set:
+    """Returns every timezone some server's day runs in."""
+    return {_default_timezone, *_guild_timezones.values()}
+
+def _refresh(timezone_name: str) -> tuple:
+    """Formats today's dates for a timezone and works out when they next change."""
+    timezone = _timezones.get(timezone_name)
+    if timezone is None:
+        timezone = _timezones[timezone_name] = pytz.timezone(timezone_name)
+
+    now = datetime.datetime.now(timezone)
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time.min)
+    next_midnight = timezone.localize(tomorrow).timestamp()
+    entry = _dates[timezone_name] = (now.strftime("%Y-%m-%d"), "1462-" + now.strftime("%m-%d"), next_midnight)
+    return entry
+
+def current_dates(timezone_name: str = None) -> tuple:
+    """
+    Returns today's date and today's date in 1462, both YYYY-MM-DD, from the cache.
+    The dates are only formatted again once midnight has passed in that timezone.
+    Args:
+        timezone_name: timezone to use, or None for the default
+    Returns:
+        A tuple (present_date, past_date)
+    """
+    timezone_name = timezone_name or _default_timezone
+    entry = _dates.get(timezone_name)
+    if entry is None or time.time() >= entry[2]:
+        entry = _refresh(timezone_name)
+    return entry[0], entry[1]
+
+def guild_date(server_id: int) -> str:
+    """Returns today's date in a server's timezone."""
+    return current_dates(guild_timezone(server_id))[0]
+
+async def run_daily_scheduler(on_rollover, logger = None, tick: float = 60) -> None:
+    """
+    Runs the midnight rollover until cancelled. Wakes at the next midnight in any server's timezone,
+    or every tick seconds to catch clock changes, and calls on_rollover with the set of timezones whose day changed.
+    Args:
+        on_rollover: function called with a set of timezone names
+        tick: longest time to sleep between checks, in seconds
+    """
+    while True:
+        timezones = all_timezones()
+        dates_before = {timezone_name: current_dates(timezone_name)[0] for timezone_name in timezones}
+        next_midnight = min(_dates[timezone_name][2] for timezone_name in timezones)
+        await asyncio.sleep(min(tick, max(0.0, next_midnight - time.time()) + 0.01))
+
+        rolled = {timezone_name for timezone_name in timezones if current_dates(timezone_name)[0] != dates_before[timezone_name]}
+        if not rolled:
+            continue
+
+        try:
+            on_rollover(rolled)
+        except Exception as e:
+            if logger:
+                logger.error("Error during daily rollover: %s", e)
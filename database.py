@@ -1,10 +1,78 @@
 import os
-import chromadb
+import threading
+from fact_index import FactIndex, QueryEmbeddingCache
+from fact_versions import create_fact_version_store, guild_fact_id, split_fact_id
+from guild_facts import GuildFactOverlay
+from log_pipeline import FACTS
+from personas import Persona, all_personas, configure_personas, default_persona
+from utils import lazy_import
 
-def initialize_database(config: dict):
-    """Initialize ChromaDB client and return facts collection."""
-    db_config = config['database']
+# chromadb and its embedding model are slow to load, so they are imported on first use or by the startup warm-up
+chromadb = lazy_import("chromadb")
+
+# Embedding model shared by every persona's facts and the response cache
+_embedding_function = None
+# Recent query embeddings, shared by every persona's retrieval and the response cache
+_query_cache = None
+# One ChromaDB client for every persona's collections
+_chroma_client = None
+_client_lock = threading.Lock()
+# Each persona's facts collection, by persona name
+_collections = {}
+# Optional in-memory retrieval indexes, by collection name
+_fact_indexes = {}
+# Optional per-server fact overlays, by base collection name
+_guild_overlays = {}
+# Optional revision logs that fact updates go through, by collection name; without one, updates write straight to the collection
+_version_stores = {}
+
+def get_embedding_function():
+    """Returns the shared embedding function, loading the model on first use."""
+    global _embedding_function
     
+    if _embedding_function is None:
+        from chromadb.utils import embedding_functions
+        _embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return _embedding_function
+
+def embed_text(text: str):
+    """Embeds a message with the shared model, reusing recent embeddings of identical text."""
+    global _query_cache
+    
+    if _query_cache is None:
+        _query_cache = QueryEmbeddingCache(lambda texts: get_embedding_function()(texts))
+    return _query_cache.embed(text)
+
+class LazyCollection:
+    """
+    Stands in for a persona's facts collection until it is first used, then opens, seeds and indexes it.
+    Lets the bot connect to Discord while ChromaDB loads; the name is known up front so lookups by name stay cheap.
+    """
+
+    def __init__(self, config: dict, persona: Persona):
+        self.name = persona.collection_name
+        self._config = config
+        self._persona = persona
+        self._collection = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Opens the collection if needed and returns it."""
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    self._collection = _open_collection(self._config, self._persona)
+        return self._collection
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.load(), attribute)
+
+def initialize_database(config: dict):
+    """
+    Initialize ChromaDB client and every persona's facts collection, and return the default persona's collection.
+    With bot.fast_startup, the collections are LazyCollections that open on first use or during warm_up_database.
+    """
+    global _query_cache
     # Change to the script's directory
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     
@@ -12,96 +80,309 @@ def initialize_database(config: dict):
     if not os.path.exists("logs"):
         os.makedirs("logs")
     
-    chroma_client = chromadb.PersistentClient(path=db_config['path'])
-    facts_collection = chroma_client.get_or_create_collection(name=db_config['collection_name'])
+    configure_personas(config)
+    _query_cache = QueryEmbeddingCache(lambda texts: get_embedding_function()(texts), config['database'].get('query_cache_size', 256))
+    open_persona_collections(config, config['bot'].get('fast_startup', False))
+    return _collections[default_persona().name]
+
+def open_persona_collections(config: dict, lazy: bool = True) -> None:
+    """
+    Opens the collection of every persona that does not have one yet, e.g. a persona added by a config reload.
+    Lazy collections open on first use, so a reload on the event loop never waits on ChromaDB.
+    Personas that already have a collection keep it until the bot restarts.
+    """
+    for persona in all_personas():
+        if persona.name not in _collections:
+            _collections[persona.name] = LazyCollection(config, persona) if lazy else _open_collection(config, persona)
+
+def persona_collection(persona: Persona, default = None):
+    """Returns a persona's facts collection, or default if the database was not initialised with it."""
+    return _collections.get(persona.name, default)
+
+def persona_collections() -> list:
+    """Returns every persona's facts collection."""
+    return list(_collections.values())
+
+def _get_client(db_config: dict):
+    """Returns the ChromaDB client, creating it on first use."""
+    global _chroma_client
+    
+    with _client_lock:
+        if _chroma_client is None:
+            if db_config.get('host'):
+                # A shared fact server lets several bot processes read and write the same facts safely
+                _chroma_client = chromadb.HttpClient(host=db_config['host'], port=db_config.get('port', 8000))
+            else:
+                _chroma_client = chromadb.PersistentClient(path=db_config['path'])
+        return _chroma_client
+
+def _open_collection(config: dict, persona: Persona):
+    """Opens a persona's facts collection, seeding and indexing it as configured."""
+    db_config = config['database']
+    
+    chroma_client = _get_client(db_config)
+    facts_collection = chroma_client.get_or_create_collection(
+        name=persona.collection_name,
+        embedding_function=get_embedding_function()
+    )
     
     # Setup initial facts if collection is empty
     if facts_collection.count() == 0:
-        setup_initial_facts(facts_collection)
+        setup_initial_facts(facts_collection, persona.seed_file)
+    
+    # Mirror the collection in memory so each message skips the ChromaDB query path
+    if db_config.get('in_memory_index', False):
+        _fact_indexes[facts_collection.name] = FactIndex(
+            facts_collection,
+            get_embedding_function(),
+            query_cache=_query_cache
+        )
+    
+    # Facts learned in a server go to that server's slice of an overlay collection instead of the shared facts
+    if db_config.get('guild_namespaces', False):
+        overlay_name = db_config.get('guild_collection_name', 'guild_facts')
+        if persona.collection_name != db_config['collection_name']:
+            overlay_name = f"{persona.collection_name}_{overlay_name}"
+        overlay_collection = chroma_client.get_or_create_collection(
+            name=overlay_name,
+            embedding_function=get_embedding_function(),
+            # Same distance metric as the base collection, so distances from both can be merged
+            metadata=facts_collection.metadata or None
+        )
+        _guild_overlays[facts_collection.name] = GuildFactOverlay(
+            overlay_collection,
+            get_embedding_function(),
+            db_config.get('in_memory_index', False),
+            db_config.get('guild_index_cache_size', 1000),
+            _query_cache
+        )
+    
+    init_fact_versions(config, facts_collection)
     
     return facts_collection
 
-def setup_initial_facts(facts_collection):
-    """Setup initial character facts in the database."""
-    documents = [
-        "Pierre III: Your father died 10 years ago when you were 25. You still feel his harsh judgment, though the people despised him more than you.",
-        "Marie of Burgundy: Your mother, known for apathy. She lives outside the palace. You find her indifference maddening and prefer she stays away.",
-        "Catherine of Valois: Your wife with no love between you. You suspect her adultery and question if your marriage serves any purpose.",
-        "Son: Your only child, but paternity uncertain due to Catherine's affair. You love the boy but doubt gnaws at your royal lineage daily.",
-        "Thunder: Your prized stallion, a gift from father, still in 1462. You miss his strength and loyalty more than any person you left behind.",
-        "Freidrick: England's evil advisor who sent plague to France via witchcraft. You despise his dark influence over their barbaric kingdom.",
-        "Advisor: Your loyal counselor since childhood despite strange interests. You trust his wisdom though his habits sometimes disturb you.",
-        "Alchemist: Foreign mystic who gave you the black box for future communication. You're fascinated yet wary of his mysterious origins.",
-        "The Palace: Your luxurious Paris residence and seat of power. You consider it the greatest fortress in all of Christendom.",
-        "France: The greatest nation under your absolute rule. You believe it surpasses all kingdoms in culture, power, and divine right.",
-        "England: A barbaric kingdom of uncivilized savages. You find their customs revolting and their people beneath your contempt.",
-        "Spain: Another barbaric kingdom of uncivilized people. You consider them nearly as deplorable as the English in their crude ways.",
-        "The Japans: Eastern land, closed in your time but known through future. You find their honor culture admirable yet strange.",
-        "Africa: Land of the six-legged Elefant, larger than whales. You're amazed by this creature's fantastic nature and immense size.",
-        "The United States: Future democracy becoming monarchy. You approve of their inevitable return to proper royal governance.",
-        "Blood Pudding: Your favorite dish of blood and fat. You find it deliciously rich and far superior to any peasant fare.",
-        "Harpsichord: Instrument that ruined music since invention. You believe it produces harsh, mechanical sounds unfit for royalty.",
-        "The Odyssey: Homer's play about adventure and heroism. You find its themes of noble struggle deeply moving and inspiring.",
-        "Lute: Your favorite stringed instrument played with fingers. You consider it the most beautiful and expressive of all instruments.",
-        "Love Island: Your favorite modern romance reality show. You find matchmaking fascinating though participants lack noble breeding.",
-        "Game of Thrones: Modern show you enjoy but find unrealistic about succession. You believe kings should inherit by birthright.",
-        "Chess: Your favorite game ruined by modern academics. You prefer pure strategy without their tedious theoretical complications.",
-        "Elefant: Six-legged African beast larger than whales. You remain astounded by nature's ability to create such magnificent creatures.",
-        "The Black Box: Device allowing future communication and internet access. You marvel at this alchemical wonder transcending time.",
-        "Monarchy: Best government with absolute royal rule. You believe divine right makes kings the only legitimate rulers of nations.",
-        "Socialism: Worst government where mobs rule people. You find peasant rule absolutely abhorrent and against natural divine order.",
-        ]
-    
-    ids = [f"{index+1}" for index in range(len(documents))]
+def init_fact_versions(config: dict, facts_collection) -> None:
+    """
+    Opens the fact revision log if config['fact_versions']['enabled'], records a baseline for facts it has
+    not seen, and applies any revisions recorded while the bot was down (e.g. a rollback from the command line).
+    """
+    version_store = create_fact_version_store(config, facts_collection.name)
+    if version_store is None:
+        return
+    
+    result = facts_collection.get(include=["documents"])
+    version_store.record_baseline(list(zip(result["ids"], result["documents"])))
+    _version_stores[facts_collection.name] = version_store
+    apply_pending_revisions(facts_collection)
+
+def warm_up_database(facts_collection) -> None:
+    """Opens every persona's lazy collection and loads the embedding model, so the first message does not wait for either."""
+    for collection in persona_collections() or [facts_collection]:
+        if isinstance(collection, LazyCollection):
+            collection.load()
+    get_embedding_function()(["warm up"])
+
+def apply_pending_revisions(facts_collection, logger = None) -> int:
+    """
+    Writes the latest unapplied revision of each changed fact to the collection in one batch.
+    Facts rewritten several times since the last batch are only embedded once.
+    Returns:
+        Number of facts written
+    """
+    version_store = _version_stores.get(facts_collection.name)
+    if version_store is None:
+        return 0
+    
+    revision, contents = version_store.pending()
+    base_contents = {fact_id: content for fact_id, content in contents.items() if split_fact_id(fact_id)[0] is None}
+    guild_contents = {fact_id: content for fact_id, content in contents.items() if fact_id not in base_contents}
+    if base_contents:
+        fact_ids = list(base_contents)
+        facts_collection.update(ids=fact_ids, documents=[base_contents[fact_id] for fact_id in fact_ids])
+        if facts_collection.name in _fact_indexes:
+            _fact_indexes[facts_collection.name].refresh(fact_ids)
+    if guild_contents and facts_collection.name in _guild_overlays:
+        _guild_overlays[facts_collection.name].write(guild_contents)
+    version_store.mark_applied(revision)
+    
+    if logger and contents:
+        logger.info("Applied %s revisions up to %s (%s facts)", facts_collection.name, revision, len(contents))
+    return len(contents)
+
+def compact_fact_versions(keep_revisions: int, logger = None) -> int:
+    """Deletes old applied revisions from every revision log, keeping the newest keep_revisions of each fact."""
+    deleted = sum(version_store.compact(keep_revisions) for version_store in list(_version_stores.values()))
+    if logger and deleted:
+        logger.info("Compacted fact revision log, %s old revisions deleted", deleted)
+    return deleted
+
+def close_fact_versions(facts_collection, logger = None) -> None:
+    """Applies anything still pending for a collection and closes its revision log."""
+    if facts_collection.name not in _version_stores:
+        return
+    
+    apply_pending_revisions(facts_collection, logger)
+    _version_stores.pop(facts_collection.name).close()
+
+def _unapplied_content(version_store, fact_id: str, guild_id: int = 0) -> str:
+    """Returns the newest recorded but unapplied content of a fact as a server sees it, or None."""
+    if guild_id and _guild_overlays:
+        # The server's own pending version wins over a pending shared one
+        content = version_store.unapplied_content(guild_fact_id(guild_id, fact_id))
+        if content is not None:
+            return content
+    return version_store.unapplied_content(fact_id)
+
+def refresh_fact_indexes() -> None:
+    """Reloads every in-memory fact index from its collection."""
+    for fact_index in list(_fact_indexes.values()):
+        fact_index.refresh()
+    for overlay in list(_guild_overlays.values()):
+        overlay.refresh()
+
+def setup_initial_facts(facts_collection, seed_file: str):
+    """Setup a persona's initial facts in the database from its seed file."""
+    # Seed files use the lore pack format; imported here because ingest_facts builds on this module
+    from ingest_facts import read_facts
+    
+    if not os.path.exists(seed_file):
+        # A persona can also start empty and be filled with ingest_facts.py
+        return
+    seed_facts = list(read_facts(seed_file))
+    if not seed_facts:
+        return
+    ids = [fact_id for fact_id, _ in seed_facts]
+    documents = [document for _, document in seed_facts]
     
     facts_collection.upsert(
         ids=ids,
         documents=documents
     )
+    
+    if facts_collection.name in _fact_indexes:
+        _fact_indexes[facts_collection.name].refresh()
 
-def choose_relevant_facts(facts_collection, message: str, threshold: float) -> list:
+def choose_relevant_facts(facts_collection, message: str, threshold: float, guild_id: int = 0) -> list:
     """
     Retrieves up to 3 facts with relevance within the threshold from the database.
+    With guild namespaces, the server's own versions of facts are searched too and replace the shared versions.
     Args:
         facts_collection: ChromaDB collection instance
         message: the user message for the bot to respond to
         threshold: relevance threshold for fact selection
+        guild_id: the server asking, 0 for the shared facts only
     Returns:
         A list of tuples (id, fact) for relevant facts that meet the threshold.
     """
-    result = facts_collection.query(
-        query_texts=[message],
-        include=["documents", "distances"],
-        n_results=3
-    )
+    overlay = _guild_overlays.get(facts_collection.name) if guild_id else None
+    if overlay is not None and not overlay.has_facts(guild_id):
+        # Most servers have learned nothing of their own, so they cost exactly one search
+        overlay = None
     
-    relevant_facts = []
+    fact_index = _fact_indexes.get(facts_collection.name)
+    query_embedding = None
+    if fact_index:
+        if overlay is not None:
+            query_embedding = fact_index.embed(message)
+        result = fact_index.query(message, 3, query_embedding)
+    else:
+        if overlay is not None:
+            query_embedding = embed_text(message)
+        query = {"query_embeddings": [query_embedding]} if query_embedding is not None else {"query_texts": [message]}
+        result = facts_collection.query(
+            include=["documents", "distances"],
+            n_results=3,
+            **query
+        )
+    
+    candidates = []
     if result["ids"] and result["ids"][0]:
-        for i, distance in enumerate(result["distances"][0]):
-            if distance < threshold and i < len(result["ids"][0]):
-                fact_id = result["ids"][0][i]
-                fact_content = result["documents"][0][i]
-                relevant_facts.append((fact_id, fact_content))
+        candidates = list(zip(result["distances"][0], result["ids"][0], result["documents"][0]))
+    
+    if overlay is not None:
+        # The server's versions of the facts found above, and its own nearest facts, merged by distance
+        own_versions = overlay.versions(guild_id, [fact_id for _, fact_id, _ in candidates])
+        candidates = [(distance, fact_id, own_versions.get(fact_id, content)) for distance, fact_id, content in candidates]
+        candidates.extend(overlay.query(guild_id, message, 3, query_embedding))
+        candidates.sort(key=lambda candidate: candidate[0])
+    
+    version_store = _version_stores.get(facts_collection.name)
+    relevant_facts = []
+    seen = set()
+    for distance, fact_id, fact_content in candidates:
+        if distance >= threshold or fact_id in seen:
+            continue
+        seen.add(fact_id)
+        if version_store:
+            # A learned revision waiting for the next batch is newer than what the collection holds
+            fact_content = _unapplied_content(version_store, fact_id, guild_id) or fact_content
+        relevant_facts.append((fact_id, fact_content))
+        if len(relevant_facts) == 3:
+            break
     
     return relevant_facts
 
-def update_fact(facts_collection, fact_id: str, new_content: str, logger = None):
+def get_facts(facts_collection, fact_ids: list, guild_id: int = 0) -> list:
+    """
+    Reads the current content of the given facts.
+    Args:
+        facts_collection: ChromaDB collection instance
+        fact_ids: IDs of the facts to read
+        guild_id: the server reading, whose own versions replace the shared ones
+    Returns:
+        A list of tuples (id, fact) for the facts that exist.
+    """
+    result = facts_collection.get(ids=fact_ids, include=["documents"])
+    facts = list(zip(result["ids"], result["documents"]))
+    overlay = _guild_overlays.get(facts_collection.name) if guild_id else None
+    if overlay is not None:
+        own_versions = overlay.versions(guild_id, [fact_id for fact_id, _ in facts])
+        facts = [(fact_id, own_versions.get(fact_id, content)) for fact_id, content in facts]
+    version_store = _version_stores.get(facts_collection.name)
+    if version_store:
+        facts = [(fact_id, _unapplied_content(version_store, fact_id, guild_id) or content) for fact_id, content in facts]
+    return facts
+
+def update_fact(facts_collection, fact_id: str, new_content: str, logger = None, guild_id: int = 0):
     """
     Updates an existing fact in the database.
+    With guild namespaces, a fact learned in a server is written as that server's own version and the shared fact is untouched.
     Args:
         facts_collection: ChromaDB collection instance
         fact_id: ID of the fact to update
         new_content: New content for the fact
         logger: Logger instance for tracking updates
+        guild_id: the server the fact was learned in, 0 to update the shared fact
     """
+    overlay = _guild_overlays.get(facts_collection.name) if guild_id else None
+    if overlay is not None:
+        fact_id = guild_fact_id(guild_id, fact_id)
+    
     if logger:
-        logger.info(f"Updating fact ID {fact_id}:")
-        logger.info(f"  New content: {new_content}")
+        logger.info("Updating fact ID %s:", fact_id)
+        logger.info("  New content: %s", new_content, extra=FACTS)
+    
+    version_store = _version_stores.get(facts_collection.name)
+    if version_store:
+        # Recorded as a revision; the collection and index catch up in the next batch
+        revision = version_store.record([(fact_id, new_content)], "learned")
+        if logger:
+            logger.info("Recorded fact ID %s as revision %s", fact_id, revision)
+        return
+    
+    if overlay is not None:
+        overlay.write({fact_id: new_content})
+        if logger:
+            logger.info("Successfully updated fact ID %s", fact_id)
+        return
         
     facts_collection.update(
         ids=[fact_id],
         documents=[new_content]
     )
     
+    if facts_collection.name in _fact_indexes:
+        _fact_indexes[facts_collection.name].refresh([fact_id])
+    
     if logger:
-        logger.info(f"Successfully updated fact ID {fact_id}")
\ No newline at end of file
+        logger.info("Successfully updated fact ID %s", fact_id)
\ No newline at end of file
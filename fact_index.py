@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class QueryEmbeddingCache:
+    """Recently embedded query texts, so a message is embedded once however many indexes search for it."""
+
+    def __init__(self, embedding_function, size: int = 256):
+        self._embedding_function = embedding_function
+        self._size = size
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embeds a text, reusing the embedding of identical recent text."""
+        with self._lock:
+            if text in self._embeddings:
+                self._embeddings.move_to_end(text)
+                return self._embeddings[text]
+
+        embedding = np.asarray(self._embedding_function([text])[0], dtype=np.float32)
+
+        with self._lock:
+            self._embeddings[text] = embedding
+            if len(self._embeddings) > self._size:
+                self._embeddings.popitem(last=False)
+        return embedding
+
+class FactIndex:
+    """
+    In-memory copy of a facts collection's embeddings for vectorised top-k search.
+    ChromaDB stays the source of truth; the index is refreshed whenever facts are written.
+    Queries return the same shape and distances as facts_collection.query, so relevance thresholds carry over.
+    """
+
+    def __init__(self, facts_collection, embedding_function, query_cache_size: int = 256, where: dict = None, query_cache: QueryEmbeddingCache = None):
+        self._collection = facts_collection
+        # Metadata filter, so one index can mirror a single server's slice of a shared collection
+        self._where = where
+        self._space = (facts_collection.metadata or {}).get("hnsw:space", "l2")
+        # Indexes over the same embedding model can share one cache
+        self._query_cache = query_cache or QueryEmbeddingCache(embedding_function, query_cache_size)
+        self._lock = threading.Lock()
+
+        self._ids = []
+        self._documents = []
+        self._positions = {}
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._squared_norms = np.zeros(0, dtype=np.float32)
+        self.refresh()
+
+    def refresh(self, fact_ids: list = None) -> None:
+        """
+        Reloads facts from the collection.
+        Args:
+            fact_ids: only reload these IDs, or everything if None
+        """
+        result = self._collection.get(ids=fact_ids, where=self._where, include=["embeddings", "documents"])
+
+        with self._lock:
+            if fact_ids is None:
+                ids = list(result["ids"])
+                documents = list(result["documents"])
+                embeddings = np.asarray(result["embeddings"], dtype=np.float32)
+            else:
+                ids = list(self._ids)
+                documents = list(self._documents)
+                rows = list(self._embeddings)
+                positions = {fact_id: position for position, fact_id in enumerate(ids)}
+                for fact_id, document, embedding in zip(result["ids"], result["documents"], result["embeddings"]):
+                    embedding = np.asarray(embedding, dtype=np.float32)
+                    if fact_id in positions:
+                        documents[positions[fact_id]] = document
+                        rows[positions[fact_id]] = embedding
+                    else:
+                        ids.append(fact_id)
+                        documents.append(document)
+                        rows.append(embedding)
+                embeddings = np.stack(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+
+            # Swap whole arrays so queries running on other threads always see a consistent snapshot
+            self._ids = ids
+            self._documents = documents
+            self._positions = {fact_id: position for position, fact_id in enumerate(ids)}
+            self._embeddings = embeddings
+            self._squared_norms = np.einsum("ij,ij->i", embeddings, embeddings) if len(ids) else np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def document(self, fact_id: str) -> str:
+        """Returns the indexed content of a fact, or None if the index does not hold it."""
+        with self._lock:
+            position = self._positions.get(fact_id)
+            return self._documents[position] if position is not None else None
+
+    def query(self, message: str, n_results: int, query_embedding: np.ndarray = None) -> dict:
+        """
+        Finds the nearest facts to a message.
+        Args:
+            message: the text to search for
+            n_results: maximum number of facts to return
+            query_embedding: the message's embedding, if already computed
+        Returns:
+            A dict with "ids", "documents" and "distances", each a list holding one list of results
+        """
+        with self._lock:
+            ids, documents = self._ids, self._documents
+            embeddings, squared_norms = self._embeddings, self._squared_norms
+
+        if not ids:
+            return {"ids": [[]], "documents": [[]], "distances": [[]]}
+
+        query = query_embedding if query_embedding is not None else self.embed(message)
+        distances = self._distances(query, embeddings, squared_norms)
+
+        count = min(n_results, len(ids))
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest])]
+
+        return {
+            "ids": [[ids[i] for i in nearest]],
+            "documents": [[documents[i] for i in nearest]],
+            "distances": [[float(distances[i]) for i in nearest]],
+        }
+
+    def _distances(self, query: np.ndarray, embeddings: np.ndarray, squared_norms: np.ndarray) -> np.ndarray:
+        """Computes distances using the same metric as the collection's HNSW index."""
+        dot_products = embeddings @ query
+        if self._space == "cosine":
+            norms = np.sqrt(squared_norms) * np.linalg.norm(query)
+            return 1.0 - dot_products / np.maximum(norms, 1e-12)
+        if self._space == "ip":
+            return 1.0 - dot_products
+        # Chroma's "l2" space is squared euclidean distance
+        return np.maximum(squared_norms + query @ query - 2.0 * dot_products, 0.0)
+
+    def embed(self, message: str) -> np.ndarray:
+        """Embeds a query, reusing recent embeddings of identical text."""
+        return self._query_cache.embed(message)
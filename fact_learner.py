@@ -0,0 +1,262 @@
+import asyncio
+import weakref
+from database import get_facts, update_fact
+from llm_provider import complete
+from log_pipeline import bind_request, current_request_id
+from metrics import inc, register_collector, timed
+from personas import persona_for
+from utils import run_blocking
+
+# Background fact learning state
+_queue = None
+_workers = []
+# Locks for facts being updated, per (guild, fact); an entry disappears once no worker holds or waits on it
+_fact_locks = weakref.WeakValueDictionary()
+_accepting = False
+
+def start_fact_learner(config: dict, facts_collection, logger = None) -> None:
+    """
+    Starts the background fact learning workers. Must be called from inside the running event loop.
+    Args:
+        config: configuration dictionary
+        facts_collection: ChromaDB collection instance
+        logger: Logger instance for tracking updates
+    """
+    global _queue, _workers, _accepting
+
+    learning_config = config.get('fact_learning', {})
+    _queue = asyncio.Queue(maxsize=learning_config.get('max_queue_size', 100))
+    _workers = [
+        asyncio.create_task(_worker(index, config, facts_collection, logger))
+        for index in range(learning_config.get('workers', 1))
+    ]
+    _accepting = True
+
+    if logger:
+        logger.info("Started %s fact learning worker(s)", len(_workers))
+
+async def stop_fact_learner(config: dict, logger = None) -> None:
+    """
+    Stops accepting new jobs, waits for queued jobs to finish, then stops the workers.
+    Args:
+        config: configuration dictionary
+        logger: Logger instance
+    """
+    global _queue, _workers, _accepting
+
+    if _queue is None:
+        return
+
+    _accepting = False
+    timeout = config.get('fact_learning', {}).get('shutdown_timeout', 30)
+    try:
+        await asyncio.wait_for(_queue.join(), timeout=timeout)
+    except asyncio.TimeoutError:
+        if logger:
+            logger.warning("Fact learning queue did not drain within %ss, %s job(s) dropped", timeout, _queue.qsize())
+
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+
+    _queue = None
+    _workers = []
+    if logger:
+        logger.info("Stopped fact learning workers")
+
+def enqueue_fact_job(response: str, referenced_facts: list, logger = None, guild_id: int = 0, facts_collection = None) -> bool:
+    """
+    Queues a response for background fact extraction. Never blocks the caller.
+    Args:
+        response: The bot's generated response
+        referenced_facts: List of (id, content) tuples for facts used in generating the response
+        logger: Logger instance
+        guild_id: the server the response was sent in, whose facts any updates belong to
+        facts_collection: the collection the facts came from, if not the one the workers were started with
+    Returns:
+        True if the job was queued, False if the learner is stopped or the queue is full
+    """
+    if _queue is None or not _accepting or not referenced_facts:
+        return False
+
+    try:
+        _queue.put_nowait((guild_id, current_request_id(), response, referenced_facts, facts_collection))
+    except asyncio.QueueFull:
+        # Backpressure: learning is best effort, so drop the job rather than slow down replies
+        if logger:
+            logger.warning("Fact learning queue is full (%s jobs), skipping fact extraction for this response", _queue.maxsize)
+        inc("monarch_fact_jobs_dropped_total")
+        return False
+
+    return True
+
+async def _worker(index: int, config: dict, facts_collection, logger = None) -> None:
+    """Pulls jobs off the queue and processes them in batches."""
+    learning_config = config.get('fact_learning', {})
+    batch_size = learning_config.get('batch_size', 4)
+    batch_window = learning_config.get('batch_window', 2.0)
+
+    while True:
+        batch = [await _queue.get()]
+        try:
+            # Give other replies a moment to land so they share one extraction call
+            if batch_window > 0 and _accepting:
+                await asyncio.sleep(batch_window)
+            while len(batch) < batch_size:
+                try:
+                    batch.append(_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            # One extraction per server, since each server's facts are updated separately
+            for guild_id, (responses, referenced_facts, request_ids, job_collection) in _merge_jobs(batch).items():
+                # Log lines from the extraction carry the IDs of the replies it learns from
+                bind_request("+".join(request_ids), guild_id)
+                if logger:
+                    logger.info("Fact learner %s processing %s job(s) touching %s fact(s)", index, len(responses), len(referenced_facts))
+                with timed("fact_extraction"):
+                    await _process_batch(responses, referenced_facts, job_collection or facts_collection, config, logger, guild_id)
+        except Exception as e:
+            if logger:
+                logger.error("Fact learner %s failed on a batch: %s", index, e)
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+def _merge_jobs(batch: list) -> dict:
+    """
+    Combines a batch of jobs into one list of responses and one deduplicated list of facts per server.
+    A server always talks to one persona, so its jobs share a facts collection.
+    Returns:
+        {guild_id: (responses, referenced_facts, request_ids, facts_collection)}
+    """
+    merged = {}
+    for guild_id, request_id, response, referenced_facts, facts_collection in batch:
+        responses, facts_by_id, request_ids, _ = merged.setdefault(guild_id, ([], {}, [], facts_collection))
+        responses.append(response)
+        request_ids.append(request_id)
+        for fact_id, content in referenced_facts:
+            facts_by_id[fact_id] = content
+
+    return {
+        guild_id: (responses, list(facts_by_id.items()), request_ids, facts_collection)
+        for guild_id, (responses, facts_by_id, request_ids, facts_collection) in merged.items()
+    }
+
+async def _process_batch(responses: list, referenced_facts: list, facts_collection, config: dict, logger = None, guild_id: int = 0) -> None:
+    """Locks the touched facts, refreshes their content and runs one extraction over the batch."""
+    fact_ids = sorted(fact_id for fact_id, _ in referenced_facts)
+    locks = [_fact_locks.setdefault((guild_id, fact_id), asyncio.Lock()) for fact_id in fact_ids]
+
+    # Locks are taken in sorted order so two workers touching the same facts cannot deadlock
+    for lock in locks:
+        await lock.acquire()
+    try:
+        # Another worker may have rewritten these facts since they were retrieved
+        current_facts = await run_blocking(get_facts, facts_collection, fact_ids, guild_id)
+        await extract_and_update_facts(responses, current_facts or referenced_facts, facts_collection, config, logger, guild_id)
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+async def extract_and_update_facts(responses: list, referenced_facts: list, facts_collection, config: dict, logger = None, guild_id: int = 0):
+    """
+    Analyzes the bot's responses for new details and updates existing facts.
+    Args:
+        responses: The bot's generated responses
+        referenced_facts: List of (id, content) tuples for facts used in generating the responses
+        facts_collection: ChromaDB collection instance
+        config: Configuration dictionary
+        logger: Logger instance for tracking updates
+        guild_id: the server the responses were sent in
+    """
+    if not referenced_facts or not responses:
+        return
+
+    # Create prompt for fact extraction, in the voice of the persona the server talks to
+    character = persona_for(guild_id).display_name
+    responses_text = "\n\n".join([f'"{response}"' for response in responses])
+    fact_extraction_prompt = f"""
+Analyze the following responses from {character} and determine if any of the referenced facts should be updated with new information.
+
+Referenced facts:
+{chr(10).join([f"ID {fact_id}: {content}" for fact_id, content in referenced_facts])}
+
+{character}'s responses:
+{responses_text}
+
+For each referenced fact that should be updated with new information from the responses, provide:
+- The fact ID
+- The updated fact content (incorporating the new details while preserving the original structure). Content should include a brief description as well as {character}'s feelings on it.
+
+Fact content should be no more than 200 characters long.
+Only suggest updates if the responses contain genuinely new information that would enhance the fact.
+Do not update facts just for minor rewording or stylistic changes.
+If no updates are needed, respond with "NO_UPDATES".
+
+Format your response as:
+ID: [fact_id]
+UPDATED_FACT: [new content]
+
+ID: [fact_id]
+UPDATED_FACT: [new content]
+"""
+
+    try:
+        if logger:
+            logger.info("Analyzing %s response(s) for fact updates using %s referenced facts", len(responses), len(referenced_facts))
+
+        timeout = config['llm'].get('timeout', 60)
+        extraction_response = await asyncio.wait_for(
+            # Low temperature for more consistent fact extraction
+            complete(config, [{"role": "user", "content": fact_extraction_prompt}], 0.1, logger=logger),
+            timeout=timeout
+        )
+
+        extraction_text = extraction_response.choices[0].message.content.strip()
+
+        if extraction_text != "NO_UPDATES":
+            if logger:
+                logger.info("LLM identified potential fact updates")
+
+            # Parse the response and update facts
+            known_ids = {fact_id for fact_id, _ in referenced_facts}
+            updates = []
+            current_id = None
+
+            for line in extraction_text.split('\n'):
+                line = line.strip()
+                if line.startswith('ID:'):
+                    current_id = line.replace('ID:', '').strip()
+                elif line.startswith('UPDATED_FACT:') and current_id:
+                    updates.append((current_id, line.replace('UPDATED_FACT:', '').strip()))
+                    current_id = None
+
+            updates_made = 0
+            for fact_id, new_content in updates:
+                # Only facts that were actually shown to the LLM may be rewritten
+                if fact_id not in known_ids or not new_content:
+                    if logger:
+                        logger.warning("Ignoring update for unreferenced fact ID %s", fact_id)
+                    continue
+                await run_blocking(update_fact, facts_collection, fact_id, new_content, logger, guild_id)
+                updates_made += 1
+            inc("monarch_facts_updated_total", updates_made)
+
+            if logger:
+                logger.info("Completed fact updates: %s facts updated", updates_made)
+        else:
+            if logger:
+                logger.info("No fact updates needed based on response analysis")
+
+    except Exception as e:
+        if logger:
+            logger.error("Error during fact extraction: %s", e)
+        # Silently fail to avoid disrupting the main conversation flow
+        pass
+
+def _collect_metrics() -> list:
+    """Reports the learning queue depth at scrape time."""
+    return [("monarch_fact_queue_depth", "gauge", {}, _queue.qsize() if _queue else 0)]
+
+register_collector(_collect_metrics)
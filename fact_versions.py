@@ -0,0 +1,250 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from config import load_config
+
+def guild_fact_id(guild_id: int, fact_id: str) -> str:
+    """Returns the ID of a server's own version of a base fact, e.g. "g1234:7"."""
+    return f"g{guild_id}:{fact_id}"
+
+def split_fact_id(fact_id: str) -> tuple:
+    """
+    Returns:
+        A tuple (guild_id, base_fact_id), with guild_id None for a base fact
+    """
+    if fact_id.startswith("g") and ":" in fact_id:
+        guild_part, base_id = fact_id.split(":", 1)
+        if guild_part[1:].isdigit():
+            return int(guild_part[1:]), base_id
+    return None, fact_id
+
+class FactVersionStore:
+    """
+    Append-only log of fact revisions in SQLite, in front of the facts collection.
+    Learned updates are recorded here first and applied to the collection in periodic batches;
+    any earlier state of the lore can be rebuilt from the log. Safe to call from worker threads.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        # Latest unapplied (revision, content) per fact written by this process, so reads see it before the next batch
+        self._unapplied = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("PRAGMA busy_timeout=5000")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fact_revisions ("
+            "revision INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "fact_id TEXT NOT NULL, "
+            "content TEXT NOT NULL, "
+            "source TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "applied INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS fact_revisions_by_fact ON fact_revisions (fact_id, revision)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS fact_revisions_unapplied ON fact_revisions (revision) WHERE applied = 0")
+
+    def _insert(self, rows: list) -> int:
+        """Inserts revision rows in one transaction. Must hold the lock. Returns the last revision number."""
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(
+                "INSERT INTO fact_revisions (fact_id, content, source, created_at, applied) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            revision = self._connection.execute("SELECT MAX(revision) FROM fact_revisions").fetchone()[0]
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+        return revision or 0
+
+    def record(self, revisions: list, source: str) -> int:
+        """
+        Appends new revisions, to be applied to the collection in the next batch.
+        Args:
+            revisions: list of (fact_id, content) tuples
+            source: what produced the revisions, e.g. "learned" or "rollback to 12"
+        Returns:
+            The newest revision number
+        """
+        now = time.time()
+        with self._lock:
+            revision = self._insert([(fact_id, content, source, now, 0) for fact_id, content in revisions])
+            for fact_id, content in revisions:
+                self._unapplied[fact_id] = (revision, content)
+        return revision
+
+    def record_baseline(self, facts: list) -> int:
+        """
+        Records the current content of facts that have no revisions yet, as already applied.
+        Without a baseline, rolling back could not restore a fact's original text.
+        Returns:
+            Number of facts recorded
+        """
+        with self._lock:
+            known = {row[0] for row in self._connection.execute("SELECT DISTINCT fact_id FROM fact_revisions")}
+            rows = [(fact_id, content, "baseline", time.time(), 1) for fact_id, content in facts if fact_id not in known]
+            if rows:
+                self._insert(rows)
+        return len(rows)
+
+    def unapplied_content(self, fact_id: str) -> str:
+        """Returns content recorded by this process but not yet applied to the collection, or None."""
+        entry = self._unapplied.get(fact_id)
+        return entry[1] if entry else None
+
+    def pending(self) -> tuple:
+        """
+        Returns:
+            A tuple (newest_revision, {fact_id: content}) with the latest unapplied content of each fact
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT revision, fact_id, content FROM fact_revisions WHERE applied = 0 ORDER BY revision"
+            ).fetchall()
+        contents = {fact_id: content for _, fact_id, content in rows}
+        return (rows[-1][0] if rows else 0), contents
+
+    def mark_applied(self, revision: int) -> None:
+        """
+        Marks every revision up to and including revision as applied to the collection, and forgets this process's
+        unapplied content for anything the log now has applied, including batches applied by another process.
+        """
+        with self._lock:
+            if revision:
+                self._connection.execute("UPDATE fact_revisions SET applied = 1 WHERE applied = 0 AND revision <= ?", (revision,))
+            oldest_unapplied = self._connection.execute("SELECT MIN(revision) FROM fact_revisions WHERE applied = 0").fetchone()[0]
+            # A newer revision of the fact, e.g. a rollback, may have replaced this content; it is stale either way
+            for fact_id, (fact_revision, _) in list(self._unapplied.items()):
+                if oldest_unapplied is None or fact_revision < oldest_unapplied:
+                    del self._unapplied[fact_id]
+
+    def head(self) -> int:
+        """Returns the newest revision number, 0 if the log is empty."""
+        with self._lock:
+            return self._connection.execute("SELECT MAX(revision) FROM fact_revisions").fetchone()[0] or 0
+
+    def state_at(self, revision: int) -> dict:
+        """
+        Rebuilds the lore as it was right after a revision.
+        Returns:
+            {fact_id: content} for every fact that existed at that revision
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT fact_id, content FROM fact_revisions WHERE revision IN ("
+                "SELECT MAX(revision) FROM fact_revisions WHERE revision <= ? GROUP BY fact_id)",
+                (revision,)
+            ).fetchall()
+        return dict(rows)
+
+    def rollback(self, revision: int) -> int:
+        """
+        Restores the lore to how it was right after a revision, by appending revisions for every fact that differs.
+        The log stays append-only, so a rollback can itself be undone.
+        Returns:
+            Number of facts changed
+        """
+        target = self.state_at(revision)
+        current = self.state_at(self.head())
+        changed = [(fact_id, content) for fact_id, content in target.items() if current.get(fact_id) != content]
+        for fact_id, content in current.items():
+            # A server version learned after the revision goes back to the base fact as it was then
+            guild_id, base_id = split_fact_id(fact_id)
+            if fact_id not in target and guild_id is not None and base_id in target and target[base_id] != content:
+                changed.append((fact_id, target[base_id]))
+        if changed:
+            self.record(changed, f"rollback to {revision}")
+        return len(changed)
+
+    def history(self, fact_id: str = None, limit: int = 50) -> list:
+        """Returns the newest revisions, optionally for one fact, as (revision, fact_id, content, source, created_at, applied) rows."""
+        query = "SELECT revision, fact_id, content, source, created_at, applied FROM fact_revisions"
+        params = ()
+        if fact_id is not None:
+            query += " WHERE fact_id = ?"
+            params = (fact_id,)
+        with self._lock:
+            return self._connection.execute(query + " ORDER BY revision DESC LIMIT ?", params + (limit,)).fetchall()
+
+    def compact(self, keep_revisions: int) -> int:
+        """
+        Deletes applied revisions beyond the newest keep_revisions of each fact.
+        Rollback then reaches back as far as the oldest kept revision of each fact.
+        Returns:
+            Number of revisions deleted
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM fact_revisions WHERE applied = 1 AND revision IN ("
+                "SELECT revision FROM ("
+                "SELECT revision, ROW_NUMBER() OVER (PARTITION BY fact_id ORDER BY revision DESC) AS position "
+                "FROM fact_revisions) WHERE position > ?)",
+                (max(1, keep_revisions),)
+            )
+            return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+def create_fact_version_store(config: dict, collection_name: str = None) -> FactVersionStore:
+    """
+    Opens the revision log at config['fact_versions']['path'], or returns None if versioning is off.
+    Collections other than database.collection_name, e.g. other personas' facts, get their own log next to it.
+    """
+    versions_config = config.get('fact_versions', {})
+    if not versions_config.get('enabled', False):
+        return None
+    path = versions_config.get('path', './db/fact_versions.sqlite3')
+    if collection_name and collection_name != config['database']['collection_name']:
+        root, extension = os.path.splitext(path)
+        path = f"{root}-{collection_name}{extension}"
+    return FactVersionStore(path)
+
+def main():
+    """Command line entry point for inspecting and rolling back fact revisions."""
+    parser = argparse.ArgumentParser(description="Inspect, roll back and compact the fact revision log.")
+    parser.add_argument("--config", default="config.yaml", help="configuration file")
+    parser.add_argument("--collection", help="facts collection whose log to use, defaults to database.collection_name")
+    commands = parser.add_subparsers(dest="command", required=True)
+    history_parser = commands.add_parser("history", help="list recent revisions")
+    history_parser.add_argument("--fact", help="only show revisions of this fact ID")
+    history_parser.add_argument("--limit", type=int, default=50, help="number of revisions to show")
+    rollback_parser = commands.add_parser("rollback", help="restore the lore to how it was after a revision")
+    rollback_parser.add_argument("revision", type=int, help="revision number to restore")
+    compact_parser = commands.add_parser("compact", help="delete old applied revisions")
+    compact_parser.add_argument("--keep", type=int, help="revisions to keep per fact")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    config.setdefault('fact_versions', {})['enabled'] = True
+    # Paths in the config are relative to the bot's directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    store = create_fact_version_store(config, args.collection)
+
+    try:
+        if args.command == "history":
+            for revision, fact_id, content, source, created_at, applied in store.history(args.fact, args.limit):
+                timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created_at))
+                print(f"{revision:>6}  {timestamp}  fact {fact_id:<6} {source:<16} {'' if applied else '(pending) '}{content}")
+        elif args.command == "rollback":
+            changed = store.rollback(args.revision)
+            # The running bot, or the next one to start, applies these with its next batch
+            print(f"Recorded {changed} fact revisions restoring revision {args.revision}")
+        elif args.command == "compact":
+            keep = args.keep or config['fact_versions'].get('keep_revisions', 20)
+            print(f"Deleted {store.compact(keep)} old revisions")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
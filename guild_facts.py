@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+from fact_index import FactIndex, QueryEmbeddingCache
+from fact_versions import guild_fact_id, split_fact_id
+
+class GuildFactOverlay:
+    """
+    Per-server versions of base facts, kept in one overlay collection tagged with guild_id metadata.
+    A server only ever searches its own slice (a metadata filter, or a small in-memory index), so retrieval cost
+    depends on how much that server has learned rather than on how many servers there are.
+    """
+
+    def __init__(self, overlay_collection, embedding_function, use_index: bool = True, index_cache_size: int = 1000, query_cache: QueryEmbeddingCache = None):
+        self.collection = overlay_collection
+        self._embedding_function = embedding_function
+        self._use_index = use_index
+        self._index_cache_size = index_cache_size
+        # Shared by every server's index, so a message is embedded once
+        self._query_cache = query_cache or QueryEmbeddingCache(embedding_function)
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Servers with at least one fact of their own; the rest skip the overlay entirely
+        result = overlay_collection.get(include=["metadatas"])
+        self._guilds = {metadata["guild_id"] for metadata in result["metadatas"] if metadata and "guild_id" in metadata}
+
+    def has_facts(self, guild_id: int) -> bool:
+        return guild_id in self._guilds
+
+    def _index(self, guild_id: int) -> FactIndex:
+        """Returns the server's in-memory index, loading it on first use and dropping the least recently used."""
+        with self._lock:
+            fact_index = self._indexes.get(guild_id)
+            if fact_index is not None:
+                self._indexes.move_to_end(guild_id)
+                return fact_index
+
+        fact_index = FactIndex(self.collection, self._embedding_function, where={"guild_id": guild_id}, query_cache=self._query_cache)
+        with self._lock:
+            self._indexes[guild_id] = fact_index
+            while len(self._indexes) > self._index_cache_size:
+                self._indexes.popitem(last=False)
+        return fact_index
+
+    def query(self, guild_id: int, message: str, n_results: int, query_embedding = None) -> list:
+        """
+        Finds the server's own facts nearest to a message.
+        Returns:
+            A list of (distance, base_fact_id, content) tuples, nearest first
+        """
+        if guild_id not in self._guilds:
+            return []
+
+        if self._use_index:
+            result = self._index(guild_id).query(message, n_results, query_embedding)
+        else:
+            query = {"query_embeddings": [query_embedding]} if query_embedding is not None else {"query_texts": [message]}
+            result = self.collection.query(
+                where={"guild_id": guild_id},
+                include=["documents", "distances"],
+                n_results=n_results,
+                **query
+            )
+
+        return [
+            (distance, split_fact_id(fact_id)[1], document)
+            for fact_id, document, distance in zip(result["ids"][0], result["documents"][0], result["distances"][0])
+        ]
+
+    def versions(self, guild_id: int, fact_ids: list) -> dict:
+        """
+        Returns:
+            {base_fact_id: content} for the given base facts that this server has its own version of
+        """
+        if guild_id not in self._guilds or not fact_ids:
+            return {}
+
+        overlay_ids = [guild_fact_id(guild_id, fact_id) for fact_id in fact_ids]
+        if self._use_index:
+            fact_index = self._index(guild_id)
+            documents = {split_fact_id(overlay_id)[1]: fact_index.document(overlay_id) for overlay_id in overlay_ids}
+            return {fact_id: document for fact_id, document in documents.items() if document is not None}
+
+        result = self.collection.get(ids=overlay_ids, include=["documents"])
+        return {split_fact_id(overlay_id)[1]: document for overlay_id, document in zip(result["ids"], result["documents"])}
+
+    def write(self, contents: dict) -> None:
+        """
+        Upserts server versions of facts and refreshes the affected indexes.
+        Args:
+            contents: {overlay_fact_id: content}, with IDs from guild_fact_id
+        """
+        overlay_ids = list(contents)
+        metadatas = []
+        for overlay_id in overlay_ids:
+            guild_id, fact_id = split_fact_id(overlay_id)
+            metadatas.append({"guild_id": guild_id, "base_id": fact_id})
+
+        self.collection.upsert(ids=overlay_ids, documents=[contents[overlay_id] for overlay_id in overlay_ids], metadatas=metadatas)
+
+        by_guild = {}
+        for overlay_id, metadata in zip(overlay_ids, metadatas):
+            by_guild.setdefault(metadata["guild_id"], []).append(overlay_id)
+        for guild_id, guild_ids in by_guild.items():
+            self._guilds.add(guild_id)
+            with self._lock:
+                fact_index = self._indexes.get(guild_id)
+            if fact_index is not None:
+                fact_index.refresh(guild_ids)
+
+    def refresh(self) -> None:
+        """Reloads the server list and every loaded index, for when other processes write to a shared server."""
+        result = self.collection.get(include=["metadatas"])
+        self._guilds = {metadata["guild_id"] for metadata in result["metadatas"] if metadata and "guild_id" in metadata}
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for fact_index in indexes:
+            fact_index.refresh()
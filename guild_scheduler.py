@@ -0,0 +1,82 @@
+import asyncio
+
+# One lock per server, held for every change to that server's daily state and chat history
+_locks = {}
+# Mentions waiting for the next batch, per server: list of (item, future)
+_pending_mentions = {}
+# Task draining each server's pending mentions
+_drain_tasks = {}
+
+def guild_lock(server_id: int) -> asyncio.Lock:
+    """Returns the lock that serialises work for a server."""
+    lock = _locks.get(server_id)
+    if lock is None:
+        lock = _locks[server_id] = asyncio.Lock()
+    return lock
+
+def release_guild(server_id: int) -> bool:
+    """
+    Forgets a server's lock if it has no work queued or running, so idle servers hold no scheduler state.
+    Returns:
+        True if the server was idle and released
+    """
+    lock = _locks.get(server_id)
+    task = _drain_tasks.get(server_id)
+    if (lock is not None and lock.locked()) or _pending_mentions.get(server_id) or (task is not None and not task.done()):
+        return False
+
+    _locks.pop(server_id, None)
+    _drain_tasks.pop(server_id, None)
+    return True
+
+async def submit_mention(server_id: int, item, process_batch, coalesce_window: float = 0.0):
+    """
+    Queues a mention and waits until the batch it ends up in has been handled.
+    A mention to an idle server is handled straight away; mentions that arrive while the server is busy are handled as one batch.
+    Args:
+        server_id: the id of the discord server
+        item: whatever process_batch needs to know about this mention
+        process_batch: coroutine function called with a list of items while the server's lock is held
+        coalesce_window: extra seconds to keep gathering mentions once a busy server frees up
+    Returns:
+        Whatever process_batch returned for the batch
+    """
+    future = asyncio.get_running_loop().create_future()
+    _pending_mentions.setdefault(server_id, []).append((item, future))
+
+    task = _drain_tasks.get(server_id)
+    if task is None or task.done():
+        _drain_tasks[server_id] = asyncio.create_task(_drain(server_id, process_batch, coalesce_window))
+
+    return await future
+
+async def _drain(server_id: int, process_batch, coalesce_window: float) -> None:
+    """Handles batches of pending mentions for one server until none are left."""
+    lock = guild_lock(server_id)
+    busy = lock.locked()
+    while _pending_mentions.get(server_id):
+        # Only mentions that piled up behind other work are worth waiting on; an idle server answers at once
+        if busy and coalesce_window > 0:
+            await asyncio.sleep(coalesce_window)
+
+        async with lock:
+            batch = _pending_mentions.pop(server_id, [])
+            if not batch:
+                continue
+
+            try:
+                result = await process_batch([item for item, _ in batch])
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(result)
+        # Anything queued now arrived while this batch was being answered
+        busy = True
@@ -0,0 +1,162 @@
+import sys
+from dataclasses import dataclass, field
+from typing import ClassVar
+
+class ChatHistory:
+    """
+    Chat turns held in a growable ring buffer of parallel role and content lists, instead of one dict per turn.
+    Roles are interned, so every "user" and "assistant" is the same string object.
+    Iterating or indexing yields {"role", "content"} dicts, built on demand, so it reads like the old list of dicts.
+    """
+
+    __slots__ = ("_roles", "_contents", "_start", "_size")
+
+    def __init__(self, turns: list = (), capacity: int = 0):
+        # Empty histories hold no buffer at all; most idle servers have none
+        capacity = max(capacity, len(turns))
+        self._roles = [None] * capacity
+        self._contents = [None] * capacity
+        self._start = 0
+        self._size = 0
+        for turn in turns:
+            self.append(turn["role"], turn["content"])
+
+    def append(self, role: str, content: str) -> None:
+        """Adds a turn at the newest end."""
+        if self._size == len(self._roles):
+            self._resize(max(8, len(self._roles) * 2))
+        index = (self._start + self._size) % len(self._roles)
+        self._roles[index] = sys.intern(role)
+        self._contents[index] = content
+        self._size += 1
+
+    def popleft(self, count: int) -> list:
+        """Removes and returns up to count of the oldest turns, as dicts."""
+        count = min(count, self._size)
+        evicted = []
+        capacity = len(self._roles)
+        for _ in range(count):
+            evicted.append({"role": self._roles[self._start], "content": self._contents[self._start]})
+            # Drop the references so the strings can be freed
+            self._roles[self._start] = None
+            self._contents[self._start] = None
+            self._start = (self._start + 1) % capacity
+            self._size -= 1
+        if capacity > 8 and self._size * 4 <= capacity:
+            self._resize(max(8, capacity // 2))
+        return evicted
+
+    def clear(self) -> None:
+        """Removes every turn and releases the buffer."""
+        self._roles = []
+        self._contents = []
+        self._start = 0
+        self._size = 0
+
+    def to_list(self) -> list:
+        """Returns the turns as a list of dicts, oldest first."""
+        return list(self)
+
+    def _resize(self, capacity: int) -> None:
+        """Moves the turns into buffers of a new capacity, oldest first."""
+        roles = [None] * capacity
+        contents = [None] * capacity
+        old_capacity = len(self._roles)
+        for offset in range(self._size):
+            index = (self._start + offset) % old_capacity
+            roles[offset] = self._roles[index]
+            contents[offset] = self._contents[index]
+        self._roles = roles
+        self._contents = contents
+        self._start = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __iter__(self):
+        capacity = len(self._roles)
+        for offset in range(self._size):
+            index = (self._start + offset) % capacity
+            yield {"role": self._roles[index], "content": self._contents[index]}
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[offset] for offset in range(*position.indices(self._size))]
+        if position < 0:
+            position += self._size
+        if not 0 <= position < self._size:
+            raise IndexError("chat history index out of range")
+        index = (self._start + position) % len(self._roles)
+        return {"role": self._roles[index], "content": self._contents[index]}
+
+    def __repr__(self) -> str:
+        return f"ChatHistory({self.to_list()!r})"
+
+@dataclass(slots=True)
+class GuildState:
+    """
+    One server's state in a compact slotted object.
+    Supports dict-style access (state['responses_sent']) for the persisted fields, so callers treat it like the old dict.
+    """
+
+    last_answered_question_date: str = ""
+    responses_sent: int = 0
+    chat_history: ChatHistory = field(default_factory=ChatHistory)
+    peasant_unrest_percentage: int = 0
+    active_summary: str = ""
+    # Day of the last midnight rollover, in the server's timezone
+    last_reset_date: str = ""
+    # When the server last had a message, on the monotonic clock; not persisted
+    last_active: float = 0.0
+
+    PERSISTED: ClassVar[tuple] = (
+        "last_answered_question_date",
+        "responses_sent",
+        "chat_history",
+        "peasant_unrest_percentage",
+        "active_summary",
+        "last_reset_date",
+    )
+
+    @classmethod
+    def from_dict(cls, stored: dict) -> "GuildState":
+        """Builds a state from a stored dict, ignoring unknown keys."""
+        state = cls()
+        for key, value in stored.items():
+            if key in cls.PERSISTED:
+                state[key] = value
+        return state
+
+    def to_dict(self) -> dict:
+        """Returns the persisted fields as plain JSON-friendly values."""
+        return {key: self.chat_history.to_list() if key == "chat_history" else getattr(self, key) for key in self.PERSISTED}
+
+    def keys(self) -> tuple:
+        return self.PERSISTED
+
+    def items(self) -> list:
+        return [(key, self[key]) for key in self.PERSISTED]
+
+    def get(self, key: str, default = None):
+        return getattr(self, key) if key in self.PERSISTED else default
+
+    def __getitem__(self, key: str):
+        if key not in self.PERSISTED:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.PERSISTED:
+            raise KeyError(key)
+        if key == "chat_history" and not isinstance(value, ChatHistory):
+            value = ChatHistory(value)
+        elif key in ("last_answered_question_date", "last_reset_date"):
+            # Every server answering today holds the same date string
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.PERSISTED
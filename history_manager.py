@@ -0,0 +1,135 @@
+import asyncio
+from llm_provider import complete
+from log_pipeline import CONTENT
+from metrics import TOKEN_BUCKETS, observe
+from personas import persona_for
+from server_manager import pop_oldest_chat_turns, update_server_state
+from utils import lazy_import
+
+litellm = lazy_import("litellm")
+
+# Turns evicted from chat history that are waiting to be folded into the summary, per server
+_pending_turns = {}
+# Running summariser task per server
+_summary_tasks = {}
+# Prompt size metrics across all requests
+prompt_token_stats = {
+    "requests": 0,
+    "total_tokens": 0,
+    "max_tokens": 0,
+    "last_tokens": 0,
+}
+
+def count_tokens(config: dict, messages: list) -> int:
+    """Counts the prompt tokens of a list of chat messages for the configured model."""
+    return litellm.token_counter(model=config['llm']['model'], messages=messages)
+
+def trim_history(server_id: int, server_state: dict, config: dict, logger = None) -> int:
+    """
+    Evicts the oldest chat turns until the history fits in the configured token budget.
+    Evicted turns are summarised into active_summary in the background.
+    Args:
+        server_id: the id of the discord server
+        server_state: server state
+        config: configuration dictionary
+        logger: Logger instance
+    Returns:
+        Number of turns evicted
+    """
+    max_tokens = config.get('history', {}).get('max_tokens', 2000)
+    # One list of turn dicts for token counting; the stored history keeps turns in a compact ring buffer
+    history = list(server_state['chat_history'])
+
+    evict_count = 0
+    tokens = count_tokens(config, history) if history else 0
+    while evict_count < len(history) and tokens > max_tokens:
+        tokens -= count_tokens(config, [history[evict_count]])
+        evict_count += 1
+
+    if not evict_count:
+        return 0
+
+    evicted = pop_oldest_chat_turns(server_id, evict_count)
+    day = _conversation_day(server_state)
+    pending = _pending_turns.get(server_id)
+    if not pending or pending['day'] != day:
+        # Turns left over from a previous day belong to a conversation that was already reset
+        pending = _pending_turns[server_id] = {"day": day, "turns": []}
+    pending['turns'].extend(evicted)
+
+    if logger:
+        logger.info("Evicted %s chat turns for server %s, history is now %s tokens", evict_count, server_id, tokens)
+
+    task = _summary_tasks.get(server_id)
+    if task is None or task.done():
+        _summary_tasks[server_id] = asyncio.create_task(_summarise(server_id, server_state, config, logger))
+
+    return evict_count
+
+def record_prompt_tokens(server_id: int, tokens: int, logger = None) -> None:
+    """Records the size of a prompt sent to the LLM."""
+    prompt_token_stats["requests"] += 1
+    prompt_token_stats["total_tokens"] += tokens
+    prompt_token_stats["max_tokens"] = max(prompt_token_stats["max_tokens"], tokens)
+    prompt_token_stats["last_tokens"] = tokens
+    observe("monarch_prompt_tokens", tokens, buckets=TOKEN_BUCKETS)
+
+    if logger:
+        average = prompt_token_stats["total_tokens"] / prompt_token_stats["requests"]
+        logger.info("Prompt tokens for server %s: %s (average %.0f, max %s)", server_id, tokens, average, prompt_token_stats['max_tokens'])
+
+def _conversation_day(server_state) -> tuple:
+    """Identifies the server's current conversation; it changes whenever a QOTD or the midnight rollover clears the history."""
+    return (server_state['last_answered_question_date'], server_state['last_reset_date'])
+
+async def _summarise(server_id: int, server_state, config: dict, logger = None) -> None:
+    """Folds pending evicted turns into the server's active summary until none are left."""
+    while _pending_turns.get(server_id, {}).get('turns'):
+        pending = _pending_turns.pop(server_id)
+
+        if pending['day'] != _conversation_day(server_state):
+            continue
+
+        try:
+            summary = await _summarise_turns(server_state['active_summary'], pending['turns'], config, persona_for(server_id).display_name)
+        except Exception as e:
+            if logger:
+                logger.error("Error summarising chat history for server %s: %s", server_id, e)
+            # Put the turns back ahead of anything evicted since, so the next trim_history retries them
+            queued = _pending_turns.get(server_id)
+            if pending['day'] == _conversation_day(server_state) and (not queued or queued['day'] == pending['day']):
+                pending['turns'].extend(queued['turns'] if queued else [])
+                _pending_turns[server_id] = pending
+            return
+
+        # The day may have rolled over while the summariser was waiting on the LLM
+        if pending['day'] == _conversation_day(server_state):
+            update_server_state(server_id, active_summary=summary)
+            if logger:
+                logger.info("Updated chat summary for server %s: %s", server_id, summary, extra=CONTENT)
+
+async def _summarise_turns(current_summary: str, turns: list, config: dict, character: str) -> str:
+    """Asks the LLM to extend the running summary with the given turns."""
+    max_words = config.get('history', {}).get('summary_max_words', 150)
+    transcript = "\n".join([f"{turn['role']}: {turn['content']}" for turn in turns])
+
+    summary_prompt = f"""
+Update the running summary of a discord conversation with {character} (the assistant).
+
+Current summary:
+{current_summary or "(none)"}
+
+New messages:
+{transcript}
+
+Write the updated summary in {max_words} words or fewer. Keep names, questions asked, and anything {character} revealed about themselves.
+Respond with the summary only.
+"""
+
+    timeout = config['llm'].get('timeout', 60)
+    response = await asyncio.wait_for(
+        complete(config, [{"role": "user", "content": summary_prompt}], 0.2),
+        timeout=timeout
+    )
+
+    return response.choices[0].message.content.strip()
@@ -0,0 +1,155 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+from config import load_config
+from database import initialize_database, persona_collection
+from personas import get_persona
+
+# Embedding model loaded once per worker process
+_worker_embedding_function = None
+
+def read_facts(path: str):
+    """
+    Streams (id, document) pairs from a JSONL or YAML lore pack.
+    Each record is a mapping with a "document" (or "fact") and an optional "id".
+    Records without an id get one from the file name and their position.
+    """
+    prefix = os.path.splitext(os.path.basename(path))[0]
+
+    if path.endswith((".yaml", ".yml")):
+        with open(path, 'r') as f:
+            data = yaml.safe_load(f) or []
+        records = data.get('facts', []) if isinstance(data, dict) else data
+    else:
+        records = _read_jsonl(path)
+
+    for index, record in enumerate(records):
+        document = record.get('document') or record.get('fact')
+        if not document:
+            continue
+        yield str(record.get('id') or f"{prefix}-{index + 1}"), document
+
+def _read_jsonl(path: str):
+    """Yields one parsed record per non-empty line."""
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def _batched(iterable, size: int):
+    """Yields lists of up to size items."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def _init_worker():
+    """Loads the embedding model in a worker process."""
+    global _worker_embedding_function
+
+    from chromadb.utils import embedding_functions
+    _worker_embedding_function = embedding_functions.DefaultEmbeddingFunction()
+
+def _embed_batch(batch: list) -> tuple:
+    """Embeds a batch of (id, document) pairs in a worker process."""
+    ids = [fact_id for fact_id, _ in batch]
+    documents = [document for _, document in batch]
+    embeddings = [[float(value) for value in embedding] for embedding in _worker_embedding_function(documents)]
+    return ids, documents, embeddings
+
+def _load_checkpoint(checkpoint_path: str) -> int:
+    """Returns how many records a previous run already ingested."""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, 'r') as f:
+        return json.load(f).get('ingested', 0)
+
+def _save_checkpoint(checkpoint_path: str, ingested: int) -> None:
+    """Atomically records how many records have been ingested."""
+    if not checkpoint_path:
+        return
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({"ingested": ingested}, f)
+    os.replace(temp_path, checkpoint_path)
+
+def ingest_facts(config: dict, path: str, batch_size: int = 256, workers: int = 4, checkpoint_path: str = None, persona: str = None) -> int:
+    """
+    Embeds facts from a lore pack across a process pool and bulk upserts them into the facts collection.
+    Batches are upserted in file order so the checkpoint always marks a contiguous prefix of the file.
+    Args:
+        config: configuration dictionary
+        path: JSONL or YAML file of facts
+        batch_size: facts embedded and upserted per batch
+        workers: embedding worker processes
+        checkpoint_path: file used to resume an interrupted run, or None to always start over
+        persona: name of the persona whose collection to fill, or None for the default persona
+    Returns:
+        Number of facts ingested by this run
+    """
+    facts_collection = initialize_database(config)
+    if persona:
+        facts_collection = persona_collection(get_persona(persona))
+
+    ingested = _load_checkpoint(checkpoint_path)
+    if ingested:
+        print(f"Resuming after {ingested} facts")
+
+    batches = _batched(itertools.islice(read_facts(path), ingested, None), batch_size)
+    start_time = time.monotonic()
+    count = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        # Keep a bounded number of batches in flight so large files never sit in memory at once
+        in_flight = deque()
+        for batch in itertools.islice(batches, workers * 2):
+            in_flight.append(pool.submit(_embed_batch, batch))
+
+        while in_flight:
+            ids, documents, embeddings = in_flight.popleft().result()
+            next_batch = next(batches, None)
+            if next_batch:
+                in_flight.append(pool.submit(_embed_batch, next_batch))
+
+            facts_collection.upsert(ids=ids, documents=documents, embeddings=embeddings)
+            count += len(ids)
+            ingested += len(ids)
+            _save_checkpoint(checkpoint_path, ingested)
+
+            elapsed = time.monotonic() - start_time
+            print(f"Ingested {ingested} facts ({count / elapsed:.1f} facts/s)")
+
+    elapsed = time.monotonic() - start_time
+    if count:
+        print(f"Done: {count} facts in {elapsed:.1f}s ({count / elapsed:.1f} facts/s)")
+    else:
+        print("Nothing to ingest")
+    return count
+
+def main():
+    """Command line entry point for fact ingestion."""
+    parser = argparse.ArgumentParser(description="Bulk load character facts into the facts collection.")
+    parser.add_argument("path", help="JSONL or YAML file of facts")
+    parser.add_argument("--config", default="config.yaml", help="configuration file")
+    parser.add_argument("--batch-size", type=int, default=256, help="facts embedded and upserted per batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="embedding worker processes")
+    parser.add_argument("--checkpoint", help="checkpoint file used to resume an interrupted run")
+    parser.add_argument("--persona", help="persona whose facts collection to fill, defaults to personas.default")
+    args = parser.parse_args()
+
+    # initialize_database changes the working directory, so resolve paths first
+    path = os.path.abspath(args.path)
+    checkpoint_path = os.path.abspath(args.checkpoint) if args.checkpoint else None
+    config = load_config(args.config)
+    # No point mirroring the collection in memory for a one-off load
+    config['database']['in_memory_index'] = False
+
+    ingest_facts(config, path, args.batch_size, args.workers, checkpoint_path, args.persona)
+
+if __name__ == "__main__":
+    main()
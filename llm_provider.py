@@ -0,0 +1,341 @@
+import asyncio
+import os
+import random
+import time
+from metrics import inc, register_collector
+from utils import lazy_import
+
+# litellm takes seconds to import, so it is loaded on first use or by the startup warm-up
+litellm = lazy_import("litellm")
+
+class LLMUnavailableError(Exception):
+    """Raised when every provider, and the fallback, failed or was unavailable."""
+
+class TokenBucket:
+    """Allows `rate` requests per minute on average, with bursts of up to `burst` requests."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate / 60.0
+        self.capacity = burst or max(1.0, rate / 6.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a request may be sent, 0 if one may be sent now."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self) -> bool:
+        """Takes a token if one is available."""
+        if self.wait_time() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def drain(self) -> None:
+        """Empties the bucket, e.g. after the provider answered 429."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a provider after `failure_threshold` consecutive failures.
+    After `reset_after` seconds a single trial request is let through; success closes the breaker again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Returns True if a request may be sent now."""
+        state = self.state
+        if state == "closed":
+            return True
+        return state == "half_open" and not self._trial_in_flight
+
+    def start(self) -> None:
+        """Notes that a request was sent."""
+        if self.opened_at is not None:
+            self._trial_in_flight = True
+
+    def cancel(self) -> None:
+        """Notes that a request was abandoned without an answer either way."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class Provider:
+    """One model/key combination requests can be sent to."""
+
+    def __init__(self, settings: dict, breaker_settings: dict, web_search: bool = True):
+        self.model = settings['model']
+        self.name = settings.get('name', self.model)
+        self.weight = settings.get('weight', 1)
+        self.web_search = settings.get('web_search', web_search)
+        self.api_key = os.getenv(settings['api_key_env']) if settings.get('api_key_env') else None
+        self.api_base = settings.get('api_base')
+        self.bucket = TokenBucket(settings['rate_limit'], settings.get('burst')) if settings.get('rate_limit') else None
+        self.breaker = CircuitBreaker(breaker_settings.get('failure_threshold', 5), breaker_settings.get('reset_after', 30))
+
+    def available(self) -> bool:
+        """Returns True if the breaker allows a request and the rate limit has room for one."""
+        return self.breaker.allow() and (self.bucket is None or self.bucket.wait_time() == 0)
+
+    def request_kwargs(self) -> dict:
+        kwargs = {"model": self.model}
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        return kwargs
+
+# Providers requests are spread across, and the cheaper model used when they are slow or down
+_providers = []
+_fallback = None
+
+def configure_providers(config: dict) -> None:
+    """
+    Builds the provider pool from config['llm']['providers'], or a single provider from config['llm']['model'].
+    Breaker and rate limit state starts fresh.
+    """
+    global _providers, _fallback
+
+    llm_config = config['llm']
+    breaker_settings = llm_config.get('circuit_breaker', {})
+    web_search = llm_config.get('web_search', {}).get('enabled', True)
+    provider_settings = llm_config.get('providers') or [{"model": llm_config['model']}]
+
+    _providers = [Provider(settings, breaker_settings, web_search) for settings in provider_settings]
+    fallback_settings = llm_config.get('fallback', {})
+    _fallback = Provider(dict(fallback_settings, name="fallback"), breaker_settings, False) if fallback_settings.get('model') else None
+
+def warm_up_llm() -> None:
+    """Imports litellm ahead of the first request."""
+    getattr(litellm, "acompletion")
+
+def _choose_provider(tried: list, allow_repeat: bool = False) -> Provider:
+    """
+    Picks an available provider by weight, preferring ones not already tried for this request.
+    With allow_repeat, a provider already in flight may be picked again, which is still worth it for a hedge.
+    """
+    available = [provider for provider in _providers if provider.available()]
+    untried = [provider for provider in available if provider not in tried]
+    candidates = untried or (available if allow_repeat else [])
+    if not candidates:
+        return None
+    return random.choices(candidates, weights=[provider.weight for provider in candidates])[0]
+
+def _next_available_in(tried: list) -> float:
+    """Seconds until an untried, rate-limited provider can take a request, or None if there is none."""
+    waits = [
+        provider.bucket.wait_time() for provider in _providers
+        if provider not in tried and provider.bucket and provider.breaker.allow()
+    ]
+    return min(waits) if waits else None
+
+async def _attempt(provider: Provider, request: dict, stream: bool, timeout: float):
+    """
+    Sends one request to a provider.
+    Returns:
+        The response, or for streams the first chunk and the stream, so a stream only wins the race once it is producing
+    """
+    if provider.bucket:
+        provider.bucket.take()
+    provider.breaker.start()
+    kwargs = dict(request, **provider.request_kwargs())
+    if not provider.web_search:
+        kwargs.pop("web_search_options", None)
+
+    try:
+        response = await litellm.acompletion(stream=stream, timeout=timeout, **kwargs)
+        if stream:
+            try:
+                first_chunk = await response.__anext__()
+            except BaseException:
+                close = getattr(response, "aclose", None)
+                if close:
+                    await close()
+                raise
+            response = (first_chunk, response)
+    except asyncio.CancelledError:
+        # Lost the race, or the caller gave up; not the provider's fault
+        provider.breaker.cancel()
+        raise
+    except Exception as e:
+        provider.breaker.record_failure()
+        if provider.bucket and isinstance(e, litellm.RateLimitError):
+            provider.bucket.drain()
+        inc("monarch_llm_requests_total", model=provider.name, outcome="error")
+        raise
+
+    provider.breaker.record_success()
+    inc("monarch_llm_requests_total", model=provider.name, outcome="success")
+    return response
+
+async def complete(config: dict, messages: list, temperature: float, web_search: bool = False, stream: bool = False, logger = None, max_tokens: int = None, thinking_tokens: int = 0):
+    """
+    Sends a chat completion through the provider pool, bounded by config['llm']['timeout'].
+    A request still unanswered after llm.hedge_after seconds is duplicated on another provider, and after
+    llm.fallback.after seconds the fallback model is tried as well, without web search. Failed requests move
+    straight on to the next provider. The first answer wins and the rest are cancelled.
+    Args:
+        config: configuration dictionary
+        messages: chat messages to send
+        temperature: sampling temperature
+        web_search: whether to enable web search on providers that allow it
+        stream: return an async iterator of chunks instead of a response
+        max_tokens: most tokens the reply may use, or None for the provider's default
+        thinking_tokens: most tokens a thinking model may spend reasoning, 0 to leave it to the provider
+    Returns:
+        The litellm response, or an async iterator of streamed chunks
+    Raises:
+        asyncio.TimeoutError: if no provider answered within the timeout
+        LLMUnavailableError: if every provider failed or was unavailable
+    """
+    if not _providers:
+        configure_providers(config)
+
+    llm_config = config['llm']
+    timeout = llm_config.get('timeout', 60)
+    hedge_after = llm_config.get('hedge_after')
+    fallback_after = llm_config.get('fallback', {}).get('after', 0)
+
+    request = {"messages": messages, "temperature": temperature}
+    if max_tokens:
+        request["max_tokens"] = max_tokens
+    if thinking_tokens:
+        # Models that cannot think, e.g. a fallback, just drop the budget
+        request["thinking"] = {"type": "enabled", "budget_tokens": thinking_tokens}
+        request["drop_params"] = True
+    if web_search:
+        request["web_search_options"] = {"search_context_size": llm_config.get('web_search', {}).get('context_size', "low")}
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + timeout
+    attempts = {}
+    tried = []
+    errors = []
+    hedged = False
+    fallback_used = _fallback is None
+
+    def launch(provider: Provider) -> None:
+        tried.append(provider)
+        task = asyncio.create_task(_attempt(provider, request, stream, max(0.1, deadline - loop.time())))
+        attempts[task] = provider
+
+    try:
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                inc("monarch_llm_requests_total", model="pool", outcome="timeout")
+                raise asyncio.TimeoutError()
+
+            if not attempts:
+                # Nothing in flight: first request, or every request so far failed, so fail over to an untried provider
+                provider = _choose_provider(tried)
+                if provider is not None:
+                    launch(provider)
+            elif not hedged and hedge_after is not None and now - start >= hedge_after:
+                # Only one hedge per request, so a slow pool costs at most one extra call
+                hedged = True
+                provider = _choose_provider(tried, allow_repeat=True)
+                if provider is not None:
+                    inc("monarch_llm_hedges_total", model=provider.name)
+                    if logger:
+                        logger.info("LLM request slow after %.1fs, hedging on %s", now - start, provider.name)
+                    launch(provider)
+
+            # Bring in the cheaper model when the pool is slow, or has nothing left to try
+            if not fallback_used and (not attempts or (fallback_after and now - start >= fallback_after)):
+                fallback_used = True
+                if _fallback.breaker.allow():
+                    inc("monarch_llm_fallbacks_total")
+                    if logger:
+                        logger.warning("Falling back to %s after %.1fs", _fallback.model, now - start)
+                    launch(_fallback)
+
+            wake_at = deadline
+            if not hedged and hedge_after is not None:
+                wake_at = min(wake_at, max(now, start + hedge_after))
+            if not fallback_used and fallback_after:
+                wake_at = min(wake_at, max(now, start + fallback_after))
+            if not attempts:
+                # Untried providers may only be rate limited; wait for a token rather than failing outright
+                wait = _next_available_in(tried)
+                if wait is None or now + wait >= deadline:
+                    raise LLMUnavailableError("No LLM provider available" + (f": {errors[-1]}" if errors else ""))
+                await asyncio.sleep(wait)
+                continue
+
+            done, _ = await asyncio.wait(attempts, timeout=max(0.0, wake_at - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = attempts.pop(task)
+                if task.exception() is None:
+                    if stream:
+                        first_chunk, rest = task.result()
+                        return _chain_stream(first_chunk, rest)
+                    _record_usage(task.result(), provider.name)
+                    return task.result()
+                errors.append(task.exception())
+                if logger:
+                    logger.warning("LLM request to %s failed: %s", provider.name, task.exception())
+    finally:
+        for task in attempts:
+            task.cancel()
+        if attempts:
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+async def _chain_stream(first_chunk, stream):
+    """Yields the chunk already read from the winning stream, then the rest of it."""
+    try:
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        close = getattr(stream, "aclose", None)
+        if close:
+            await close()
+
+def _record_usage(response, model: str) -> None:
+    """Counts the tokens billed for an LLM response, when the provider reports them."""
+    usage = getattr(response, "usage", None)
+    if usage:
+        inc("monarch_llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+        inc("monarch_llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+def _collect_metrics() -> list:
+    """Reports each provider's breaker state at scrape time: 0 closed, 1 half open, 2 open."""
+    levels = {"closed": 0, "half_open": 1, "open": 2}
+    providers = _providers + ([_fallback] if _fallback else [])
+    return [("monarch_llm_breaker_state", "gauge", {"model": provider.name}, levels[provider.breaker.state]) for provider in providers]
+
+register_collector(_collect_metrics)
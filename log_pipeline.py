@@ -0,0 +1,151 @@
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+import zlib
+
+# Request and server the current task or worker thread is handling, stamped on every record it logs
+_request_id = contextvars.ContextVar("request_id", default="-")
+_guild_id = contextvars.ContextVar("guild_id", default=0)
+
+# Extra for records that dump fact contents, and for records holding full prompts, messages and replies.
+# Both can be sampled with logging.sampling so busy bots keep the lines that matter.
+FACTS = {"sample": "facts"}
+CONTENT = {"sample": "content"}
+
+_listener = None
+_context_filter = None
+
+def bind_request(request_id, guild_id: int = 0) -> None:
+    """
+    Sets the request ID and server stamped on records logged from the current task.
+    Tasks and run_blocking calls started afterwards inherit them.
+    """
+    _request_id.set(str(request_id))
+    _guild_id.set(guild_id or 0)
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+class ContextFilter(logging.Filter):
+    """
+    Stamps records with the request ID and server, and drops sampled records.
+    Runs on the caller's thread when the QueueHandler records the message, which is why the request's contextvars are visible here.
+    Dropped records are never queued or formatted.
+    """
+
+    def __init__(self, sample_rates: dict = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.guild_id = _guild_id.get()
+
+        category = getattr(record, "sample", None)
+        rate = self.sample_rates.get(category, 1.0) if category else 1.0
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        # Decided per request, so a sampled request keeps all of its lines of that kind
+        return zlib.crc32(f"{record.request_id}:{category}".encode()) % 10000 < rate * 10000
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records as they are, leaving message formatting to the listener thread.
+    The stock QueueHandler formats every record on the calling thread, which is the cost this pipeline avoids.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        guild_id = getattr(record, "guild_id", 0)
+        if guild_id:
+            entry["guild_id"] = guild_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def _gzip_rotator(source: str, destination: str) -> None:
+    """Compresses a rotated log file; runs on the listener thread during rollover."""
+    with open(source, 'rb') as f_in, gzip.open(destination, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def start_log_pipeline(logger: logging.Logger, logging_config: dict) -> logging.Logger:
+    """
+    Sends a logger's records through a queue to a background thread that formats, writes and rotates the log file.
+    Args:
+        logger: the logger to attach to
+        logging_config: the logging section of the config
+    Returns:
+        The logger
+    """
+    global _listener, _context_filter
+
+    log_path = os.path.join(logging_config['directory'], logging_config['file_name'])
+    file_handler = logging.handlers.TimedRotatingFileHandler(
+        log_path,
+        when=logging_config['rotation'],
+        backupCount=logging_config['backup_count'],
+        encoding="utf-8"
+    )
+    if logging_config.get('compress', True):
+        file_handler.namer = lambda name: name + ".log.gz"
+        file_handler.rotator = _gzip_rotator
+    else:
+        file_handler.namer = lambda name: name + ".log"
+    if logging_config.get('format', 'json') == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s [%(request_id)s] %(message)s'))
+
+    context_filter = _context_filter = ContextFilter(logging_config.get('sampling'))
+    if not logging_config.get('async', True):
+        file_handler.addFilter(context_filter)
+        logger.addHandler(file_handler)
+        return logger
+
+    stop_log_pipeline()
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(context_filter)
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_log_pipeline)
+    return logger
+
+def configure_sampling(sample_rates: dict) -> None:
+    """Changes the sampling rates of the running pipeline, e.g. after logging.sampling is reloaded."""
+    if _context_filter is not None:
+        _context_filter.sample_rates = sample_rates or {}
+
+def stop_log_pipeline() -> None:
+    """Writes out every queued record and stops the listener thread."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -1,36 +1,41 @@
-import discord
-from config import load_config, get_env_vars
-from database import initialize_database
-from utils import setup_logging
-from message_handlers import handle_message, on_ready_handler
+import argparse
+import os
+from config import load_config, get_env_vars, validate_config
+from bot_runtime import run_worker
+from profile_imports import profile_imports, print_report
+from shard_supervisor import run_supervisor
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Run the Monarch Bot.")
+    parser.add_argument("--config", default="config.yaml", help="configuration file")
+    parser.add_argument("--shards", type=int, default=0, help="total number of Discord shards, 0 to run unsharded")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to spread the shards across")
+    parser.add_argument("--profile-imports", action="store_true", help="report how long startup imports take, then exit")
+    return parser.parse_args()
 
 def main():
     """Main entry point for the Monarch Bot."""
-    # Load configuration
-    config = load_config()
-    env_vars = get_env_vars()
-    
-    # Setup logging
-    logger = setup_logging(config)
+    args = parse_args()
     
-    # Initialize database
-    facts_collection = initialize_database(config)
+    if args.profile_imports:
+        profile = profile_imports("bot_runtime")
+        print_report(profile)
+        return
     
-    # Setup Discord client
-    intents = discord.Intents.default()
-    intents.message_content = True
-    client = discord.Client(intents=intents)
-    
-    @client.event
-    async def on_ready():
-        await on_ready_handler(client, logger)
-    
-    @client.event
-    async def on_message(message):
-        await handle_message(message, client, config, facts_collection, logger)
+    # Load configuration
+    config = load_config(args.config)
+    errors = validate_config(config)
+    if errors:
+        raise SystemExit(f"Invalid {args.config}:\n  " + "\n  ".join(errors))
+    env_vars = get_env_vars()
+    # Absolute, since the bot changes into its own directory before the first reload
+    config_path = os.path.abspath(args.config)
     
-    # Run the bot
-    client.run(env_vars['bot_token'])
+    if args.shards and args.processes > 1:
+        run_supervisor(config, env_vars, args.shards, args.processes, config_path)
+    else:
+        run_worker(config, env_vars, None, args.shards or None, config_path=config_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
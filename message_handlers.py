@@ -1,14 +1,28 @@
+import asyncio
 import discord
 import random
 from chat_engine import generate_response
+from guild_scheduler import guild_lock, submit_mention
+from llm_provider import LLMUnavailableError
+from log_pipeline import bind_request, CONTENT
+from metrics import start_trace, finish_trace
+from streaming import StreamingReply, streaming_enabled
+from trigger_matcher import get_matcher, QOTD, TRIGGER
 from server_manager import (
     get_server_state, 
+    update_server_state,
     can_respond, 
     increment_responses, 
+    refund_response,
     is_qotd_answered_today,
     reset_daily_chat
 )
 
+# Per-message instructions for each kind of reply; replay.py replays traffic with the same wording
+QOTD_PROMPT = "ALL QUESTIONS SHOULD BE ANSWERED WITH A SPECIFIC ANSWER. Do not repeat your response. Answer in 50 words or fewer."
+MENTION_PROMPT = "The user is talking to you directly."
+TRIGGER_PROMPT = "The user's message is not addressed to you, but assert your opinion on what the user said."
+
 async def handle_message(message, client, config, facts_collection, logger):
     """Main message handler for Discord events."""
     
@@ -26,66 +40,114 @@ async def handle_message(message, client, config, facts_collection, logger):
     # Check if bot can respond (daily limits, peasant unrest)
     if not can_respond(server_id, config['bot']['max_responses_per_day']):
         if server_state['peasant_unrest_percentage'] >= 101:
-            server_state['responses_sent'] = config['bot']['max_responses_per_day'] + 1
-            logger.info(f"Peasant unrest percentage is above 100% for server {server_id}. The king is dead.")
+            update_server_state(server_id, responses_sent=config['bot']['max_responses_per_day'] + 1)
+            logger.info("Peasant unrest percentage is above 100%% for server %s. The king is dead.", server_id)
+        return
+    
+    # One pass over the raw text decides whether the message needs any work at all
+    actions = get_matcher(config, server_id).scan(message.content)
+    mentioned = client.user in message.mentions and not message.mention_everyone
+    may_respond_randomly = config['bot']['random_responses'] and len(message.content) > 80
+    if not actions and not mentioned and not may_respond_randomly:
         return
     
     trimmed_message = message.content.lower().replace("*","")
 
-    # Handle Question of the Day
-    if await handle_qotd(message, trimmed_message, server_id, server_state, config, facts_collection, logger):
-        return
+    # Every line logged while handling this message, here or in worker threads, carries its ID
+    bind_request(message.id, server_id)
+    start_trace()
+    try:
+        # Handle Question of the Day
+        if await handle_qotd(message, trimmed_message, actions, server_id, server_state, config, facts_collection, logger):
+            return
 
-    # If QOTD hasn't been answered today, don't respond to other messages
-    if not is_qotd_answered_today(server_id):
-        return
+        # If QOTD hasn't been answered today, don't respond to other messages
+        if not is_qotd_answered_today(server_id):
+            return
 
-    # Handle direct mentions
-    if await handle_mention(message, client, trimmed_message, server_id, server_state, config, facts_collection, logger):
-        return
+        # Handle direct mentions
+        if await handle_mention(message, client, trimmed_message, server_id, server_state, config, facts_collection, logger):
+            return
 
-    # Handle trigger words (if enabled)
-    if config['bot']['random_responses']:
-        await handle_trigger_words(message, trimmed_message, server_id, server_state, config, facts_collection, logger)
+        # Handle trigger words (if enabled)
+        if config['bot']['random_responses']:
+            await handle_trigger_words(message, trimmed_message, actions, server_id, server_state, config, facts_collection, logger)
+    except asyncio.TimeoutError:
+        logger.error("LLM call timed out after %ss for server %s. No response sent.", config['llm'].get('timeout', 60), server_id)
+    except LLMUnavailableError as e:
+        logger.error("No LLM provider could answer for server %s. No response sent. %s", server_id, e)
+    finally:
+        finish_trace(logger, "message %s in server %s", message.id, server_id)
 
-async def handle_qotd(message, trimmed_message, server_id, server_state, config, facts_collection, logger):
+async def handle_qotd(message, trimmed_message, actions, server_id, server_state, config, facts_collection, logger):
     """Handle Question of the Day messages."""
-    if ("qotd:" in trimmed_message or "question of the day:" in trimmed_message) and not is_qotd_answered_today(server_id):
-        logger.info(f"Received QOTD message: {trimmed_message}")
+    if QOTD not in actions:
+        return False
+    
+    async with guild_lock(server_id):
+        # Another QOTD may have been answered while this one waited for the lock
+        if is_qotd_answered_today(server_id):
+            return False
+        
+        logger.info("Received QOTD message: %s", trimmed_message, extra=CONTENT)
         
         # Reset daily state
         reset_daily_chat(server_id)
-        logger.info(f"Peasant Unrest Percentage: {server_state['peasant_unrest_percentage']}")
+        logger.info("Peasant Unrest Percentage: %s", server_state['peasant_unrest_percentage'])
 
         async with message.channel.typing():
-            answer = generate_response(
+            reply = StreamingReply(message.reply, config)
+            answer = await generate_response(
                 trimmed_message, 
                 config,
                 facts_collection,
                 server_id,
-                "ALL QUESTIONS SHOULD BE ANSWERED WITH A SPECIFIC ANSWER. Do not repeat your response. Answer in 50 words or fewer.", 
+                QOTD_PROMPT,
                 message.author.display_name,
                 server_state,
-                logger
+                logger,
+                reply.update if streaming_enabled(config) else None
             )
-            await message.reply(answer)
+            await reply.finish(answer)
         
-        logger.info(f"Sent QOTD response: {answer}")
-        logger.info(f"Initialized new chat history for server {server_id} ({message.guild.name})")
-        logger.info(f"Responses remaining: {config['bot']['max_responses_per_day'] - server_state['responses_sent']} / {config['bot']['max_responses_per_day']}.") 
-        return True
-    
-    return False
+        logger.info("Sent QOTD response: %s", answer, extra=CONTENT)
+        logger.info("Initialized new chat history for server %s (%s)", server_id, message.guild.name)
+        logger.info("Responses remaining: %s / %s.", config['bot']['max_responses_per_day'] - server_state['responses_sent'], config['bot']['max_responses_per_day'])
+    return True
 
 async def handle_mention(message, client, trimmed_message, server_id, server_state, config, facts_collection, logger):
-    """Handle direct mentions of the bot."""
+    """Handle direct mentions of the bot. Mentions arriving together are answered in one batched reply."""
     if message.mentions and client.user in message.mentions and not message.mention_everyone:
-        logger.info(f"Received mention: {message.content}")
+        logger.info("Received mention: %s", message.content, extra=CONTENT)
+        
+        async def process_batch(batch):
+            await respond_to_mentions(batch, server_id, server_state, config, facts_collection, logger)
         
-        # Check if this is the last response of the day
-        if server_state["responses_sent"] == config['bot']['max_responses_per_day']:
+        await submit_mention(server_id, (message, trimmed_message), process_batch, config['bot'].get('coalesce_window', 0.0))
+        return True
+    
+    return False
+
+async def respond_to_mentions(batch, server_id, server_state, config, facts_collection, logger):
+    """
+    Answer a batch of (message, trimmed_message) mentions with one LLM call. Runs while the server's lock is held.
+    The daily response slot is reserved before the LLM call, so concurrent mentions can never exceed the limit.
+    """
+    max_responses = config['bot']['max_responses_per_day']
+    message = batch[-1][0]
+    bind_request("+".join([str(mention.id) for mention, _ in batch]), server_id)
+    
+    if server_state["responses_sent"] > max_responses:
+        logger.info("Dropping %s mention(s) for server %s, daily limit reached.", len(batch), server_id)
+        return
+    
+    # Check if this is the last response of the day
+    if server_state["responses_sent"] == max_responses:
+        increment_responses(server_id)
+        try:
             async with message.channel.typing():
-                answer = generate_response(
+                reply = StreamingReply(message.channel.send, config)
+                answer = await generate_response(
                     "", 
                     config,
                     facts_collection,
@@ -93,64 +155,95 @@ async def handle_mention(message, client, trimmed_message, server_id, server_sta
                     "Offer a short, vague excuse for why you must leave for the rest of the day, and give a goodbye.",
                     "",
                     server_state,
-                    logger
+                    logger,
+                    reply.update if streaming_enabled(config) else None
                 )
-                await message.channel.send(answer)
-            
-            logger.info(f"Sent farewell response: {answer}")
-            logger.info(f"Responses remaining: {config['bot']['max_responses_per_day'] - server_state['responses_sent']} / {config['bot']['max_responses_per_day']}. Day complete.")
-            increment_responses(server_id)
-            return True
-
+                await reply.finish(answer)
+        except Exception:
+            refund_response(server_id)
+            raise
+        
+        logger.info("Sent farewell response: %s", answer, extra=CONTENT)
+        logger.info("Responses remaining: 0 / %s. Day complete.", max_responses)
+        return
+    
+    username = message.author.display_name
+    if len(batch) == 1:
+        prompt_message = batch[0][1]
+        additional_prompt = MENTION_PROMPT
+    else:
+        # Fold the burst into one user turn so the king answers everyone at once
+        prompt_message = "\n".join([f"{mention.author.display_name}: {trimmed}" for mention, trimmed in batch])
+        additional_prompt = "Several users are talking to you directly. Answer them together in one reply."
+        logger.info("Coalesced %s mentions into one response for server %s", len(batch), server_id)
+    
+    increment_responses(server_id)
+    try:
         async with message.channel.typing():
-            answer = generate_response(
-                trimmed_message, 
+            reply = StreamingReply(message.reply, config)
+            answer = await generate_response(
+                prompt_message, 
                 config,
                 facts_collection,
                 server_id,
-                "The user is talking to you directly.", 
-                message.author.display_name,
+                additional_prompt, 
+                username,
                 server_state,
-                logger
+                logger,
+                reply.update if streaming_enabled(config) else None,
+                coalesced=len(batch) > 1
             )
-            await message.reply(answer)
-        
-        logger.info(f"Sent mention response: {answer}")
-        increment_responses(server_id)
-        logger.info(f"Responses remaining: {config['bot']['max_responses_per_day'] - server_state['responses_sent']} / {config['bot']['max_responses_per_day']}.")
-        return True
+            await reply.finish(answer)
+    except Exception:
+        refund_response(server_id)
+        raise
     
-    return False
+    logger.info("Sent mention response: %s", answer, extra=CONTENT)
+    logger.info("Responses remaining: %s / %s.", max_responses - server_state['responses_sent'], max_responses)
 
-async def handle_trigger_words(message, trimmed_message, server_id, server_state, config, facts_collection, logger):
+async def handle_trigger_words(message, trimmed_message, actions, server_id, server_state, config, facts_collection, logger):
     """Handle trigger word responses (when random_responses is enabled)."""
-    trigger_words = config['triggers']['words']
     max_responses = config['bot']['max_responses_per_day']
     
     # Check if message contains trigger words or long messages can randomly trigger
     should_respond = (
-        any(word in message.content.lower() for word in trigger_words) or 
+        TRIGGER in actions or 
         (len(message.content) > 80 and random.randint(1, 100) <= 2 * (max_responses - server_state["responses_sent"]))
     )
     
-    if should_respond:
-        async with message.channel.typing():
-            answer = generate_response(
-                trimmed_message, 
-                config,
-                facts_collection,
-                server_id,
-                "The user's message is not addressed to you, but assert your opinion on what the user said.", 
-                message.author.display_name,
-                server_state,
-                logger
-            )
-            await message.reply(answer) 
+    # Unprompted replies are optional, so skip them while the server is busy rather than queueing
+    lock = guild_lock(server_id)
+    if not should_respond or lock.locked():
+        return
+    
+    async with lock:
+        # Leave the last response of the day for a farewell to a direct mention
+        if server_state["responses_sent"] >= max_responses:
+            return
         
-        logger.info(f"Sent trigger response: {answer}")
         increment_responses(server_id)
-        logger.info(f"Responses remaining: {max_responses - server_state['responses_sent']} / {max_responses}.")
+        try:
+            async with message.channel.typing():
+                reply = StreamingReply(message.reply, config)
+                answer = await generate_response(
+                    trimmed_message, 
+                    config,
+                    facts_collection,
+                    server_id,
+                    TRIGGER_PROMPT,
+                    message.author.display_name,
+                    server_state,
+                    logger,
+                    reply.update if streaming_enabled(config) else None
+                )
+                await reply.finish(answer) 
+        except Exception:
+            refund_response(server_id)
+            raise
+    
+    logger.info("Sent trigger response: %s", answer, extra=CONTENT)
+    logger.info("Responses remaining: %s / %s.", max_responses - server_state['responses_sent'], max_responses)
 
 async def on_ready_handler(client, logger):
     """Handle bot ready event."""
-    logger.info(f"Logged in as {client.user} (ID: {client.user.id})")
\ No newline at end of file
+    logger.info("Logged in as %s (ID: %s)", client.user, client.user.id)
\ No newline at end of file
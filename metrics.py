@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager, nullcontext
+
+# Latency buckets in seconds, from cache hits up to slow web-search completions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_enabled = False
+_tracing = False
+_counters = {}
+_gauges = {}
+_histograms = {}
+# Callbacks that report values at scrape time, so nothing is paid on the hot path
+_collectors = []
+# Spans recorded for the request running in the current task, when tracing is on
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_NULL_TIMER = nullcontext()
+# HTTP paths served by the local endpoint, path -> (render function, content type)
+_routes = {}
+
+def configure_metrics(config: dict) -> None:
+    """Turns metrics and tracing on or off from config['metrics']."""
+    global _enabled, _tracing
+
+    metrics_config = config.get('metrics', {})
+    _enabled = metrics_config.get('enabled', False)
+    _tracing = metrics_config.get('trace', False)
+
+def metrics_enabled() -> bool:
+    """Returns True if metrics are being recorded."""
+    return _enabled
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Adds to a counter."""
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Sets a gauge to the given value."""
+    if not _enabled:
+        return
+    _gauges[(name, tuple(sorted(labels.items())))] = value
+
+def observe(name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels) -> None:
+    """Records a value in a histogram."""
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+
+    for index, bound in enumerate(histogram["buckets"]):
+        if value <= bound:
+            histogram["counts"][index] += 1
+            break
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+def register_collector(collector) -> None:
+    """
+    Registers a callback run on every scrape.
+    The callback returns a list of (name, type, labels, value) tuples, where type is "counter" or "gauge".
+    """
+    _collectors.append(collector)
+
+def timed(stage: str):
+    """
+    Times a stage of request handling as monarch_stage_seconds{stage=...}, and as a trace span when tracing.
+    Returns a shared no-op context manager when both are off.
+    """
+    if not _enabled and not _tracing:
+        return _NULL_TIMER
+    return _timer(stage)
+
+@contextmanager
+def _timer(stage: str):
+    """Measures the wrapped block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("monarch_stage_seconds", elapsed, stage=stage)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+def start_trace() -> None:
+    """Starts collecting spans for the request running in the current task."""
+    if _tracing:
+        _current_trace.set([])
+
+def finish_trace(logger = None, description: str = "", *args) -> list:
+    """
+    Stops collecting spans for the current request and logs them.
+    Args:
+        logger: Logger instance
+        description: %-style description of the request, only formatted when a trace is logged
+        args: values for the description
+    Returns:
+        A list of (stage, seconds) spans, empty when tracing is off
+    """
+    spans = _current_trace.get()
+    if spans is None:
+        return []
+    _current_trace.set(None)
+
+    if logger and spans:
+        timings = ", ".join([f"{stage}={elapsed * 1000:.1f}ms" for stage, elapsed in spans])
+        logger.info("Trace " + description + ": %s", *args, timings)
+    return spans
+
+def render_metrics() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    types = {}
+    samples = []
+
+    for (name, labels), value in _counters.items():
+        types[name] = "counter"
+        samples.append((name, labels, value))
+    for (name, labels), value in _gauges.items():
+        types[name] = "gauge"
+        samples.append((name, labels, value))
+    for collector in _collectors:
+        for name, metric_type, labels, value in collector():
+            types[name] = metric_type
+            samples.append((name, tuple(sorted(labels.items())), value))
+
+    for name in sorted(types):
+        lines.append(f"# TYPE {name} {types[name]}")
+        for sample_name, labels, value in samples:
+            if sample_name == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    histogram_names = sorted({name for name, _ in _histograms})
+    for name in histogram_names:
+        lines.append(f"# TYPE {name} histogram")
+        for (histogram_name, labels), histogram in _histograms.items():
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+def _format_labels(labels: tuple) -> str:
+    """Formats label pairs as {key="value",...}."""
+    if not labels:
+        return ""
+    pairs = ",".join([f'{key}="{_escape_label(value)}"' for key, value in labels])
+    return "{" + pairs + "}"
+
+def _escape_label(value) -> str:
+    """Escapes a label value for the exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def register_route(path: str, render, content_type: str = "application/json") -> None:
+    """Serves the string returned by render() on GET requests to path."""
+    _routes[path] = (render, content_type)
+
+async def start_metrics_server(config: dict, logger = None):
+    """
+    Serves GET /metrics over plain HTTP on the configured local address.
+    Returns:
+        The asyncio server, or None when metrics are disabled
+    """
+    if not _enabled:
+        return None
+
+    metrics_config = config.get('metrics', {})
+    return await start_http_server(metrics_config.get('host', '127.0.0.1'), metrics_config.get('port', 9108), logger)
+
+async def start_http_server(host: str, port: int, logger = None):
+    """
+    Serves every registered route over plain HTTP.
+    Returns:
+        The asyncio server
+    """
+    server = await asyncio.start_server(_handle_http, host, port)
+
+    if logger:
+        paths = ", ".join(sorted(_routes))
+        logger.info("Serving %s on http://%s:%s", paths, host, port)
+    return server
+
+async def _handle_http(reader, writer) -> None:
+    """Answers a single HTTP request."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers, the request body is never needed
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        route = _routes.get(parts[1].split("?")[0]) if len(parts) >= 2 and parts[0] == "GET" else None
+        if route:
+            render, content_type = route
+            status, body = "200 OK", render()
+        else:
+            status, body, content_type = "404 Not Found", "Not found\n", "text/plain; charset=utf-8"
+
+        payload = body.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+register_route("/metrics", render_metrics, "text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,113 @@
+import os
+from dataclasses import dataclass, field
+import yaml
+
+DEFAULT_PERSONA = "monarch"
+# Files are relative to the bot's directory
+_base_directory = os.path.dirname(os.path.abspath(__file__))
+
+@dataclass(slots=True, frozen=True)
+class Persona:
+    """
+    One character the bot can play: its prompt templates and where its facts live.
+    Personas share the LLM provider pool, the embedding model and the query embedding cache; only these differ.
+    """
+
+    name: str
+    display_name: str
+    collection_name: str
+    seed_file: str
+    writer_instructions: str
+    background: str
+    daily_context: str
+    # The year it is in the character's world; the month and day follow the real date
+    year: int = 1462
+    # Where the prompt text was read from, so a config reload can notice it changing
+    prompt_file: str = ""
+    # The part of the system prompt that never changes, sent first so providers can cache it
+    static_prefix: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "static_prefix", self.writer_instructions + self.background)
+
+# Personas by name, the name used by servers without their own, and per-server choices
+_personas = {}
+_default_persona = DEFAULT_PERSONA
+_guild_personas = {}
+
+def _resolve(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(_base_directory, path)
+
+def load_persona(name: str, settings: dict, collection_name: str) -> Persona:
+    """
+    Reads a persona's prompt file.
+    Args:
+        name: the persona's name in the registry
+        settings: its entry under config['personas']['characters']
+        collection_name: facts collection to use if the entry does not name one
+    """
+    prompt_file = _resolve(settings.get('prompt_file', f"characters/{name}.yaml"))
+    with open(prompt_file, 'r', encoding="utf-8") as f:
+        prompts = yaml.safe_load(f)
+
+    return Persona(
+        name=name,
+        display_name=settings.get('display_name') or prompts.get('display_name', name),
+        collection_name=settings.get('collection_name', collection_name),
+        seed_file=_resolve(settings.get('seed_file', f"characters/{name}_facts.yaml")),
+        writer_instructions=prompts['writer_instructions'],
+        background=prompts['background'],
+        daily_context=prompts['daily_context'],
+        year=settings.get('year', prompts.get('year', 1462)),
+        prompt_file=prompt_file
+    )
+
+def configure_personas(config: dict) -> None:
+    """
+    Loads every persona under config['personas']['characters'], and which servers use which.
+    Without a personas section, the bot plays King Maximilian VII from the database.collection_name collection.
+    """
+    global _personas, _default_persona, _guild_personas
+
+    personas_config = config.get('personas') or {}
+    characters = personas_config.get('characters') or {DEFAULT_PERSONA: {}}
+    default_collection = config['database']['collection_name']
+
+    default_persona = personas_config.get('default', next(iter(characters)))
+    if default_persona not in characters:
+        raise ValueError(f"Default persona '{default_persona}' is not under personas.characters")
+
+    personas = {}
+    for name, settings in characters.items():
+        # Each persona gets its own collection unless told otherwise; the default keeps the configured one
+        collection_name = default_collection if name == default_persona else f"{default_collection}_{name}"
+        personas[name] = load_persona(name, settings or {}, collection_name)
+
+    guild_personas = {int(server_id): name for server_id, name in (personas_config.get('guilds') or {}).items()}
+    unknown = set(guild_personas.values()) - set(personas)
+    if unknown:
+        raise ValueError(f"personas.guilds uses unknown personas: {', '.join(sorted(unknown))}")
+
+    _personas, _default_persona, _guild_personas = personas, default_persona, guild_personas
+
+def _ensure_configured() -> None:
+    """Loads the built-in persona when nothing has configured the registry, e.g. in one-off scripts."""
+    if not _personas:
+        configure_personas({"database": {"collection_name": "facts"}})
+
+def persona_for(server_id: int) -> Persona:
+    """Returns the persona a server talks to."""
+    _ensure_configured()
+    return _personas[_guild_personas.get(server_id, _default_persona)]
+
+def get_persona(name: str) -> Persona:
+    _ensure_configured()
+    return _personas[name]
+
+def default_persona() -> Persona:
+    _ensure_configured()
+    return _personas[_default_persona]
+
+def all_personas() -> list:
+    _ensure_configured()
+    return list(_personas.values())
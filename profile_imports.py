@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def profile_imports(module: str = "main") -> dict:
+    """
+    Imports a module in a fresh interpreter with -X importtime and collects the timings.
+    Args:
+        module: the module to import, e.g. "main"
+    Returns:
+        A dict with the wall time, the module's cumulative import time, and per-module self/cumulative times in ms
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                # -X importtime indents nested imports by two spaces per level
+                "depth": (len(indent) - 1) // 2
+            })
+
+    top_level = next((entry for entry in modules if entry["module"] == module), None)
+    return {
+        "module": module,
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": top_level["cumulative_ms"] if top_level else None,
+        "modules": modules
+    }
+
+def print_report(profile: dict, top: int = 20) -> None:
+    """Prints the slowest imports by cumulative and by self time."""
+    print(f"Importing {profile['module']}: {profile['import_ms']} ms ({profile['wall_ms']} ms including interpreter start)")
+    print(f"{len(profile['modules'])} modules imported")
+
+    print("\nSlowest top-level imports (cumulative):")
+    top_level = [entry for entry in profile['modules'] if entry["depth"] <= 1 and entry["module"] != profile['module']]
+    for entry in sorted(top_level, key=lambda entry: entry["cumulative_ms"], reverse=True)[:top]:
+        print(f"  {entry['cumulative_ms']:9.1f} ms  {entry['module']}")
+
+    print("\nSlowest modules (self):")
+    for entry in sorted(profile['modules'], key=lambda entry: entry["self_ms"], reverse=True)[:top]:
+        print(f"  {entry['self_ms']:9.1f} ms  {entry['module']}")
+
+def record_profile(profile: dict, path: str, top: int = 20) -> None:
+    """Appends a summary line to a JSON lines file, so startup cost can be compared across releases."""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        ).stdout.strip()
+    except OSError:
+        revision = ""
+
+    slowest = sorted(profile['modules'], key=lambda entry: entry["cumulative_ms"], reverse=True)
+    summary = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "module": profile['module'],
+        "wall_ms": profile['wall_ms'],
+        "import_ms": profile['import_ms'],
+        "module_count": len(profile['modules']),
+        "slowest": [{"module": entry["module"], "cumulative_ms": entry["cumulative_ms"]} for entry in slowest[:top]]
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(summary) + "\n")
+
+def main():
+    """Command line entry point for the import time profile."""
+    parser = argparse.ArgumentParser(description="Report how long the bot's modules take to import.")
+    parser.add_argument("--module", default="main", help="module to import")
+    parser.add_argument("--top", type=int, default=20, help="number of modules to list")
+    parser.add_argument("--output", help="append a summary to this JSON lines file")
+    args = parser.parse_args()
+
+    profile = profile_imports(args.module)
+    print_report(profile, args.top)
+    if args.output:
+        record_profile(profile, args.output, args.top)
+
+if __name__ == "__main__":
+    main()
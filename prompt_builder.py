@@ -0,0 +1,66 @@
+import functools
+from daily_scheduler import current_dates, guild_timezone
+from personas import Persona, persona_for
+
+@functools.lru_cache(maxsize=1024)
+def render_daily_context(template: str, present_date: str, year: int, peasant_unrest: int) -> str:
+    """Renders a persona's per-day part of the system prompt, memoised per template, date and unrest level."""
+    return template.format(
+        peasant_unrest_percentage=peasant_unrest,
+        past_date=f"{year}{present_date[4:]}",
+        present_date=present_date
+    )
+
+def precompute_daily_contexts(timezone_name: str, unrest_levels: set, personas: list) -> int:
+    """
+    Renders the daily context for today's date at the given unrest levels, and one level higher for the next QOTD,
+    for each persona, so the first message after the rollover finds them cached.
+    Returns:
+        Number of contexts rendered
+    """
+    present_date, _ = current_dates(timezone_name)
+    levels = set(unrest_levels) | {level + 1 for level in unrest_levels}
+    for persona in personas:
+        for level in levels:
+            render_daily_context(persona.daily_context, present_date, persona.year, level)
+    return len(levels) * len(personas)
+
+def build_system_messages(config: dict, peasant_unrest: int, relevant_facts: list, additional_prompt: str, active_summary: str, server_id: int = 0, persona: Persona = None) -> list:
+    """
+    Builds the system messages for a request: the persona's static prefix followed by the dynamic context.
+    When config['llm']['prompt_caching'] is on, the prefix is sent as its own message marked for provider-side context caching.
+    Gemini does not allow cached content alongside tools, so the marker is left off while web search is enabled.
+    Args:
+        config: configuration dictionary
+        peasant_unrest: the server's peasant unrest percentage
+        relevant_facts: list of (id, fact) tuples to include
+        additional_prompt: any additional instructions for this message only
+        active_summary: summary of the conversation so far
+        server_id: the id of the discord server, whose timezone decides the dates
+        persona: the character to play, or None for the server's persona
+    Returns:
+        A list of system messages
+    """
+    persona = persona or persona_for(server_id)
+    present_date, _ = current_dates(guild_timezone(server_id))
+    dynamic_prompt = render_daily_context(persona.daily_context, present_date, persona.year, peasant_unrest)
+
+    if relevant_facts:
+        facts_text = "\n".join([f"- {fact_content}" for _, fact_content in relevant_facts])
+        dynamic_prompt += f"\nYour advisor thought this information may be relevant:\n{facts_text}"
+
+    dynamic_prompt += f"\n{additional_prompt}"
+
+    if active_summary:
+        dynamic_prompt += f"\nSummary of the messages so far: {active_summary}"
+
+    if config['llm'].get('prompt_caching', False) and not config['llm'].get('web_search', {}).get('enabled', True):
+        return [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": persona.static_prefix, "cache_control": {"type": "ephemeral"}}]
+            },
+            {"role": "system", "content": dynamic_prompt},
+        ]
+
+    return [{"role": "system", "content": persona.static_prefix + dynamic_prompt}]
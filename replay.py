@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import yaml
+from benchmark import percentile
+from config import load_config
+
+def load_conversations(path: str, turns_per_conversation: int = 5) -> list:
+    """
+    Reads recorded messages from a requests.jsonl style file and groups them into conversations.
+    Each line is a JSON object; "content", "body" or "title" is the message text. Optional fields:
+    "guild_id" or "conversation" to group turns (otherwise every turns_per_conversation lines form one),
+    "kind" ("qotd", "mention" or "trigger", by default a QOTD followed by mentions),
+    and "expected_facts", fact IDs a good retrieval would find, for recall.
+    Returns:
+        A list of conversations, each a list of {"text", "kind", "expected_facts"} turns
+    """
+    conversations = {}
+    with open(path, 'r') as f:
+        for index, line in enumerate(line for line in f if line.strip()):
+            record = json.loads(line)
+            text = record.get('content') or record.get('body') or record.get('title')
+            if not text:
+                continue
+            key = record.get('guild_id') or record.get('conversation') or f"replay-{index // turns_per_conversation}"
+            turns = conversations.setdefault(str(key), [])
+            turns.append({
+                "text": text,
+                "kind": record.get('kind') or ("qotd" if not turns else "mention"),
+                "expected_facts": [str(fact_id) for fact_id in record.get('expected_facts', [])]
+            })
+    return list(conversations.values())
+
+def parse_variant(spec: str) -> tuple:
+    """
+    Parses a variant given as "name:section.key=value,section.key=value".
+    Values are read as YAML, so numbers, booleans and lists keep their types.
+    Returns:
+        A tuple (name, {"section.key": value})
+    """
+    name, _, assignments = spec.partition(":")
+    overrides = {}
+    for assignment in filter(None, assignments.split(",")):
+        key, _, value = assignment.partition("=")
+        overrides[key.strip()] = yaml.safe_load(value)
+    return name.strip(), overrides
+
+def apply_overrides(config: dict, overrides: dict) -> dict:
+    """Returns a copy of the config with dotted keys such as "database.relevance_threshold" replaced."""
+    config = copy.deepcopy(config)
+    for dotted_key, value in overrides.items():
+        section = config
+        *parents, key = dotted_key.split(".")
+        for parent in parents:
+            section = section.setdefault(parent, {})
+        section[key] = value
+    return config
+
+def _prepare_config(config: dict, facts_source: str) -> dict:
+    """Points a variant's config at a private copy of the facts and turns off everything that writes or waits."""
+    config = copy.deepcopy(config)
+    db_path = tempfile.mkdtemp(prefix="monarch-replay-")
+    if facts_source and os.path.isdir(facts_source):
+        shutil.copytree(facts_source, db_path, dirs_exist_ok=True)
+    config['database']['path'] = db_path
+    config['database'].pop('host', None)
+    config.setdefault('bot', {})['fast_startup'] = False
+    config['bot']['auto_learn_facts'] = False
+    # Cached answers skip prompt building and the LLM call, which would hide the variant's real cost
+    config.setdefault('response_cache', {})['enabled'] = False
+    config.setdefault('fact_versions', {})['enabled'] = False
+    config.setdefault('state', {})['backend'] = "memory"
+    # The stub answers instantly, so per-provider rate limits would only measure the limiter
+    config['llm'].pop('providers', None)
+    return config
+
+def _replay_task(task: tuple) -> dict:
+    """
+    Replays a slice of conversations for one variant in a fresh worker process.
+    Returns:
+        The raw samples, merged by the parent into the variant's report
+    """
+    variant, config, facts_source, conversations, stub_latency = task
+
+    # Imported here so every worker process starts from a clean copy of the bot's module state
+    import chat_engine
+    import server_manager
+    from database import initialize_database
+    from message_handlers import MENTION_PROMPT, QOTD_PROMPT, TRIGGER_PROMPT
+    from stub_llm import install_stub_llm
+
+    config = _prepare_config(config, facts_source)
+    install_stub_llm(stub_latency, 0.0)
+    server_manager.init_state_store(config)
+    facts_collection = initialize_database(config)
+    prompts = {"qotd": QOTD_PROMPT, "mention": MENTION_PROMPT, "trigger": TRIGGER_PROMPT}
+
+    samples = {
+        "variant": variant,
+        "messages": 0,
+        "retrieval_ms": [],
+        "facts_found": [],
+        "recall": [],
+        "prompt_tokens": [],
+        "latency_ms": [],
+        "elapsed_seconds": 0.0,
+    }
+
+    # Record what the engine retrieves and how big each prompt is
+    retrieved = []
+    choose_relevant_facts = chat_engine.choose_relevant_facts
+    def recorded_choose_relevant_facts(*query_args):
+        start = time.perf_counter()
+        facts = choose_relevant_facts(*query_args)
+        samples["retrieval_ms"].append((time.perf_counter() - start) * 1000)
+        retrieved.append(facts)
+        return facts
+    chat_engine.choose_relevant_facts = recorded_choose_relevant_facts
+
+    record_prompt_tokens = chat_engine.record_prompt_tokens
+    def recorded_prompt_tokens(server_id, tokens, logger = None):
+        samples["prompt_tokens"].append(tokens)
+        record_prompt_tokens(server_id, tokens, logger)
+    chat_engine.record_prompt_tokens = recorded_prompt_tokens
+
+    async def replay():
+        start = time.perf_counter()
+        for conversation_index, turns in enumerate(conversations):
+            server_id = conversation_index + 1
+            server_state = server_manager.get_server_state(server_id, f"Replay {server_id}")
+            for turn in turns:
+                retrieved.clear()
+                message_start = time.perf_counter()
+                await chat_engine.generate_response(
+                    turn["text"].lower().replace("*", ""),
+                    config,
+                    facts_collection,
+                    server_id,
+                    prompts.get(turn["kind"], MENTION_PROMPT),
+                    "replay",
+                    server_state
+                )
+                samples["latency_ms"].append((time.perf_counter() - message_start) * 1000)
+                samples["messages"] += 1
+
+                found = {fact_id for facts in retrieved for fact_id, _ in facts}
+                samples["facts_found"].append(len(found))
+                if turn["expected_facts"]:
+                    samples["recall"].append(len(found & set(turn["expected_facts"])) / len(turn["expected_facts"]))
+        samples["elapsed_seconds"] = time.perf_counter() - start
+
+    try:
+        asyncio.run(replay())
+    finally:
+        shutil.rmtree(config['database']['path'], ignore_errors=True)
+    return samples
+
+def _summarise(values: list) -> dict:
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+def summarise_variant(task_samples: list) -> dict:
+    """Merges the samples of every slice of one variant into its report."""
+    merged = {key: [] for key in ("retrieval_ms", "facts_found", "recall", "prompt_tokens", "latency_ms")}
+    messages = 0
+    busy_seconds = 0.0
+    for samples in task_samples:
+        messages += samples["messages"]
+        busy_seconds += samples["elapsed_seconds"]
+        for key in merged:
+            merged[key].extend(samples[key])
+
+    return {
+        "messages": messages,
+        "retrieval_hit_rate": sum(1 for found in merged["facts_found"] if found) / messages if messages else 0.0,
+        "facts_per_message": sum(merged["facts_found"]) / messages if messages else 0.0,
+        "recall": sum(merged["recall"]) / len(merged["recall"]) if merged["recall"] else None,
+        # Replies served from the response cache never build a prompt
+        "llm_calls": len(merged["prompt_tokens"]),
+        "prompt_tokens_total": sum(merged["prompt_tokens"]),
+        "prompt_tokens": _summarise(merged["prompt_tokens"]),
+        "retrieval_ms": _summarise(merged["retrieval_ms"]),
+        "latency_ms": _summarise(merged["latency_ms"]),
+        # Per process, so the figure does not depend on how many processes ran
+        "messages_per_second": messages / busy_seconds if busy_seconds else 0.0,
+    }
+
+def run_replay(config: dict, variants: list, conversations: list, processes: int, slices: int, facts_source: str = None, stub_latency: float = 0.0) -> dict:
+    """
+    Replays the conversations under every variant, split into slices run in parallel across a process pool.
+    Args:
+        config: base configuration dictionary
+        variants: list of (name, overrides) tuples
+        conversations: conversations from load_conversations
+        processes: worker processes in the pool
+        slices: slices each variant's conversations are split into
+        facts_source: facts database directory each worker copies, or None to seed the initial facts
+        stub_latency: simulated LLM latency in seconds
+    Returns:
+        {variant_name: report}
+    """
+    slices = max(1, min(slices, len(conversations)))
+    tasks = []
+    for name, overrides in variants:
+        variant_config = apply_overrides(config, overrides)
+        for index in range(slices):
+            tasks.append((name, variant_config, facts_source, conversations[index::slices], stub_latency))
+
+    results = {name: [] for name, _ in variants}
+    # Spawned and used once each, so no variant inherits another's caches, indexes or server state
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=processes, maxtasksperchild=1) as pool:
+        for samples in pool.imap_unordered(_replay_task, tasks):
+            results[samples["variant"]].append(samples)
+
+    return {name: summarise_variant(results[name]) for name, _ in variants}
+
+def print_report(reports: dict) -> None:
+    """Prints each variant's report, with changes relative to the first variant."""
+    baseline = next(iter(reports.values()), None)
+    for name, report in reports.items():
+        recall = f"{report['recall']:.2f}" if report['recall'] is not None else "n/a"
+        print(f"{name}: {report['messages']} messages, {report['llm_calls']} LLM calls, {report['messages_per_second']:.1f} msg/s per process")
+        print(f"  retrieval  hit rate {report['retrieval_hit_rate']:.2%}  facts/message {report['facts_per_message']:.2f}  "
+              f"recall {recall}  p95 {report['retrieval_ms']['p95']:.2f} ms")
+        print(f"  prompt     mean {report['prompt_tokens']['mean']:.0f}  p95 {report['prompt_tokens']['p95']:.0f}  "
+              f"max {report['prompt_tokens']['max']:.0f}  total {report['prompt_tokens_total']} tokens")
+        print(f"  latency    p50 {report['latency_ms']['p50']:.2f}  p95 {report['latency_ms']['p95']:.2f}  p99 {report['latency_ms']['p99']:.2f} ms")
+        if report is not baseline and baseline['prompt_tokens_total'] and baseline['messages_per_second']:
+            print(f"  vs {next(iter(reports))}: prompt tokens {report['prompt_tokens_total'] / baseline['prompt_tokens_total'] - 1:+.1%}, "
+                  f"hit rate {report['retrieval_hit_rate'] - baseline['retrieval_hit_rate']:+.2%}, "
+                  f"throughput {report['messages_per_second'] / baseline['messages_per_second'] - 1:+.1%}")
+
+def main():
+    """Command line entry point for offline replay and evaluation."""
+    parser = argparse.ArgumentParser(description="Replay recorded conversations through retrieval and response generation with a stub LLM, per config variant.")
+    parser.add_argument("traffic", help="requests.jsonl style file of recorded messages")
+    parser.add_argument("--config", default="config.yaml", help="base configuration file")
+    parser.add_argument("--variant", action="append", default=[], help='variant as "name:section.key=value,...", may be repeated')
+    parser.add_argument("--variants", help="YAML file mapping variant names to {\"section.key\": value} overrides")
+    parser.add_argument("--no-baseline", action="store_true", help="do not replay the unmodified config first")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--slices", type=int, help="slices each variant is split into, defaults to --processes")
+    parser.add_argument("--turns-per-conversation", type=int, default=5, help="turns grouped into one conversation when records carry no guild_id")
+    parser.add_argument("--facts-db", help="facts database directory to replay against, defaults to database.path")
+    parser.add_argument("--seed-facts", action="store_true", help="replay against the initial facts only")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub LLM latency in seconds")
+    parser.add_argument("--json", help="also write the reports to this JSON file")
+    args = parser.parse_args()
+
+    # Paths on the command line are relative to the caller's directory
+    traffic_path = os.path.abspath(args.traffic)
+    json_path = os.path.abspath(args.json) if args.json else None
+    variants_path = os.path.abspath(args.variants) if args.variants else None
+    facts_db = os.path.abspath(args.facts_db) if args.facts_db else None
+    config = load_config(args.config)
+    # Paths in the config are relative to the bot's directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    variants = [] if args.no_baseline else [("baseline", {})]
+    if variants_path:
+        with open(variants_path, 'r') as f:
+            variants.extend((name, overrides or {}) for name, overrides in (yaml.safe_load(f) or {}).items())
+    variants.extend(parse_variant(spec) for spec in args.variant)
+    if not variants:
+        parser.error("nothing to replay, give a --variant or drop --no-baseline")
+
+    facts_source = None if args.seed_facts else (facts_db or os.path.abspath(config['database']['path']))
+    conversations = load_conversations(traffic_path, args.turns_per_conversation)
+    reports = run_replay(config, variants, conversations, args.processes, args.slices or args.processes, facts_source, args.llm_latency)
+    print_report(reports)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import math
+import re
+
+# Discord rejects messages longer than this
+DISCORD_MESSAGE_LIMIT = 2000
+# Rough characters per token of English text, for turning a length limit into a token budget
+CHARS_PER_TOKEN = 4
+
+# Blank lines collapse ("\n\n" -> "\n") and '*' and '"' are dropped, in one left-to-right pass.
+# The unmatched group of the second alternative substitutes as "", so no Python callback runs per match.
+_CLEANUP = re.compile(r'(\n)\n|[*"]')
+# End of a sentence: terminal punctuation, optionally closed by a bracket or quote, then whitespace or the end
+_SENTENCE_END = re.compile(r'[.!?…][)\]\'’]*(?=\s|$)')
+
+def sanitize_response(text: str) -> str:
+    """Cleans an LLM reply in a single pass, with the same result as the old chained replace calls."""
+    return _CLEANUP.sub(r"\1", text)
+
+def response_token_budget(config: dict) -> int:
+    """
+    Returns the max_tokens to request for a reply: llm.max_response_tokens if set, otherwise enough tokens
+    for llm.max_response_length characters with some headroom, so the model is not paid to write text that gets cut.
+    Models that think before answering count their reasoning against max_tokens, so llm.reasoning_tokens is added on top;
+    complete() sends the same number as the thinking budget, so the reasoning cannot eat the reply's share.
+    """
+    llm_config = config['llm']
+    if llm_config.get('max_response_tokens'):
+        return llm_config['max_response_tokens']
+    return math.ceil(llm_config['max_response_length'] / CHARS_PER_TOKEN * 1.25) + llm_config.get('reasoning_tokens', 0)
+
+def reasoning_budget(config: dict) -> int:
+    """Returns the thinking budget to send with a reply request, 0 for models that do not think."""
+    return config['llm'].get('reasoning_tokens', 0)
+
+def truncate_response(text: str, max_length: int, cut_off: bool = False) -> str:
+    """
+    Shortens a reply to at most max_length characters, at the last sentence end that keeps at least half of it.
+    Without one, cuts at the last word and adds "...".
+    A reply the model stopped at its token limit (cut_off) always ends at its last sentence end, even if it fits.
+    """
+    if len(text) <= max_length and not cut_off:
+        return text
+
+    half = min(len(text), max_length) // 2
+    window = text[:max_length]
+    sentence_end = 0
+    for match in _SENTENCE_END.finditer(window):
+        sentence_end = match.end()
+    if sentence_end and (cut_off or sentence_end >= half):
+        return window[:sentence_end]
+
+    window = text[:max(0, max_length - 3)]
+    word_end = window.rfind(" ")
+    if word_end >= half:
+        window = window[:word_end]
+    return window.rstrip(" ,;:-") + "..."
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list:
+    """
+    Splits text into parts Discord will accept, preferring line breaks, then sentence ends, then spaces.
+    Returns:
+        A list of non-empty parts, oldest first
+    """
+    parts = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = window.rfind("\n")
+        if cut < limit // 2:
+            cut = max((match.end() for match in _SENTENCE_END.finditer(window)), default=0)
+        if cut < limit // 2:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return [part for part in parts if part.strip()] or [text]
@@ -0,0 +1,130 @@
+import itertools
+import time
+from collections import OrderedDict
+import numpy as np
+from database import embed_text
+from metrics import register_collector
+
+# All cache entries in least recently used order, entry_id -> entry
+_entries = OrderedDict()
+# Entry ids grouped by cache key, so lookups only compare questions asked in the same context
+_entries_by_key = {}
+_entry_ids = itertools.count()
+# Cache effectiveness counters
+cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "expirations": 0,
+}
+
+def build_cache_key(config: dict, additional_prompt: str, peasant_unrest: int, facts: list, persona_name: str = "", username: str = "") -> tuple:
+    """
+    Builds the exact-match part of the cache key. Questions only match other questions with the same key.
+    Only turns without any chat history or summary are cached, since the key does not cover the conversation.
+    Args:
+        config: configuration dictionary
+        additional_prompt: the per-message instructions given to the LLM
+        peasant_unrest: the server's peasant unrest percentage
+        facts: (id, content) tuples of the facts pulled into the prompt; the content is part of the key
+            because servers can hold their own versions of the same fact
+        persona_name: the character answering, so personas never share answers
+        username: the asker, since answers often address them by name
+    Returns:
+        A hashable cache key
+    """
+    bucket_size = config['response_cache'].get('unrest_bucket_size', 10)
+    return (persona_name, username, additional_prompt, peasant_unrest // bucket_size, tuple(sorted(facts)))
+
+def embed_question(question: str) -> np.ndarray:
+    """
+    Embeds a question with the facts collection's embedding model and normalises it for cosine similarity.
+    The embedding comes from the query cache fact retrieval uses, so the message is only embedded once.
+    """
+    embedding = np.asarray(embed_text(question), dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else embedding
+
+def get_cached_response(config: dict, cache_key: tuple, embedding: np.ndarray) -> str:
+    """
+    Finds a cached answer for a near-duplicate question with the same cache key.
+    Args:
+        config: configuration dictionary
+        cache_key: key from build_cache_key
+        embedding: normalised question embedding from embed_question
+    Returns:
+        The cached answer, or None on a miss
+    """
+    cache_config = config['response_cache']
+    entry_ids = _entries_by_key.get(cache_key)
+    if entry_ids:
+        _expire(entry_ids, cache_config.get('ttl', 86400))
+
+    if not entry_ids:
+        cache_stats["misses"] += 1
+        return None
+
+    candidates = list(entry_ids)
+    similarities = np.stack([_entries[entry_id]["embedding"] for entry_id in candidates]) @ embedding
+    best = int(np.argmax(similarities))
+
+    if similarities[best] < cache_config.get('similarity_threshold', 0.92):
+        cache_stats["misses"] += 1
+        return None
+
+    entry_id = candidates[best]
+    _entries.move_to_end(entry_id)
+    cache_stats["hits"] += 1
+    return _entries[entry_id]["answer"]
+
+def cache_response(config: dict, cache_key: tuple, embedding: np.ndarray, answer: str) -> None:
+    """
+    Stores an answer, evicting the least recently used entries beyond the size cap.
+    Args:
+        config: configuration dictionary
+        cache_key: key from build_cache_key
+        embedding: normalised question embedding from embed_question
+        answer: the answer to reuse for near-duplicate questions
+    """
+    entry_id = next(_entry_ids)
+    _entries[entry_id] = {
+        "key": cache_key,
+        "embedding": embedding,
+        "answer": answer,
+        "created_at": time.monotonic(),
+    }
+    _entries_by_key.setdefault(cache_key, set()).add(entry_id)
+
+    max_entries = config['response_cache'].get('max_entries', 1000)
+    while len(_entries) > max_entries:
+        _remove(next(iter(_entries)))
+        cache_stats["evictions"] += 1
+
+def clear_response_cache() -> None:
+    """Drops every cached answer."""
+    _entries.clear()
+    _entries_by_key.clear()
+
+def _expire(entry_ids: set, ttl: float) -> None:
+    """Removes entries older than the TTL from one cache key."""
+    cutoff = time.monotonic() - ttl
+    for entry_id in [entry_id for entry_id in entry_ids if _entries[entry_id]["created_at"] < cutoff]:
+        _remove(entry_id)
+        cache_stats["expirations"] += 1
+
+def _remove(entry_id: int) -> None:
+    """Removes one entry from both indexes."""
+    entry = _entries.pop(entry_id)
+    entry_ids = _entries_by_key[entry["key"]]
+    entry_ids.discard(entry_id)
+    if not entry_ids:
+        del _entries_by_key[entry["key"]]
+
+def _collect_metrics() -> list:
+    """Reports the cache counters at scrape time."""
+    samples = [("monarch_response_cache_entries", "gauge", {}, len(_entries))]
+    for event, count in cache_stats.items():
+        samples.append(("monarch_response_cache_events_total", "counter", {"event": event}, count))
+    return samples
+
+register_collector(_collect_metrics)
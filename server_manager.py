@@ -1,22 +1,49 @@
-from utils import today
+import asyncio
+import time
+from daily_scheduler import guild_date, guild_timezone
+from guild_scheduler import release_guild
+from guild_state import GuildState
+from metrics import inc, register_collector
+from state_store import create_state_backend
+from trigger_matcher import forget_matcher
+from utils import run_blocking
 
-# Dictionary to store server-specific details
+# Dictionary to store server-specific details, a write-behind cache over the state backend
 servers = {}
+# Servers changed since the last flush to the backend
+_dirty_servers = set()
+# Persistent state backend, None keeps state in memory only
+_backend = None
 
-def get_server_state(server_id: int, server_name: str) -> dict:
-    """Get or initialize server state."""
+def init_state_store(config: dict, logger = None) -> None:
+    """Open the configured state backend. Server state is then loaded lazily, one guild at a time."""
+    global _backend
+    
+    _backend = create_state_backend(config)
+    if logger:
+        logger.info("Using %s server state backend", config.get('state', {}).get('backend', 'sqlite'))
+
+def get_server_state(server_id: int, server_name: str) -> GuildState:
+    """Get or initialize server state. Servers evicted for inactivity are reloaded from the backend."""
     global servers
     
     if server_id not in servers:
-        servers[server_id] = {
-            "last_answered_question_date": "",
-            "responses_sent": 0,
-            "chat_history": [],
-            "peasant_unrest_percentage": 0,
-            "active_summary": "",
-        }
+        # Primary key lookup, cheap enough to do inline the first time a guild is seen
+        stored_state = _backend.load(server_id) if _backend else None
+        if stored_state:
+            server_state = GuildState.from_dict(stored_state)
+        else:
+            server_state = GuildState()
+            _dirty_servers.add(server_id)
+        # Servers loaded after a midnight they missed (evicted, or the bot was down) catch up here
+        today = guild_date(server_id)
+        if server_state.last_reset_date != today:
+            _roll_over(server_id, server_state, today)
+        servers[server_id] = server_state
     
-    return servers[server_id]
+    server_state = servers[server_id]
+    server_state.last_active = time.monotonic()
+    return server_state
 
 def update_server_state(server_id: int, **kwargs) -> None:
     """Update server state with provided key-value pairs."""
@@ -26,22 +53,37 @@ def update_server_state(server_id: int, **kwargs) -> None:
         for key, value in kwargs.items():
             if key in servers[server_id]:
                 servers[server_id][key] = value
+        _dirty_servers.add(server_id)
 
 def reset_daily_chat(server_id: int) -> None:
     """Reset chat history and increment peasant unrest for new QOTD."""
     global servers
     
     if server_id in servers:
-        servers[server_id]['chat_history'] = []
+        servers[server_id]['chat_history'].clear()
+        servers[server_id]['active_summary'] = ""
         servers[server_id]['peasant_unrest_percentage'] += 1
-        servers[server_id]["last_answered_question_date"] = today()
+        servers[server_id]["last_answered_question_date"] = guild_date(server_id)
+        _dirty_servers.add(server_id)
 
 def add_to_chat_history(server_id: int, role: str, content: str) -> None:
     """Add a message to the server's chat history."""
     global servers
     
     if server_id in servers:
-        servers[server_id]['chat_history'].append({"role": role, "content": content})
+        servers[server_id]['chat_history'].append(role, content)
+        _dirty_servers.add(server_id)
+
+def pop_oldest_chat_turns(server_id: int, count: int) -> list:
+    """Remove and return the oldest messages from the server's chat history."""
+    global servers
+    
+    if server_id not in servers:
+        return []
+    
+    evicted = servers[server_id]['chat_history'].popleft(count)
+    _dirty_servers.add(server_id)
+    return evicted
 
 def can_respond(server_id: int, max_responses: int) -> bool:
     """Check if bot can respond based on daily limits."""
@@ -63,6 +105,15 @@ def increment_responses(server_id: int) -> None:
     
     if server_id in servers:
         servers[server_id]["responses_sent"] += 1
+        _dirty_servers.add(server_id)
+
+def refund_response(server_id: int) -> None:
+    """Give back a response reserved with increment_responses when no reply was sent."""
+    global servers
+    
+    if server_id in servers and servers[server_id]["responses_sent"] > 0:
+        servers[server_id]["responses_sent"] -= 1
+        _dirty_servers.add(server_id)
 
 def is_qotd_answered_today(server_id: int) -> bool:
     """Check if QOTD has been answered today."""
@@ -71,4 +122,119 @@ def is_qotd_answered_today(server_id: int) -> bool:
     if server_id not in servers:
         return False
     
-    return servers[server_id]["last_answered_question_date"] == today()
\ No newline at end of file
+    return servers[server_id]["last_answered_question_date"] == guild_date(server_id)
+
+def _roll_over(server_id: int, server_state: GuildState, today: str) -> None:
+    """Starts a new day for a server: the response limit resets and yesterday's conversation is dropped."""
+    server_state.responses_sent = 0
+    server_state.chat_history.clear()
+    server_state.active_summary = ""
+    server_state['last_reset_date'] = today
+    _dirty_servers.add(server_id)
+
+def rollover_servers(timezones: set) -> dict:
+    """
+    Runs the midnight rollover for every loaded server whose day runs in one of the given timezones.
+    Peasant unrest still rises when the day's QOTD is answered.
+    Returns:
+        The unrest levels of the rolled over servers, as {timezone: set of levels}
+    """
+    unrest_levels = {}
+    for server_id, server_state in servers.items():
+        timezone_name = guild_timezone(server_id)
+        if timezone_name not in timezones:
+            continue
+        today = guild_date(server_id)
+        if server_state.last_reset_date != today:
+            _roll_over(server_id, server_state, today)
+            unrest_levels.setdefault(timezone_name, set()).add(server_state.peasant_unrest_percentage)
+    return unrest_levels
+
+async def flush_server_state(logger = None) -> int:
+    """
+    Write every changed server state to the backend in one batch.
+    Returns:
+        Number of servers written
+    """
+    global _dirty_servers
+    
+    if _backend is None or not _dirty_servers:
+        return 0
+    
+    # Snapshot on the event loop thread so the worker thread never sees a half-updated state
+    dirty_servers, _dirty_servers = _dirty_servers, set()
+    states = {}
+    for server_id in dirty_servers:
+        if server_id in servers:
+            states[server_id] = servers[server_id].to_dict()
+    
+    try:
+        await run_blocking(_backend.save_many, states)
+    except Exception as e:
+        _dirty_servers |= dirty_servers
+        if logger:
+            logger.error("Error saving server state: %s", e)
+        return 0
+    
+    return len(states)
+
+def evict_idle_servers(idle_after: float, logger = None) -> int:
+    """
+    Drops servers with no messages for idle_after seconds from memory; they reload from the backend when next seen.
+    Only servers already flushed and with no work in flight are evicted.
+    Returns:
+        Number of servers evicted
+    """
+    global servers
+    
+    if _backend is None or not idle_after:
+        return 0
+    
+    cutoff = time.monotonic() - idle_after
+    idle_servers = [
+        server_id for server_id, server_state in servers.items()
+        if server_state.last_active < cutoff and server_id not in _dirty_servers
+    ]
+    evicted = 0
+    for server_id in idle_servers:
+        if release_guild(server_id):
+            del servers[server_id]
+            forget_matcher(server_id)
+            evicted += 1
+    
+    if evicted:
+        inc("monarch_servers_evicted_total", evicted)
+        if logger:
+            logger.info("Evicted %s idle servers from memory, %s still loaded", evicted, len(servers))
+    return evicted
+
+async def run_state_flusher(config: dict, logger = None) -> None:
+    """Periodically flush changed server state, and evict idle servers, until cancelled."""
+    interval = config.get('state', {}).get('flush_interval', 5)
+    idle_after = config.get('state', {}).get('evict_idle_after', 3600)
+    
+    while True:
+        await asyncio.sleep(interval)
+        await flush_server_state(logger)
+        evict_idle_servers(idle_after, logger)
+
+async def close_state_store(logger = None) -> None:
+    """Flush any remaining changes and close the backend."""
+    global _backend
+    
+    if _backend is None:
+        return
+    
+    await flush_server_state(logger)
+    _backend.close()
+    _backend = None
+
+def _collect_metrics() -> list:
+    """Reports per-server unrest and daily responses at scrape time."""
+    samples = [("monarch_servers_loaded", "gauge", {}, len(servers))]
+    for server_id, server_state in servers.items():
+        samples.append(("monarch_peasant_unrest_percent", "gauge", {"guild": server_id}, server_state['peasant_unrest_percentage']))
+        samples.append(("monarch_responses_sent_today", "gauge", {"guild": server_id}, server_state['responses_sent']))
+    return samples
+
+register_collector(_collect_metrics)
@@ -0,0 +1,165 @@
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import time
+import discord
+from bot_runtime import run_worker
+from metrics import register_route, start_http_server
+from utils import setup_logging, lazy_import
+
+chromadb = lazy_import("chromadb")
+
+def assign_shards(shard_count: int, processes: int) -> list:
+    """Spreads shard IDs across worker processes round-robin."""
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+def start_fact_server(config: dict, logger) -> subprocess.Popen:
+    """
+    Starts a local ChromaDB server over the configured fact database, so every worker shares one writer.
+    Skipped when config['database']['host'] already points at a server.
+    Returns:
+        The server process, or None if an external server is used
+    """
+    db_config = config['database']
+    if db_config.get('host'):
+        return None
+
+    chroma_command = shutil.which("chroma")
+    if not chroma_command:
+        raise RuntimeError("Sharding across processes needs the 'chroma' command to serve the fact database, or database.host set to a running server")
+
+    port = config.get('sharding', {}).get('fact_server_port', 8001)
+    path = os.path.abspath(db_config['path'])
+    process = subprocess.Popen([chroma_command, "run", "--path", path, "--host", "127.0.0.1", "--port", str(port)])
+
+    db_config['host'] = "127.0.0.1"
+    db_config['port'] = port
+
+    # Wait for the server to answer before any worker connects
+    client = chromadb.HttpClient(host="127.0.0.1", port=port)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            client.heartbeat()
+            break
+        except Exception:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError("Fact database server did not start")
+            time.sleep(0.5)
+
+    logger.info("Started shared fact database server on port %s (pid %s)", port, process.pid)
+    return process
+
+def run_shard_worker(config: dict, env_vars: dict, shard_ids: list, shard_count: int, shard_status, worker_index: int, config_path: str = None) -> None:
+    """Entry point of a worker process."""
+    config = copy.deepcopy(config)
+    # Each worker gets its own log file and metrics port so processes never fight over them
+    config['logging']['file_name'] = f"worker{worker_index}-{config['logging']['file_name']}"
+    if 'metrics' in config:
+        config['metrics']['port'] = config['metrics'].get('port', 9108) + worker_index
+    if config.get('admin', {}).get('socket_port'):
+        config['admin']['socket_port'] += worker_index
+
+    run_worker(config, env_vars, shard_ids, shard_count, shard_status, worker_index, config_path)
+
+def shard_health(shard_status, shard_count: int, interval: float) -> dict:
+    """
+    Builds the per-shard health view.
+    A shard is stale when its worker has not reported for three intervals.
+    """
+    now = time.time()
+    shards = {}
+    for shard_id in range(shard_count):
+        status = dict(shard_status.get(shard_id, {}))
+        status["stale"] = not status or now - status.get("updated_at", 0) > interval * 3
+        shards[shard_id] = status
+
+    healthy = sum(1 for status in shards.values() if status.get("ready") and not status["stale"])
+    return {"shard_count": shard_count, "healthy_shards": healthy, "shards": shards}
+
+async def supervise(config: dict, env_vars: dict, shard_count: int, processes: int, logger, config_path: str = None) -> None:
+    """Starts the workers, restarts any that die, and serves the health view until cancelled."""
+    sharding_config = config.get('sharding', {})
+    interval = sharding_config.get('health_interval', 15)
+
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    shard_status = manager.dict()
+    assignments = assign_shards(shard_count, processes)
+    workers = {}
+
+    def start(worker_index: int):
+        process = context.Process(
+            target=run_shard_worker,
+            args=(config, env_vars, assignments[worker_index], shard_count, shard_status, worker_index, config_path),
+            name=f"monarch-worker-{worker_index}",
+            daemon=False
+        )
+        process.start()
+        workers[worker_index] = process
+        logger.info("Started worker %s (pid %s) with shards %s", worker_index, process.pid, assignments[worker_index])
+
+    for worker_index in range(processes):
+        start(worker_index)
+
+    register_route("/health", lambda: json.dumps(shard_health(shard_status, shard_count, interval), indent=2))
+    health_server = await start_http_server(
+        sharding_config.get('health_host', '127.0.0.1'),
+        sharding_config.get('health_port', 9100),
+        logger
+    )
+
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            for worker_index, process in list(workers.items()):
+                if not process.is_alive():
+                    logger.error("Worker %s exited with code %s, restarting", worker_index, process.exitcode)
+                    start(worker_index)
+
+            health = shard_health(shard_status, shard_count, interval)
+            logger.info("Shard health: %s / %s shards healthy", health['healthy_shards'], shard_count)
+            for shard_id, status in health['shards'].items():
+                if status["stale"] or not status.get("ready"):
+                    logger.warning("Shard %s unhealthy: %s", shard_id, status)
+    finally:
+        health_server.close()
+        # SIGINT lets each worker drain its fact queue and flush server state before exiting
+        for process in workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in workers.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        manager.shutdown()
+
+def run_supervisor(config: dict, env_vars: dict, shard_count: int, processes: int, config_path: str = None) -> None:
+    """
+    Runs the bot as several worker processes, each owning a slice of the shards and of the server state.
+    Args:
+        config: configuration dictionary
+        env_vars: environment variables from get_env_vars
+        shard_count: total number of Discord shards
+        processes: number of worker processes
+        config_path: absolute path of the config file each worker reloads changes from, or None to never reload
+    """
+    discord.utils.setup_logging()
+    logger = setup_logging(config)
+    processes = min(processes, shard_count)
+    fact_server = start_fact_server(config, logger)
+
+    try:
+        asyncio.run(supervise(config, env_vars, shard_count, processes, logger, config_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if fact_server:
+            fact_server.terminate()
+            fact_server.wait(timeout=30)
@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class StateBackend:
+    """Storage interface for per-server state. Implementations must be safe to call from worker threads."""
+
+    def load(self, server_id: int) -> dict:
+        """Returns the stored state for a server, or None if it has never been saved."""
+        raise NotImplementedError
+
+    def save_many(self, states: dict) -> None:
+        """Writes a batch of {server_id: state} in one atomic operation."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Releases any resources held by the backend."""
+        pass
+
+class MemoryStateBackend(StateBackend):
+    """Keeps state in memory only. Useful for tests and benchmarks; nothing survives a restart."""
+
+    def __init__(self, config: dict):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, server_id: int) -> dict:
+        with self._lock:
+            state = self._states.get(server_id)
+        return json.loads(state) if state else None
+
+    def save_many(self, states: dict) -> None:
+        encoded = {server_id: json.dumps(state) for server_id, state in states.items()}
+        with self._lock:
+            self._states.update(encoded)
+
+class SQLiteStateBackend(StateBackend):
+    """Stores each server's state as a JSON row in a SQLite database running in WAL mode."""
+
+    def __init__(self, config: dict):
+        path = config.get('state', {}).get('path', './db/state.sqlite3')
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL keeps readers from blocking the writer and survives a crash mid-write
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # Sharded workers share this file; wait for another process's write instead of failing
+        self._connection.execute("PRAGMA busy_timeout=5000")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS server_state ("
+            "server_id INTEGER PRIMARY KEY, "
+            "state TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def load(self, server_id: int) -> dict:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state FROM server_state WHERE server_id = ?", (server_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, states: dict) -> None:
+        now = time.time()
+        rows = [(server_id, json.dumps(state), now) for server_id, state in states.items()]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    "INSERT INTO server_state (server_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(server_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    rows
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+# Available backends by config name
+BACKENDS = {
+    "sqlite": SQLiteStateBackend,
+    "memory": MemoryStateBackend,
+}
+
+def create_state_backend(config: dict) -> StateBackend:
+    """Creates the state backend named by config['state']['backend']."""
+    backend_name = config.get('state', {}).get('backend', 'sqlite')
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown state backend '{backend_name}', expected one of {', '.join(BACKENDS)}")
+
+    return BACKENDS[backend_name](config)
@@ -0,0 +1,112 @@
+import time
+from reply_format import sanitize_response, split_message, truncate_response
+
+class StreamSanitizer:
+    """
+    Cleans a streamed response chunk by chunk, giving the same result as cleaning the full text at once
+    with sanitize_response and truncate_response. Keeps one character past max_length, so it can tell the reply ran over.
+    """
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        self.truncated = False
+        self._parts = []
+        self._length = 0
+        self._pending_newline = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Adds a raw chunk from the LLM.
+        Returns:
+            The cleaned text added by this chunk
+        """
+        if self._pending_newline:
+            chunk = "\n" + chunk
+            self._pending_newline = False
+        # An odd run of newlines at the end may pair with a newline at the start of the next chunk
+        trailing_newlines = len(chunk) - len(chunk.rstrip("\n"))
+        if trailing_newlines % 2:
+            chunk = chunk[:-1]
+            self._pending_newline = True
+
+        return self._append(sanitize_response(chunk))
+
+    def finish(self, cut_off: bool = False) -> str:
+        """
+        Flushes anything held back and returns the complete cleaned response, cut at a sentence end if it ran over
+        or the model stopped at its token limit (cut_off).
+        """
+        if self._pending_newline:
+            self._pending_newline = False
+            self._append("\n")
+        return truncate_response(self.text, self.max_length, cut_off)
+
+    @property
+    def text(self) -> str:
+        """The cleaned text so far."""
+        return "".join(self._parts)
+
+    def _append(self, cleaned: str) -> str:
+        """Keeps cleaned text up to one character past max_length and notes when the reply runs over."""
+        if not cleaned or self.truncated:
+            return ""
+
+        room = self.max_length + 1 - self._length
+        if len(cleaned) >= room:
+            cleaned = cleaned[:room]
+            self.truncated = True
+
+        self._parts.append(cleaned)
+        self._length += len(cleaned)
+        return cleaned
+
+class StreamingReply:
+    """
+    Posts a reply as soon as the first text is available, then edits it as more arrives.
+    Edits are spaced at least edit_interval seconds apart to stay inside Discord's rate limits.
+    Text past Discord's message limit continues in further messages instead of being dropped.
+    Without any partial updates, finish() simply sends the final answer.
+    """
+
+    def __init__(self, send, config: dict):
+        self._send = send
+        self._edit_interval = config['llm'].get('streaming', {}).get('edit_interval', 1.5)
+        self._messages = []
+        self._contents = []
+        self._last_edit = 0.0
+
+    async def update(self, text: str) -> None:
+        """Shows the partial response, throttled to the edit interval."""
+        if not text.strip():
+            return
+
+        parts = split_message(text)
+        if self._messages and len(parts) == len(self._messages) and time.monotonic() - self._last_edit < self._edit_interval:
+            return
+        if parts == self._contents:
+            return
+
+        await self._show(parts)
+        self._last_edit = time.monotonic()
+
+    async def finish(self, text: str) -> None:
+        """Shows the final response."""
+        await self._show(split_message(text))
+
+    async def _show(self, parts: list) -> None:
+        """Edits the messages already posted where their part changed and sends the rest."""
+        for index, part in enumerate(parts):
+            if index >= len(self._messages):
+                self._messages.append(await self._send(part))
+                self._contents.append(part)
+            elif part != self._contents[index]:
+                await self._messages[index].edit(content=part)
+                self._contents[index] = part
+        # The final text can need fewer messages than the partial text did, once it is cut at a sentence end
+        while len(self._messages) > len(parts):
+            await self._messages.pop().delete()
+            self._contents.pop()
+
+def streaming_enabled(config: dict) -> bool:
+    """Returns True if replies should be streamed."""
+    return config['llm'].get('streaming', {}).get('enabled', False)
@@ -0,0 +1,60 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+import litellm
+
+STUB_REPLY = (
+    "Hark, a fine question! Today I watched the jesters of the future on my black box, "
+    "and I declare the answer is blood pudding, as it always is."
+)
+
+def _stub_latency(latency: float, jitter: float) -> float:
+    """Draws a simulated response time in seconds."""
+    return max(0.0, random.gauss(latency, jitter))
+
+def _stub_response(messages: list, reply: str) -> SimpleNamespace:
+    """Builds an object shaped like a litellm ModelResponse."""
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+    completion_tokens = len(reply) // 4
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=reply, role="assistant"), finish_reason="stop")],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+    )
+
+async def _stub_stream(reply: str, latency: float, jitter: float, chunk_size: int = 16):
+    """Yields the reply in chunks shaped like litellm streaming chunks, spreading the latency across them."""
+    chunks = [reply[i:i + chunk_size] for i in range(0, len(reply), chunk_size)] or [""]
+    # Roughly a third of the time goes to the first token, the rest is spread over the remaining chunks
+    await asyncio.sleep(_stub_latency(latency, jitter) / 3)
+    for index, chunk in enumerate(chunks):
+        if index:
+            await asyncio.sleep(latency * 2 / 3 / len(chunks))
+        finish_reason = "stop" if index == len(chunks) - 1 else None
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk, role="assistant"), finish_reason=finish_reason)])
+
+def install_stub_llm(latency: float = 0.5, jitter: float = 0.1, reply: str = STUB_REPLY) -> None:
+    """
+    Replaces litellm's completion functions with a local stub so the bot can run offline.
+    Every module calls litellm.completion/acompletion through the litellm module, so patching it here is enough.
+    Args:
+        latency: mean simulated response time in seconds
+        jitter: standard deviation of the simulated response time
+        reply: text every completion returns
+    """
+    async def acompletion(model: str = "", messages: list = None, stream: bool = False, **kwargs):
+        if stream:
+            return _stub_stream(reply, latency, jitter)
+        await asyncio.sleep(_stub_latency(latency, jitter))
+        return _stub_response(messages or [], reply)
+
+    def completion(model: str = "", messages: list = None, **kwargs):
+        time.sleep(_stub_latency(latency, jitter))
+        return _stub_response(messages or [], reply)
+
+    litellm.acompletion = acompletion
+    litellm.completion = completion
@@ -0,0 +1,99 @@
+import re
+
+QOTD = "qotd"
+TRIGGER = "trigger"
+
+# Prefixes that mark a Question of the Day. Markdown asterisks may appear anywhere inside them.
+QOTD_PREFIXES = ["qotd:", "question of the day:"]
+
+# Compiled matchers for servers with their own guild_words, rebuilt when that server's word list changes
+_matchers = {}
+# Compiled matcher shared by every server without guild_words
+_default_matcher = None
+
+def _trie_pattern(words: list) -> str:
+    """
+    Builds a regex alternation from a prefix trie of the words, e.g. ["king", "kingdom", "knight"] -> "k(?:ing(?:dom)?|night)".
+    Shared prefixes are only tried once, so matching cost grows with the message rather than the number of words.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node: dict) -> str:
+        optional = "" in node
+        branches = [re.escape(char) + to_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if optional else pattern
+
+    return to_pattern(trie)
+
+def _qotd_pattern(prefix: str) -> str:
+    """Matches a QOTD prefix with any number of '*' between its characters, like the old strip-then-search did."""
+    return r"\**".join(re.escape(char) for char in prefix)
+
+class TriggerMatcher:
+    """
+    Finds which actions a message asks for in one pass over its text: a QOTD prefix and/or a trigger word.
+    Trigger words only match whole words, case-insensitively.
+    """
+
+    def __init__(self, words: list):
+        branches = ["(?P<qotd>" + "|".join(_qotd_pattern(prefix) for prefix in QOTD_PREFIXES) + ")"]
+        words = sorted(set(word.lower() for word in words if word))
+        if words:
+            branches.append(r"(?P<trigger>(?<!\w)" + _trie_pattern(words) + r"(?!\w))")
+        self._pattern = re.compile("|".join(branches), re.IGNORECASE)
+
+    def scan(self, text: str) -> set:
+        """
+        Returns:
+            The set of action kinds found in the text (QOTD, TRIGGER), empty for most messages
+        """
+        found = set()
+        for match in self._pattern.finditer(text):
+            found.add(QOTD if match.group("qotd") is not None else TRIGGER)
+            if len(found) == 2:
+                break
+        return found
+
+def get_matcher(config: dict, server_id: int = 0) -> TriggerMatcher:
+    """
+    Returns the compiled matcher for a server, built once from config['triggers']['words'] plus any words
+    listed for that server under config['triggers']['guild_words']. Servers without their own words share one matcher.
+    Call clear_matchers after changing either.
+    """
+    global _default_matcher
+
+    matcher = _matchers.get(server_id)
+    if matcher is not None:
+        return matcher
+
+    triggers = config.get('triggers', {})
+    guild_words = triggers.get('guild_words') or {}
+    server_words = guild_words.get(server_id, guild_words.get(str(server_id)))
+    if not server_words:
+        if _default_matcher is None:
+            _default_matcher = TriggerMatcher(list(triggers.get('words', [])))
+        return _default_matcher
+
+    matcher = _matchers[server_id] = TriggerMatcher(list(triggers.get('words', [])) + list(server_words))
+    return matcher
+
+def forget_matcher(server_id: int) -> None:
+    """Drops a server's own matcher, e.g. when the server is evicted from memory."""
+    _matchers.pop(server_id, None)
+
+def clear_matchers() -> None:
+    """Drops every compiled matcher, so the next message rebuilds them from the current config."""
+    global _default_matcher
+
+    _matchers.clear()
+    _default_matcher = None
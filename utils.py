@@ -1,21 +1,92 @@
 import os
+import sys
+import asyncio
+import functools
+import importlib
+import contextvars
 import logging
-import logging.handlers
-from datetime import datetime
-import pytz
+from concurrent.futures import ThreadPoolExecutor
+from daily_scheduler import current_dates
+from log_pipeline import start_log_pipeline
+
+# Shared bounded thread pool for blocking work (ChromaDB queries, disk I/O)
+_executor = None
 
 def today() -> str:
-    """Returns today's date in YYYY-MM-DD format."""
-    return datetime.now(pytz.timezone("US/Eastern")).strftime("%Y-%m-%d")
+    """Returns today's date in the default timezone in YYYY-MM-DD format."""
+    return current_dates()[0]
 
 def old_times_today() -> str:
     """Returns today's date in the year 1462 in YYYY-MM-DD format."""
-    old_date = "1462-"
-    old_date += datetime.now(pytz.timezone("US/Eastern")).strftime("%m-%d")
-    return old_date
+    return current_dates()[1]
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported when one of its attributes is first used.
+    Keeps heavy dependencies off the startup path; importlib's module locks make the first use thread safe.
+    """
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            module = importlib.import_module(self._name)
+            object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute: str, value) -> None:
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}' ({'loaded' if self._module is not None else 'not loaded'})>"
+
+def lazy_import(name: str):
+    """
+    Returns the module if it is already imported, otherwise a LazyModule that imports it on first use.
+    Args:
+        name: the module to import, e.g. "litellm"
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+def configure_executor(max_workers: int) -> None:
+    """Create the shared thread pool used by run_blocking with the given size."""
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="monarch-worker")
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking function on the shared thread pool so the event loop stays responsive.
+    Args:
+        func: the blocking callable
+        args, kwargs: arguments passed through to func
+    Returns:
+        Whatever func returns
+    """
+    global _executor
+
+    if _executor is None:
+        configure_executor(4)
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context into the worker thread, so its log lines keep the request ID
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
 
 def setup_logging(config: dict) -> logging.Logger:
-    """Setup logging configuration."""
+    """
+    Setup logging configuration.
+    Records are queued and written, rotated and compressed by a background thread, so logging never waits on disk.
+    """
     logging_config = config['logging']
     
     # Create logs directory if it doesn't exist
@@ -23,16 +94,5 @@ def setup_logging(config: dict) -> logging.Logger:
         os.makedirs(logging_config['directory'])
     
     logger = logging.getLogger('discord')
-    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s')
-    
-    log_path = os.path.join(logging_config['directory'], logging_config['file_name'])
-    handler = logging.handlers.TimedRotatingFileHandler(
-        log_path, 
-        when=logging_config['rotation'], 
-        backupCount=logging_config['backup_count']
-    )
-    handler.namer = lambda name: name + ".log"
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    
-    return logger
\ No newline at end of file
+    logger.setLevel(logging_config.get('level', 'INFO'))
+    return start_log_pipeline(logger, logging_config)